@@ -0,0 +1,244 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import MATE_BOUND, MATE_SCORE, Searcher, SearchLimits
+from pgn import read_games, start_position, write_game
+from position import Position
+from position_db import to_signed
+from rules import get_termination, move_to_san, play_san
+
+logger = logging.getLogger(__name__)
+
+#Batch analysis of games: every position is searched with a fixed node or time budget, the loss of every move
+#is the difference between the best score before the move and the score after it.
+#Positions are searched in a process pool. A position that is reached in more than one game (openings!) is
+#only searched once, the results are kept in a cache keyed by the Zobrist hash that can be saved between runs.
+
+#Loss of a move in centipawns from which it is marked
+INACCURACY = 50
+MISTAKE = 100
+BLUNDER = 300
+
+ANNOTATIONS = ((BLUNDER, '??', 'Blunder'), (MISTAKE, '?', 'Mistake'), (INACCURACY, '?!', 'Inaccuracy'))
+
+
+class PositionResult:
+    def __init__(self, score, best_move, nodes, elapsed):
+        #Centipawns from the view of the side to move
+        self.score = score
+        #Best move in standard notation, None when the game is over
+        self.best_move = best_move
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+
+#Cache of searched positions. The key contains the budget, a deeper search of the same position is a new entry.
+#With a path the cache is stored in SQLite, so the nightly run does not search the same openings again
+class AnalysisCache:
+    def __init__(self, path=None):
+        self.entries = {}
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS analysis (hash INTEGER, budget TEXT, score INTEGER, "
+                                    "best_move TEXT, nodes INTEGER, PRIMARY KEY (hash, budget))")
+
+    def get(self, key, budget):
+        result = self.entries.get((key, budget))
+        if result is None and self.connection is not None:
+            row = self.connection.execute("SELECT score, best_move, nodes FROM analysis WHERE hash = ? AND budget = ?",
+                                          (to_signed(key), budget)).fetchone()
+            if row is not None:
+                result = PositionResult(row[0], row[1], row[2], 0.0)
+                self.entries[(key, budget)] = result
+        return result
+
+    def put(self, key, budget, result):
+        self.entries[(key, budget)] = result
+        if self.connection is not None:
+            self.connection.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?)",
+                                    (to_signed(key), budget, result.score, result.best_move, result.nodes))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+def budget_name(limits):
+    if limits.nodes is not None:
+        return f"nodes={limits.nodes}"
+    if limits.movetime is not None:
+        return f"movetime={limits.movetime}"
+    return f"depth={limits.depth}"
+
+
+#Runs in a worker process. The position is sent as a Position, which pickles to about 100 bytes instead of
+#a few kilobytes for a Board with its pieces
+def analyse_position(task):
+    position, limits = task
+    board = position.to_board()
+    color = position.color
+    result = Searcher().search(board, color, limits)
+    best_move = None
+    if result.best_move is not None:
+        best_move = move_to_san(board, result.best_move, color, result.best_move.promotion)
+    return PositionResult(result.score, best_move, result.nodes, result.elapsed)
+
+
+class GamePositions:
+    def __init__(self, game):
+        self.game = game
+        #Color to move in the start position of the game
+        self.color = 'white'
+        #Hash of the position before every move and after the last one
+        self.keys = []
+        #Number of moves that could be replayed
+        self.played = 0
+
+
+#Replay a game and collect its positions. New positions are added to tasks (hash -> task)
+def collect_positions(game, limits, budget, cache, tasks):
+    positions = GamePositions(game)
+    try:
+        board, color = start_position(game)
+    except ValueError as error:
+        logger.warning("Game skipped: %s", error)
+        return positions
+    positions.color = color
+
+    def add(key):
+        positions.keys.append(key)
+        if key not in tasks and cache.get(key, budget) is None:
+            tasks[key] = (Position.from_board(board, color), limits)
+
+    add(board.zobrist_hash(color))
+    for san in game.moves:
+        success, error_message = play_san(board, san, color)
+        if not success:
+            logger.warning("Game stopped early at %s: %s", san, error_message)
+            positions.keys.pop()
+            break
+        positions.played += 1
+        color = 'black' if color == 'white' else 'white'
+        add(board.zobrist_hash(color))
+        if positions.played < len(game.moves) and get_termination(board, color)[0] is not None:
+            logger.warning("Game ended after %d plies, the other moves are not analysed", positions.played)
+            break
+    return positions
+
+
+def format_score(score, color):
+    #Scores in the annotated game are from the view of white like in other programs
+    if color == 'black':
+        score = -score
+    if abs(score) >= MATE_BOUND:
+        plies = MATE_SCORE - abs(score)
+        if plies == 0:
+            return 'mate'
+        return f"#{'' if score > 0 else '-'}{(plies + 1) // 2}"
+    return f"{score / 100:+.2f}"
+
+
+#Annotations of one game: ply -> comment, ply -> suffix like "?" and the counts of the marked moves
+def annotate(positions, budget, cache):
+    comments = {}
+    suffixes = {}
+    counts = {name: 0 for _, _, name in ANNOTATIONS}
+    color = positions.color
+    for ply in range(positions.played):
+        before = cache.get(positions.keys[ply], budget)
+        after = cache.get(positions.keys[ply + 1], budget)
+        next_color = 'black' if color == 'white' else 'white'
+        #The score after the move is from the view of the opponent
+        loss = before.score + after.score
+        comment = format_score(after.score, next_color)
+        for threshold, suffix, name in ANNOTATIONS:
+            #Moves in a position that is already mated by force are not marked, neither is the best move
+            #when a deeper look after it finds a worse score
+            if loss >= threshold and before.score > -MATE_BOUND and before.best_move != positions.game.moves[ply]:
+                suffixes[ply] = suffix
+                counts[name] += 1
+                comment += f" {name}. Best was {before.best_move} ({format_score(before.score, color)})"
+                break
+        comments[ply] = comment
+        color = next_color
+    return comments, suffixes, counts
+
+
+def analyse_games(games, limits, workers=None, cache=None):
+    cache = cache if cache is not None else AnalysisCache()
+    budget = budget_name(limits)
+    tasks = {}
+    all_positions = [collect_positions(game, limits, budget, cache, tasks) for game in games]
+    position_count = sum(len(positions.keys) for positions in all_positions)
+    logger.info("%d positions, %d to search", position_count, len(tasks))
+
+    nodes = 0
+    start = time.perf_counter()
+    keys = list(tasks)
+    workers = workers or os.cpu_count()
+    #Small chunks keep all workers busy until the end, but every chunk costs a round trip
+    chunksize = max(1, len(keys) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, result in zip(keys, executor.map(analyse_position, (tasks[key] for key in keys), chunksize=chunksize)):
+            cache.put(key, budget, result)
+            nodes += result.nodes
+    elapsed = time.perf_counter() - start
+    return all_positions, {
+        'positions': position_count,
+        'searched': len(tasks),
+        'nodes': nodes,
+        'time': elapsed,
+        'nodes_per_second': nodes / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def write_annotated(path, all_positions, limits, cache):
+    budget = budget_name(limits)
+    totals = {name: 0 for _, _, name in ANNOTATIONS}
+    with open(path, 'w') as file:
+        for positions in all_positions:
+            comments, suffixes, counts = annotate(positions, budget, cache)
+            moves = positions.game.moves[:positions.played]
+            moves = [move + suffixes.get(ply, '') for ply, move in enumerate(moves)]
+            headers = dict(positions.game.headers)
+            headers['Annotator'] = f"analysis.py {budget}"
+            write_game(file, moves, headers, positions.game.result, comments)
+            for name, count in counts.items():
+                totals[name] += count
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate every position of the games in PGN files and write an annotated PGN")
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('-o', '--output', default='analysis.pgn')
+    budget_group = parser.add_mutually_exclusive_group()
+    budget_group.add_argument('--nodes', type=int, default=None, help="nodes per position")
+    budget_group.add_argument('--movetime', type=int, default=None, help="milliseconds per position")
+    budget_group.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--cache', default=None, help="SQLite file that keeps the results between runs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    limits = SearchLimits(depth=args.depth, nodes=args.nodes, movetime=args.movetime)
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        limits.nodes = 2000
+    cache = AnalysisCache(args.cache)
+    try:
+        games = [game for path in args.pgn for game in read_games(path)]
+        all_positions, stats = analyse_games(games, limits, args.workers, cache)
+        totals = write_annotated(args.output, all_positions, limits, cache)
+    finally:
+        cache.close()
+    print(f"{len(games)} games, {stats['positions']} positions, {stats['searched']} searched "
+          f"({stats['positions'] - stats['searched']} from the cache)")
+    print(f"{stats['nodes']} nodes in {stats['time']:.2f}s, {stats['nodes_per_second']:.0f} nodes/sec")
+    print(', '.join(f"{name}: {count}" for name, count in totals.items()) + f", written to {args.output}")
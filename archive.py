@@ -0,0 +1,331 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+
+from pgn import read_games, start_position
+from rules import Board, Piece, PieceType, get_termination, play_san, move_to_uci
+
+logger = logging.getLogger(__name__)
+
+#Compact binary archive for many games with random access.
+#
+#Every move is stored as its index in board.generate_moves() of the position before the move, so it only
+#needs as many bits as are required to count the moves of that position (usually 5-6 bits).
+#Reading a game replays the indices with make_move, no notation has to be parsed.
+#
+#File layout (little endian):
+#  header: magic "CGAR", u16 version, u16 reserved, u32 game count, u64 index offset, 12 bytes reserved
+#  games:  u8 result, u8 start (0 = normal start position, 2 = position and state follow),
+#          [32 bytes position, two squares per byte, u8 color to move (1 = black), u64 unmoved kings, rooks and
+#          pawns (bit row * 8 + col), u8 en passant pawn square (255 = none), u16 halfmove clock],
+#          u16 plies, u16 byte length, packed move indices
+#  index:  u64 offset of every game, stored after the last game
+#Start 1 (only the 32 bytes position, white to move, everything unmoved) is still read from older archives.
+#Appending games writes them after the old index, then the new index and the header last: when a game can't be
+#encoded or the program stops in between, the header still points to the old index and the archive stays valid.
+
+MAGIC = b"CGAR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQ12x")
+GAME_HEADER = struct.Struct("<BB")
+MOVES_HEADER = struct.Struct("<HH")
+START_STATE = struct.Struct("<BQBH")
+
+RESULT_CODES = {'*': 0, '1-0': 1, '0-1': 2, '1/2-1/2': 3}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+
+START_NORMAL = 0
+START_POSITION = 1
+START_POSITION_STATE = 2
+NO_EN_PASSANT = 255
+
+#Square codes for the stored start positions: 0 is empty, 1-6 white and 7-12 black pieces
+PIECE_CODES = {}
+for _index, _piece_type in enumerate(PieceType):
+    PIECE_CODES[('white', _piece_type)] = _index + 1
+    PIECE_CODES[('black', _piece_type)] = _index + 7
+CODE_PIECES = {code: key for key, code in PIECE_CODES.items()}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def encode_position(board):
+    codes = []
+    for row in range(8):
+        for col in range(8):
+            piece = board.grid[row][col]
+            codes.append(0 if piece is None else PIECE_CODES[(piece.color, piece.type)])
+    return bytes((codes[i] << 4) | codes[i + 1] for i in range(0, 64, 2))
+
+
+def decode_position(data):
+    board = Board()
+    for i, byte in enumerate(data):
+        for square, code in ((2 * i, byte >> 4), (2 * i + 1, byte & 15)):
+            if code:
+                color, piece_type = CODE_PIECES[code]
+                row, col = divmod(square, 8)
+                board.grid[row][col] = Piece(color, (row, col), piece_type)
+    board.reset_state()
+    return board
+
+
+#The position with what the grid does not show: the color to move, the pieces whose first move still matters
+#(castling and the double step of pawns), the en passant pawn and the halfmove clock
+def encode_start(board, color):
+    unmoved = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board.grid[row][col]
+            if piece is not None and not piece.has_moved and piece.type in (PieceType.KING, PieceType.ROOK, PieceType.PAWN):
+                unmoved |= 1 << (row * 8 + col)
+    en_passant = NO_EN_PASSANT
+    if board.en_passant_pawn is not None:
+        row, col = board.en_passant_pawn.position
+        en_passant = row * 8 + col
+    state = START_STATE.pack(1 if color == 'black' else 0, unmoved, en_passant, min(board.halfmove_clock, 0xFFFF))
+    return encode_position(board) + state
+
+
+#Returns the board and the color to move
+def decode_start(data):
+    board = decode_position(data[:32])
+    black, unmoved, en_passant, halfmove_clock = START_STATE.unpack(data[32:32 + START_STATE.size])
+    for row in range(8):
+        for col in range(8):
+            piece = board.grid[row][col]
+            if piece is not None:
+                piece.has_moved = not unmoved >> (row * 8 + col) & 1
+    if en_passant != NO_EN_PASSANT:
+        pawn = board.grid[en_passant // 8][en_passant % 8]
+        board.en_passant_pawn = pawn
+        pawn.pawn_has_moved_two_squares_last_turn = True
+    color = 'black' if black else 'white'
+    board.reset_state(color)
+    board.halfmove_clock = halfmove_clock
+    return board, color
+
+
+def is_normal_start(board, color='white'):
+    start = Board()
+    start.setup_pieces()
+    return encode_start(board, color) == encode_start(start, 'white')
+
+
+def bits_for(move_count):
+    return (move_count - 1).bit_length()
+
+
+#Find which of the generated moves was played, by looking at the pieces of the color that moved
+def find_played_move(moves, before):
+    moved = [(piece, position, piece_type) for piece, position, piece_type in before if piece.position != position]
+    if len(moved) == 2:
+        #Castling moves the king and the rook
+        rook_from = next(position for piece, position, piece_type in moved if piece.type == PieceType.ROOK)
+        for index, move in enumerate(moves):
+            if move.rook_from == rook_from:
+                return index
+    elif len(moved) == 1:
+        piece, from_pos, piece_type = moved[0]
+        promotion = piece.type if piece.type != piece_type else None
+        for index, move in enumerate(moves):
+            if ((move.from_row, move.from_col) == from_pos and (move.to_row, move.to_col) == piece.position
+                    and move.promotion == promotion and move.rook_from is None):
+                return index
+    raise ArchiveError("Played move not found in the generated moves")
+
+
+#Play moves in standard notation on the board. After every move (generated moves, index of the played move, color)
+#is yielded, the generated moves belong to the position before the move. Moves after the end of the game
+#(mate, stalemate or a draw rule) are ignored
+def replay_san_moves(board, san_moves, color='white'):
+    for ply, san in enumerate(san_moves):
+        moves = board.generate_moves(color)
+        before = [(piece, piece.position, piece.type) for row in board.grid for piece in row if piece and piece.color == color]
+        success, error_message = play_san(board, san, color)
+        if not success:
+            raise ArchiveError(f"Invalid move {san}: {error_message}")
+        yield moves, find_played_move(moves, before), color
+        color = 'black' if color == 'white' else 'white'
+        if ply + 1 < len(san_moves):
+            result, reason = get_termination(board, color)
+            if result is not None:
+                logger.warning("Game ended by %s after %d plies, %d more moves are ignored", reason, ply + 1, len(san_moves) - ply - 1)
+                return
+
+
+#Pack the moves (in standard notation) of one game. The board has to be in the start position, color is to move
+def encode_game(board, san_moves, result='*', color='white'):
+    start = START_NORMAL if is_normal_start(board, color) else START_POSITION_STATE
+    data = GAME_HEADER.pack(RESULT_CODES.get(result, 0), start)
+    if start == START_POSITION_STATE:
+        data += encode_start(board, color)
+    packed = 0
+    bit_count = 0
+    plies = 0
+    for moves, index, _ in replay_san_moves(board, san_moves, color):
+        bits = bits_for(len(moves))
+        packed = (packed << bits) | index
+        bit_count += bits
+        plies += 1
+    #Pad the last byte with zeros
+    byte_count = (bit_count + 7) // 8
+    packed <<= byte_count * 8 - bit_count
+    return data + MOVES_HEADER.pack(plies, byte_count) + packed.to_bytes(byte_count, 'big')
+
+
+def write_header(file, game_count, index_offset):
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, VERSION, 0, game_count, index_offset))
+
+
+#Append games to the archive, the file is created when it does not exist. Games with an invalid move are
+#logged and skipped. games is an iterable of (start board, moves in standard notation, result, color to move)
+def append_games(path, games):
+    if not os.path.exists(path):
+        with open(path, 'wb') as file:
+            write_header(file, 0, HEADER.size)
+    with open(path, 'r+b') as file:
+        magic, version, _, game_count, index_offset = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ArchiveError(f"{path} is not a game archive")
+        file.seek(index_offset)
+        offsets = list(struct.unpack(f"<{game_count}Q", file.read(8 * game_count)))
+        #The new games go after the old index, which stays valid until the header points to the new one.
+        #Only the space of the old index is lost, 8 bytes per game
+        position = file.seek(0, os.SEEK_END)
+        buffer = []
+        for number, (board, san_moves, result, color) in enumerate(games, 1):
+            try:
+                record = encode_game(board, san_moves, result, color)
+            except ArchiveError as error:
+                logger.warning("Game %d skipped: %s", number, error)
+                continue
+            offsets.append(position)
+            position += len(record)
+            buffer.append(record)
+            if len(buffer) >= 1024:
+                file.write(b''.join(buffer))
+                buffer = []
+        file.write(b''.join(buffer))
+        file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        file.flush()
+        write_header(file, len(offsets), position)
+    return len(offsets)
+
+
+class ArchivedGame:
+    def __init__(self, result, board, moves, color='white'):
+        self.result = result
+        #Start position and the moves as Move objects of that position
+        self.board = board
+        self.moves = moves
+        #Color to move in the start position
+        self.color = color
+
+
+#Reads an archive through mmap, game n is found with one lookup in the index
+class ArchiveReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.game_count, self.index_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ArchiveError(f"{path} is not a game archive")
+
+    def __len__(self):
+        return self.game_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def game_offset(self, number):
+        if not 0 <= number < self.game_count:
+            raise IndexError(number)
+        return struct.unpack_from("<Q", self.data, self.index_offset + 8 * number)[0]
+
+    #The start board, the color to move and the offset after the start position
+    def start_board(self, start, offset):
+        if start == START_POSITION_STATE:
+            board, color = decode_start(self.data[offset:offset + 32 + START_STATE.size])
+            return board, color, offset + 32 + START_STATE.size
+        if start == START_POSITION:
+            return decode_position(self.data[offset:offset + 32]), 'white', offset + 32
+        board = Board()
+        board.setup_pieces()
+        return board, 'white', offset
+
+    #Replay game number n and yield (board, move, color) for every move before it is played.
+    #The board is changed in place, so copy it if a position has to be kept
+    def replay(self, number):
+        offset = self.game_offset(number)
+        result_code, start = GAME_HEADER.unpack_from(self.data, offset)
+        board, color, offset = self.start_board(start, offset + GAME_HEADER.size)
+        plies, byte_count = MOVES_HEADER.unpack_from(self.data, offset)
+        offset += MOVES_HEADER.size
+        packed = int.from_bytes(self.data[offset:offset + byte_count], 'big')
+        remaining_bits = byte_count * 8
+        for _ in range(plies):
+            moves = board.generate_moves(color)
+            bits = bits_for(len(moves))
+            remaining_bits -= bits
+            move = moves[(packed >> remaining_bits) & ((1 << bits) - 1)]
+            yield board, move, color
+            board.make_move(move)
+            color = 'black' if color == 'white' else 'white'
+
+    def result(self, number):
+        return RESULT_NAMES[self.data[self.game_offset(number)]]
+
+    #The whole game with its start position and the moves as Move objects
+    def read_game(self, number):
+        offset = self.game_offset(number)
+        result_code, start = GAME_HEADER.unpack_from(self.data, offset)
+        start_board, color, _ = self.start_board(start, offset + GAME_HEADER.size)
+        moves = [move for board, move, _ in self.replay(number)]
+        return ArchivedGame(RESULT_NAMES[result_code], start_board, moves, color)
+
+
+def pgn_games(paths):
+    for path in paths:
+        for number, game in enumerate(read_games(path), 1):
+            try:
+                board, color = start_position(game)
+            except ValueError as error:
+                logger.warning("%s game %d skipped: %s", path, number, error)
+                continue
+            yield board, game.moves, game.result, color
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack PGN files into a binary game archive")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help="append the games of PGN files to an archive")
+    pack_parser.add_argument('archive')
+    pack_parser.add_argument('pgn', nargs='+')
+    info_parser = subparsers.add_parser('info', help="show the number of games and one game")
+    info_parser.add_argument('archive')
+    info_parser.add_argument('--game', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        count = append_games(args.archive, pgn_games(args.pgn))
+        print(f"{args.archive}: {count} games, {os.path.getsize(args.archive)} bytes")
+    else:
+        with ArchiveReader(args.archive) as reader:
+            print(f"{args.archive}: {len(reader)} games")
+            if args.game is not None:
+                game = reader.read_game(args.game)
+                print(game.result, ' '.join(move_to_uci(move) for move in game.moves))
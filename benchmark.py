@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+#Without a window, the frame benchmark draws on a surface of the dummy video driver. This has to be set before pygame starts
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+import chess
+from pgn import read_games
+from rules import START_FEN, Clock, PieceType, board_from_fen, move_cache
+
+#Microbenchmarks of the hot paths of the rules and the drawing. Every benchmark runs a small fixed workload,
+#the time per run is the best of several repeats (the least disturbed one), so runs on one machine can be compared.
+#The results are written as JSON, with a baseline file every benchmark shows how much faster or slower it got:
+#  python benchmark.py -o baseline.json
+#  python benchmark.py --baseline baseline.json -o current.json
+
+#Positions for the move generation: the start, a middlegame with castling, pins and en passant tricks and an endgame
+POSITIONS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+#Black is in check and can block, white is mated
+CHECK_FEN = "rnbqkbnr/ppp2ppp/8/1B1pp3/4P3/8/PPPP1PPP/RNBQK1NR b KQkq - 1 3"
+MATE_FEN = "rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3"
+#Castling to the king side is legal, to the queen side the king would pass an attacked square (d1)
+CASTLE_FEN = "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"
+CASTLE_REJECTED_FEN = "r2rk3/8/8/8/8/8/8/R3K2R w KQq - 0 1"
+
+PGN_PATH = os.path.join(os.path.dirname(__file__), "game.pgn")
+
+#A benchmark is slower or faster than the baseline when the time changed by more than this
+DEFAULT_THRESHOLD = 0.05
+
+
+def piece_moves_benchmark(piece_type):
+    boards = [board_from_fen(fen)[0] for fen in POSITIONS]
+    pieces = [(board, piece) for board in boards for row in board.grid for piece in row
+              if piece is not None and piece.type == piece_type]
+
+    def run():
+        for board, piece in pieces:
+            piece.get_valid_moves(board)
+    return run
+
+
+def is_check_benchmark():
+    boards = [board_from_fen(fen)[0] for fen in POSITIONS + [CHECK_FEN, MATE_FEN]]
+
+    def run():
+        for board in boards:
+            board.is_check('white')
+            board.is_check('black')
+    return run
+
+
+def is_checkmate_benchmark():
+    checks = [board_from_fen(fen)[:2] for fen in (CHECK_FEN, MATE_FEN)]
+
+    def run():
+        #has_legal_move takes the moves from the cache when they are there, the benchmark measures the search for them
+        move_cache.clear()
+        for board, color in checks:
+            board.is_checkmate(color)
+    return run
+
+
+#Board.castle plays the move when it is legal, so a legal castling needs a new board every time: its time
+#contains one Board.copy (see the benchmark board.copy)
+def castle_benchmark(legal):
+    if legal:
+        board = board_from_fen(CASTLE_FEN)[0]
+
+        def run():
+            board.copy().castle((7, 4), (7, 6), (7, 7), (7, 5), 'white')
+    else:
+        board = board_from_fen(CASTLE_REJECTED_FEN)[0]
+
+        def run():
+            board.castle((7, 4), (7, 2), (7, 0), (7, 3), 'white')
+    return run
+
+
+def copy_benchmark():
+    board = board_from_fen(CASTLE_FEN)[0]
+    return board.copy
+
+
+#Replay the bundled game with Game.play_move like moves typed into the game, from a new board every run
+def play_move_benchmark(game):
+    moves = next(read_games(PGN_PATH)).moves
+
+    def run():
+        move_cache.clear()
+        game.board = chess.Board(game.board.width, game.board.height, game.screen)
+        game.board.setup_pieces()
+        color = 'white'
+        for move in moves:
+            if not game.play_move(move):
+                raise RuntimeError(f"{move}: {game.error_message}")
+            color = 'black' if color == 'white' else 'white'
+            game.current_turn = color
+    return run
+
+
+def representation_benchmark():
+    boards = [board_from_fen(fen)[0] for fen in POSITIONS]
+
+    def run():
+        for board in boards:
+            board.get_position_representation()
+    return run
+
+
+#One frame of a game with a clock: the board in the start position and the sidebar
+def frame_benchmark(game):
+    board = chess.Board(game.board.width, game.board.height, game.screen)
+    board.setup_pieces()
+
+    def run():
+        game.board = board
+        game.board.print_board()
+        game.draw_sidebar()
+    return run
+
+
+def create_benchmarks():
+    pygame.init()
+    game = chess.Game(fps=0)
+    game.game_mode = 'normal'
+    game.clock = Clock(5, 0)
+    benchmarks = {}
+    for piece_type in PieceType:
+        benchmarks[f"get_valid_moves.{piece_type.name.lower()}"] = piece_moves_benchmark(piece_type)
+    benchmarks['is_check'] = is_check_benchmark()
+    benchmarks['is_checkmate'] = is_checkmate_benchmark()
+    benchmarks['castle.legal'] = castle_benchmark(True)
+    benchmarks['castle.rejected'] = castle_benchmark(False)
+    benchmarks['board.copy'] = copy_benchmark()
+    benchmarks['game.play_move.pgn'] = play_move_benchmark(game)
+    benchmarks['get_position_representation'] = representation_benchmark()
+    benchmarks['frame'] = frame_benchmark(game)
+    return benchmarks
+
+
+#Microseconds per run: best and median of the repeats. Every repeat runs the benchmark as often as it takes for
+#about 0.2 seconds, which timeit finds out once
+def measure(function, repeat=5):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [time / number * 1e6 for time in timer.repeat(repeat, number)]
+    return {'us': min(times), 'median_us': statistics.median(times), 'runs': number, 'repeat': repeat}
+
+
+def run_benchmarks(names=None, repeat=5):
+    benchmarks = create_benchmarks()
+    results = {}
+    for name, function in benchmarks.items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        #One run outside the timing fills the caches that every later run finds filled too (fonts, piece images)
+        function()
+        results[name] = measure(function, repeat)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'pygame': pygame.version.ver,
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+
+
+#Changes against the baseline: name -> (baseline us, current us, relative change), only for benchmarks in both
+def compare(results, baseline):
+    changes = {}
+    for name, result in results.items():
+        if name in baseline:
+            before = baseline[name]['us']
+            changes[name] = (before, result['us'], result['us'] / before - 1 if before > 0 else 0.0)
+    return changes
+
+
+def print_results(results, changes, threshold):
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        line = f"{name:<{width}}  {result['us']:12.2f} us"
+        if name in changes:
+            before, _, change = changes[name]
+            verdict = ''
+            if change > threshold:
+                verdict = ' slower'
+            elif change < -threshold:
+                verdict = ' faster'
+            line += f"  (baseline {before:12.2f} us, {change:+7.1%}{verdict})"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the move generation, legality checks, replay and drawing")
+    parser.add_argument('-o', '--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="JSON file of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change from which a benchmark counts as slower or faster")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fail-slower', action='store_true', help="exit with 1 when a benchmark got slower")
+    parser.add_argument('names', nargs='*', help="only the benchmarks whose name starts with one of these")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.names, args.repeat)
+    changes = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            changes = compare(results, json.load(file)['results'])
+    print_results(results, changes, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+    if args.fail_slower and any(change > args.threshold for _, _, change in changes.values()):
+        sys.exit(1)
@@ -1,71 +1,108 @@
-from enum import Enum, auto
 import pygame
 import sys
 import os
-import random
 import math
-
-class PieceType(Enum):
-    PAWN   = auto()
-    KNIGHT = auto()
-    BISHOP = auto()
-    ROOK   = auto()
-    QUEEN  = auto()
-    KING   = auto()
-
-
-class Clock:
-    def __init__(self, minutes, increment=0):
-        self.minutes = minutes
-        self.increment = increment
-        self.white_time = minutes * 60  # Convert to seconds
-        self.black_time = minutes * 60
-        self.is_running = False
-        self.current_player = 'white'
-
-    def start_clock(self):
-        self.is_running = True
-
-    def stop_clock(self):
-        self.is_running = False
-    
-    def update_clock(self, delta_time):
-        delta_time = delta_time / 1000
-        if self.is_running:
-            if self.current_player == 'white':
-                self.white_time -= delta_time
-            else:
-                self.black_time -= delta_time
-
-    def switch_player(self):
-        if self.current_player == 'white':
-            self.white_time += self.increment
-            self.current_player = 'black'
+import logging
+from collections import OrderedDict
+from profiling import profiler
+from rules import PieceType, Clock, Move, Piece, Board as RulesBoard, play_san, get_termination, move_cache
+from engine import Ponderer, choose_endgame_move
+from replay import Replay
+
+logger = logging.getLogger(__name__)
+
+#Upper bound for redraws per second of the main loop
+FPS_CAP = 30
+
+#Caches rendered text surfaces, most texts (labels, buttons, clock) are the same for many frames.
+#Surfaces are keyed by font, text and colour and the least recently used one is dropped when the cache is full.
+#The returned surfaces are shared, so they must only be blitted and never changed.
+class TextCache:
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.surfaces),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+#Shared by all draw routines of the game and the board
+text_cache = TextCache()
+
+
+#Decides when the main loop wakes up. Instead of spinning we block in pygame.event.wait until
+#an event arrives or the given timeout (e.g. the next clock second) runs out.
+#A frame is only drawn when something requested a redraw and never more often than the fps cap.
+class FrameScheduler:
+    def __init__(self, fps=FPS_CAP):
+        self.fps = fps
+        self.frame_clock = pygame.time.Clock()
+        self.needs_redraw = True
+
+    def request_redraw(self):
+        self.needs_redraw = True
+
+    #Return the next batch of events. timeout is in ms, None means we sleep until an event arrives
+    def wait_for_events(self, timeout=None):
+        #A frame is pending, so we only collect what is already there
+        if self.needs_redraw:
+            return pygame.event.get()
+        if timeout is None:
+            event = pygame.event.wait()
         else:
-            self.black_time += self.increment
-            self.current_player = 'white'        
-        
+            event = pygame.event.wait(max(1, math.ceil(timeout)))
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        return events
 
-    def get_time_string(self, time_in_seconds):
-        time_in_seconds = int(time_in_seconds)
-        minutes = time_in_seconds // 60
-        seconds = time_in_seconds % 60
-        return f"{minutes:02d}:{seconds:02d}"
-
-    def get_white_time_string(self):
-        return self.get_time_string(self.white_time)
-
-    def get_black_time_string(self):
-        return self.get_time_string(self.black_time)
+    #Called after a frame was drawn, sleeps if we would go above the fps cap
+    def frame_done(self):
+        self.needs_redraw = False
+        if self.fps:
+            self.frame_clock.tick(self.fps)
 
 class Game:
-    def __init__(self):
+    def __init__(self, fps=FPS_CAP):
         #Width and height of the board
         width = 640 
         height = 640 
         #Width (board + buttons(clock+resign etc) and height (board + buttons)
         self.screen = pygame.display.set_mode((width+200, height+60))
+        #Mouse motion is never used, so it should not wake up the main loop
+        pygame.event.set_blocked(pygame.MOUSEMOTION)
+        self.frame_scheduler = FrameScheduler(fps)
         self.board = Board(width, height, self.screen)
+        #Engine for the computer moves, it keeps its transposition table during the game and searches
+        #on the time of the player in games with a clock
+        self.ponderer = Ponderer()
         self.current_turn = 'white'
         self.input_text = ""
         self.font = pygame.font.SysFont(None, 32)
@@ -77,6 +114,7 @@ class Game:
         self.create_startSelectButtons()
         self.game_mode = None  # None, 'normal', 'fischer', or 'two_rooks' or 'done'
         self.game_result = None # None, 'white_win', 'black_win', 'draw'
+        self.game_end_reason = None # e.g. 'checkmate', 'stalemate', 'repetition', see get_termination
         
         # Clock settings
         self.use_clock = True
@@ -101,10 +139,14 @@ class Game:
         self.pgn_file_path = os.path.join(os.path.dirname(__file__), "game.pgn")  # Set your PGN file path here
         self.pgn_moves = []
         self.current_move_index = 0
+        #Navigation in the game of the PGN file, see start_replay
+        self.replay = None
         self.whiteWantsDraw = False
         self.blackWantsDraw = False
 
         self.gameMoves = []
+        self.drawn_clock_strings = None
+        self.show_profiler = profiler.enabled
         self.save_game_button = pygame.Rect(840/2 - 120/2, 840/2 + 90, 120, 40)
         
         if self.use_pgn_file:
@@ -174,7 +216,7 @@ class Game:
             pygame.draw.rect(self.screen, (200, 200, 200), clock_bg, 2)
             
             # Draw title
-            title = self.font_small.render("Chess Clock", True, (50, 50, 50))
+            title = text_cache.render(self.font_small, "Chess Clock", (50, 50, 50))
             title_rect = title.get_rect(center=(clock_x + clock_width//2, clock_y + 20))
             self.screen.blit(title, title_rect)
             
@@ -183,11 +225,11 @@ class Game:
             pygame.draw.rect(self.screen, (255, 255, 255), white_bg)
             pygame.draw.rect(self.screen, (200, 200, 200), white_bg, 2)
             
-            white_label = self.font_small.render("White", True, (50, 50, 50))
+            white_label = text_cache.render(self.font_small, "White", (50, 50, 50))
             white_label_rect = white_label.get_rect(center=(clock_x + clock_width//2, clock_y + 55))
             self.screen.blit(white_label, white_label_rect)
             
-            white_time = self.font.render(self.clock.get_white_time_string(), True, (0, 0, 0))
+            white_time = text_cache.render(self.font, self.clock.get_white_time_string(), (0, 0, 0))
             white_time_rect = white_time.get_rect(center=(clock_x + clock_width//2, clock_y + 85))
             self.screen.blit(white_time, white_time_rect)
             
@@ -196,11 +238,11 @@ class Game:
             pygame.draw.rect(self.screen, (255, 255, 255), black_bg)
             pygame.draw.rect(self.screen, (200, 200, 200), black_bg, 2)
             
-            black_label = self.font_small.render("Black", True, (50, 50, 50))
+            black_label = text_cache.render(self.font_small, "Black", (50, 50, 50))
             black_label_rect = black_label.get_rect(center=(clock_x + clock_width//2, clock_y + 135))
             self.screen.blit(black_label, black_label_rect)
             
-            black_time = self.font.render(self.clock.get_black_time_string(), True, (0, 0, 0))
+            black_time = text_cache.render(self.font, self.clock.get_black_time_string(), (0, 0, 0))
             black_time_rect = black_time.get_rect(center=(clock_x + clock_width//2, clock_y + 165))
             self.screen.blit(black_time, black_time_rect)
             
@@ -211,21 +253,21 @@ class Game:
                 pygame.draw.rect(self.screen, (100, 255, 100), black_bg, 3)
 
         #Draw the buttons for the sidebar
-        blackTitle = self.font.render("Black", True, (0, 0, 0))
-        whiteTitle = self.font.render("White", True, (0, 0, 0))
+        blackTitle = text_cache.render(self.font, "Black", (0, 0, 0))
+        whiteTitle = text_cache.render(self.font, "White", (0, 0, 0))
         whiteTitleRect = whiteTitle.get_rect(center=(self.board.width + 100, 300))
         blackTitleRect = blackTitle.get_rect(center=(self.board.width + 100, 500))
         self.screen.blit(blackTitle, blackTitleRect)
         self.screen.blit(whiteTitle, whiteTitleRect)
 
         whiteText = "Request Draw" if not self.blackWantsDraw else "Accept Draw"
-        whiteTextRect = self.font_small.render(whiteText, True, (0, 0, 0))
+        whiteTextRect = text_cache.render(self.font_small, whiteText, (0, 0, 0))
         whiteDrawButton = self.sideBarButtons[0]
         pygame.draw.rect(self.screen, (220, 220, 220), whiteDrawButton)
         pygame.draw.rect(self.screen, (100, 100, 100), whiteDrawButton, 2)
         whiteTextPos = whiteTextRect.get_rect(center=whiteDrawButton.center)
         self.screen.blit(whiteTextRect, whiteTextPos)
-        whiteTextRect = self.font_small.render("Resign", True, (0, 0, 0))
+        whiteTextRect = text_cache.render(self.font_small, "Resign", (0, 0, 0))
         whiteResignButton = self.sideBarButtons[1]
         pygame.draw.rect(self.screen, (220, 220, 220), whiteResignButton)
         pygame.draw.rect(self.screen, (100, 100, 100), whiteResignButton, 2)
@@ -233,13 +275,13 @@ class Game:
         self.screen.blit(whiteTextRect, whiteTextPos)
 
         blackText = "Request Draw" if not self.whiteWantsDraw else "Accept Draw"
-        blackTextRect = self.font_small.render(blackText, True, (0, 0, 0))
+        blackTextRect = text_cache.render(self.font_small, blackText, (0, 0, 0))
         blackDrawButton = self.sideBarButtons[2]
         pygame.draw.rect(self.screen, (220, 220, 220), blackDrawButton)
         pygame.draw.rect(self.screen, (100, 100, 100), blackDrawButton, 2)
         blackTextPos = blackTextRect.get_rect(center=blackDrawButton.center)
         self.screen.blit(blackTextRect, blackTextPos)
-        blackTextRect = self.font_small.render("Resign", True, (0, 0, 0))
+        blackTextRect = text_cache.render(self.font_small, "Resign", (0, 0, 0))
         blackResignButton = self.sideBarButtons[3]
         pygame.draw.rect(self.screen, (220, 220, 220), blackResignButton)
         pygame.draw.rect(self.screen, (100, 100, 100), blackResignButton, 2)
@@ -255,7 +297,7 @@ class Game:
             pygame.draw.rect(self.screen, (100, 100, 100), button, 2)
             
             # Draw button text
-            text = self.button_font.render(self.button_texts[i], True, (0, 0, 0))
+            text = text_cache.render(self.button_font, self.button_texts[i], (0, 0, 0))
             text_rect = text.get_rect(center=button.center)
             self.screen.blit(text, text_rect)
 
@@ -271,12 +313,12 @@ class Game:
             pygame.draw.rect(self.screen, (0, 0, 0), checkbox_rect)
             
         # Draw "Use Clock" text
-        text = self.font_small.render("Use Clock", True, (0, 0, 0))
+        text = text_cache.render(self.font_small, "Use Clock", (0, 0, 0))
         self.screen.blit(text, (35, 53))
         
         # Draw clock options if clock is enabled
         if self.use_clock:
-            text = self.font_small.render("Clock Options:", True, (0, 0, 0))
+            text = text_cache.render(self.font_small, "Clock Options:", (0, 0, 0))
             self.screen.blit(text, (10, 100))
             for i, (text, _) in enumerate(self.clock_options):
                 button = self.clock_buttons[i]
@@ -285,7 +327,7 @@ class Game:
                 if self.clock == self.clock_options[i][1]:
                     pygame.draw.rect(self.screen, (100, 100, 100), button, 5)
                 
-                text_surface = self.font_small.render(text, True, (0, 0, 0))
+                text_surface = text_cache.render(self.font_small, text, (0, 0, 0))
                 text_rect = text_surface.get_rect(center=button.center)
                 self.screen.blit(text_surface, text_rect)
 
@@ -300,7 +342,7 @@ class Game:
             # Draw checkmark inside
             pygame.draw.rect(self.screen, (0, 0, 0), checkbox_enablepgn.inflate(-8, -8))
         
-        text = self.font_small.render("Use PGN File", True, (0, 0, 0))
+        text = text_cache.render(self.font_small, "Use PGN File", (0, 0, 0))
         self.screen.blit(text, (40, checkbox_enablepgn.centery - text.get_height() // 2))
         
         # Show PGN file path if enabled
@@ -319,7 +361,7 @@ class Game:
                 pgn_path = parts[-1]
             
             pgn_text = "PGN File: " + pgn_path
-            text = self.font_small.render(pgn_text, True, (50, 50, 50))
+            text = text_cache.render(self.font_small, pgn_text, (50, 50, 50))
             self.screen.blit(text, (path_rect.x + 10, path_rect.centery - text.get_height() // 2))
 
     def handle_sidebar_click(self, pos):
@@ -343,7 +385,10 @@ class Game:
         for i, button in enumerate(self.buttons):
             if button.collidepoint(pos):
                 self.input_text = ""
-                if self.use_pgn_file:
+                self.replay = None
+                if self.use_pgn_file and not self.pgn_moves:
+                    self.load_pgn_file()
+                if self.use_pgn_file and self.pgn_moves:
                     self.current_move_index = 0
                     self.input_text = self.pgn_moves[self.current_move_index]
                 if self.use_clock and self.clock is None:
@@ -358,7 +403,7 @@ class Game:
                 elif i == 1:  # Aufgabe 2 - Fischer Random
                     self.game_mode = 'fischer'
                     self.board.game_mode = 'fischer'
-                    print("Fischer Random")
+                    logger.info("Fischer Random")
                     self.board.setup_fischer_random()
                     if self.use_clock and self.clock is not None:
                         self.clock.start_clock()
@@ -366,11 +411,14 @@ class Game:
                 elif i == 2:  # Aufgabe 3 - Two Rooks vs Two Pawns
                     self.game_mode = 'two_rooks'
                     self.board.game_mode = 'two_rooks'
-                    print("Two Rooks vs Two Pawns")
+                    logger.info("Two Rooks vs Two Pawns")
                     self.board.setup_two_rooks()
                     if self.use_clock and self.clock is not None:
                         self.clock.start_clock()
                         self.last_update = pygame.time.get_ticks()
+                #In the rook+king vs king mode the computer plays white, so the file is not replayed there
+                if self.use_pgn_file and self.game_mode != 'two_rooks':
+                    self.start_replay()
                 return True
         return False
 
@@ -426,7 +474,7 @@ class Game:
         if self.selected_piece is None and clicked_piece and clicked_piece.color == self.current_turn:
             self.selected_piece = (row, col)
             # Get valid moves for the selected piece
-            self.valid_moves = clicked_piece.get_valid_moves(self.board)
+            self.valid_moves = self.get_piece_moves(clicked_piece)
             return
         if self.selected_piece is not None:
             if row == self.selected_piece[0] and col == self.selected_piece[1]:
@@ -436,9 +484,13 @@ class Game:
             elif clicked_piece is not None:
                 self.selected_piece = (row, col)
                 # Get valid moves for the selected piece
-                self.valid_moves = clicked_piece.get_valid_moves(self.board)
+                self.valid_moves = self.get_piece_moves(clicked_piece)
                 return
 
+    #The legal moves of one piece, from the move cache so clicking around the same position costs nothing
+    def get_piece_moves(self, piece):
+        return [move for move in self.board.legal_moves(piece.color) if (move.from_row, move.from_col) == piece.position]
+
     def handle_save_game_click(self, pos):
         if self.save_game_button.collidepoint(pos):
             self.save_game()
@@ -454,12 +506,51 @@ class Game:
                 self.pgn_moves = [move for move in moves if not move.endswith('.') and not move.startswith('$')]
                 if self.pgn_moves:
                     self.input_text = self.pgn_moves[0]
-                print(self.pgn_moves)
+                logger.debug("Loaded PGN moves: %s", self.pgn_moves)
         except FileNotFoundError:
             self.error_message = f"PGN file not found: {self.pgn_file_path}"
         except Exception as e:
             self.error_message = f"Error loading PGN file: {str(e)}"
 
+    #The moves of the PGN file are checked once, then Enter and the arrow keys only make and unmake moves.
+    #Left/Right go one ply back/forward, Page Up/Down ten plies and Home/End to the start and the end
+    def start_replay(self):
+        self.replay = Replay(self.board, self.pgn_moves, self.current_turn)
+        self.show_replay_position()
+
+    #Take over the position of the replay: color to move, played moves and the next move of the file
+    def show_replay_position(self):
+        replay = self.replay
+        self.current_turn = replay.color()
+        self.gameMoves = replay.san_moves[:replay.ply]
+        self.current_move_index = replay.ply
+        self.selected_piece = None
+        self.valid_moves = []
+        if replay.ply < len(replay):
+            self.input_text = replay.san_moves[replay.ply]
+            self.error_message = None
+        else:
+            self.input_text = ""
+            self.error_message = replay.error or "End of PGN file reached"
+        if self.clock is not None:
+            self.clock.current_player = self.current_turn
+
+    def handle_replay_key(self, key):
+        replay = self.replay
+        targets = {
+            pygame.K_LEFT: replay.ply - 1,
+            pygame.K_RIGHT: replay.ply + 1,
+            pygame.K_PAGEUP: replay.ply - 10,
+            pygame.K_PAGEDOWN: replay.ply + 10,
+            pygame.K_HOME: 0,
+            pygame.K_END: len(replay)
+        }
+        if key not in targets:
+            return False
+        replay.seek(targets[key])
+        self.show_replay_position()
+        return True
+
     #Load the next move from the pgn file which was loaded before
     def load_next_move(self):
         if self.current_move_index < len(self.pgn_moves) - 1:
@@ -486,18 +577,18 @@ class Game:
         # Draw current player indicator
         player_color = (0, 0, 0)
         player_text = f"{self.current_turn.capitalize()}'s turn"
-        player_surface = self.font_small.render(player_text, True, player_color)
+        player_surface = text_cache.render(self.font_small, player_text, player_color)
         self.screen.blit(player_surface, (self.board.width - 100, self.board.height + 30))
         
         # Draw input field label
-        label_surface = self.font.render("Input Move:", True, (0, 0, 0))
+        label_surface = text_cache.render(self.font, "Input Move:", (0, 0, 0))
         self.screen.blit(label_surface, (10, self.board.height + 30))
         
         input_field_rect = pygame.Rect(200, self.board.height + 25, 100, 30)
         pygame.draw.rect(self.screen, (240, 240, 240), input_field_rect)
         pygame.draw.rect(self.screen, (200, 200, 200), input_field_rect, 1)
         
-        input_surface = self.font.render(self.input_text, True, (0, 0, 0))
+        input_surface = text_cache.render(self.font, self.input_text, (0, 0, 0))
         self.screen.blit(input_surface, (205, self.board.height + 30))
 
         # Draw error message if exists
@@ -505,7 +596,7 @@ class Game:
             error_rect = pygame.Rect(320, self.board.height + 25, 300, 30)
             pygame.draw.rect(self.screen, (255, 200, 200), error_rect)
             pygame.draw.rect(self.screen, (255, 0, 0), error_rect, 1)
-            error_surface = self.font.render(self.error_message, True, (255, 0, 0))
+            error_surface = text_cache.render(self.font, self.error_message, (255, 0, 0))
             self.screen.blit(error_surface, (325, self.board.height + 30))
 
     #Draw the valid moves when clicked on a piece
@@ -522,140 +613,70 @@ class Game:
         self.screen.fill((255, 255, 255))
         
         # Render "Game Over" text
-        game_over_text = self.font.render("Game Over", True, (0, 0, 0))
+        game_over_text = text_cache.render(self.font, "Game Over", (0, 0, 0))
         game_over_rect = game_over_text.get_rect(center=(840/2, 840/2 - 30))
         self.screen.blit(game_over_text, game_over_rect)
         
         # Render game result text
-        result_text = self.font.render(self.game_result, True, (0, 0, 0))
+        result_string = self.game_result if self.game_end_reason is None else f"{self.game_result} ({self.game_end_reason.replace('_', ' ')})"
+        result_text = text_cache.render(self.font, result_string, (0, 0, 0))
         result_rect = result_text.get_rect(center=(840/2, 840/2 + 30))
         self.screen.blit(result_text, result_rect)
 
         # Render the save game button below the game result
         pygame.draw.rect(self.screen, (220, 220, 220), self.save_game_button)
         pygame.draw.rect(self.screen, (0, 0, 0), self.save_game_button, 2)
-        save_game_text = self.font.render("Save Game", True, (0, 0, 0))
+        save_game_text = text_cache.render(self.font, "Save Game", (0, 0, 0))
         save_text_rect = save_game_text.get_rect(center=self.save_game_button.center)
         self.screen.blit(save_game_text, save_text_rect)
 
+    #Play the computer move in the rook+king vs king endgame, a repetition is found by check_game_result.
+    #The search gets its time from the clock, which is updated afterwards so the thinking time is on white's clock
     def two_rooks_algorithm(self):
+        clock = self.clock if self.use_clock else None
+        chosen_move = choose_endgame_move(self.board, 'white', clock, len(self.gameMoves) // 2 + 1, self.ponderer)
+        self.update_clock()
+        if chosen_move is None:
+            return False
+        piece_type, from_pos, to_pos = chosen_move
+        if not self.board.move_piece(piece_type, from_pos, to_pos, 'white'):
+            return False
+        if clock is not None:
+            self.ponderer.start(self.board, 'white')
+        return True
 
-        # Helper: Manhattan distance between two positions.
-        def manhattan_distance(p1, p2):
-            return abs(p1[0] - p2[0]) + abs(p1[1] - p2[1])
-
-        # Helper: From a piece's valid moves, choose the move whose destination is
-        # closest (Manhattan distance) to the intended target.
-        def select_move(piece, intended_target, board):
-            valid_moves = piece.get_valid_moves(board)
-            if not valid_moves:
-                return None
-            best_move = None
-            best_distance = math.inf
-            for move in valid_moves:
-                # Destination of move as (row, col)
-                dest = (move.to_row, move.to_col)
-                d = manhattan_distance(dest, intended_target)
-                if d < best_distance:
-                    best_distance = d
-                    best_move = move
-            return best_move
-        
-        # Helper: Execute a move using board.move_piece and then update the repetition history.
-        def execute_move(piece_type, from_pos, to_pos, color):
-            success = self.board.move_piece(piece_type, from_pos, to_pos, color)
-            if success:
-                # Obtain a representation of the current board position.
-                pos_repr = self.board.get_position_representation()  # This must return a unique string.
-                # Initialize position_history if not already done.
-                if not hasattr(self, 'position_history'):
-                    self.position_history = {}
-                self.position_history[pos_repr] = self.position_history.get(pos_repr, 0) + 1
-                if self.position_history[pos_repr] >= 3:
-                    print("Threefold repetition detected. Declaring draw.")
-                    self.game_mode = 'done'
-                    self.game_result = 'draw'
-            return success
-
-
-        white_king = None
-        white_rook = None
-        black_king = None
-        for row in range(8):
-            for col in range(8):
-                piece = self.board.grid[row][col]
-                if piece and piece.type == PieceType.KING:
-                    if piece.color == 'white':
-                        white_king = piece
-                    else:
-                        black_king = piece
-                if piece and piece.type == PieceType.ROOK:
-                    white_rook = piece
+    #Milliseconds until the main loop has to wake up without any input, None if it can sleep until the next event
+    def time_until_next_frame(self):
+        if self.game_mode in (None, 'done') or not self.use_clock or self.clock is None:
+            return None
+        next_second = self.clock.time_until_next_second()
+        if next_second is None:
+            return None
+        #The clock is only updated when we wake up, so the time since the last update is already gone
+        return max(0, next_second - (pygame.time.get_ticks() - self.last_update))
 
-        if not white_king or not white_rook or not black_king:
-            print("Error piece not found")
+    #Update the clock and request a redraw when the displayed seconds changed
+    def update_clock(self):
+        if self.game_mode in (None, 'done') or not self.use_clock or self.clock is None:
             return
-        
-        # Get current positions (row, col) for each piece.
-        # Rows are 0-based with row 0 corresponding to rank 8 and row 7 to rank 1.
-        wk_r, wk_c = white_king.position
-        wr_r, wr_c = white_rook.position
-        bk_r, bk_c = black_king.position
-
-        # Compute how far the black king is from an edge in each direction.
-        dist_row = min(bk_r, 7 - bk_r)
-        dist_col = min(bk_c, 7 - bk_c)
-
-         # Decide which axis to restrict: if black king is further from an edge vertically, use a horizontal cutoff.
-        if dist_row >= dist_col:
-            # We'll restrict vertically by moving the rook to an edge row.
-            # Choose target row: if black king is in the upper half, aim for the top (row 0, rank 8);
-            # otherwise, aim for the bottom (row 7, rank 1).
-            target_r = 0 if bk_r <= 3 else 7
-            # Intended rook target is to move it to (target_r, current rook column)
-            intended_rook_target = (target_r, wr_c)
-            
-              
-            # If the rook is not already on that row, move it there.
-            if wr_r != target_r:
-                # Rook moves: Keep its current column.
-                chosen_move = select_move(white_rook, intended_rook_target, self.board)
-                if chosen_move is not None:
-                    return execute_move(white_rook.type, white_rook.position, 
-                            (chosen_move.to_row, chosen_move.to_col), 'white')
-             # Otherwise, if the rook is in place, move the king one square closer.
-            intended_king_target = (wk_r + (1 if bk_r > wk_r else -1 if bk_r < wk_r else 0),
-                                    wk_c + (1 if bk_c > wk_c else -1 if bk_c < wk_c else 0))
-            chosen_move = select_move(white_king, intended_king_target, self.board)
-            if chosen_move is not None:
-                return execute_move(white_king.type, white_king.position,
-                        (chosen_move.to_row, chosen_move.to_col), 'white')
-    
-        else:
-            # We'll restrict horizontally by moving the rook to an edge column.
-            # Choose target column: if black king is in the left half, aim for column 0 ('a'); otherwise, column 7 ('h').
-            target_c = 0 if bk_c <= 3 else 7
-            intended_rook_target = (wr_r, target_c)
-            if wr_c != target_c:
-                # Move the rook vertically: Keep its current row.
-                chosen_move = select_move(white_rook, intended_rook_target, self.board)
-                if chosen_move is not None:
-                    return execute_move(white_rook.type, white_rook.position, 
-                            (chosen_move.to_row, chosen_move.to_col), 'white')
-            # Otherwise, move the white king one square closer.
-            intended_king_target = (wk_r + (1 if bk_r > wk_r else -1 if bk_r < wk_r else 0),
-                                    wk_c + (1 if bk_c > wk_c else -1 if bk_c < wk_c else 0))
-            chosen_move = select_move(white_king, intended_king_target, self.board)
-            if chosen_move is not None:
-                return execute_move(white_king.type, white_king.position,
-                        (chosen_move.to_row, chosen_move.to_col), 'white')
-            
-         # If no legal move was found, return False.
-         #return false
+        now = pygame.time.get_ticks()
+        self.clock.update_clock(now - self.last_update)
+        self.last_update = now
+        if self.clock.white_time <= 0 or self.clock.black_time <= 0:
+            self.check_game_result()
+        clock_strings = (self.clock.get_white_time_string(), self.clock.get_black_time_string())
+        if clock_strings != self.drawn_clock_strings:
+            self.drawn_clock_strings = clock_strings
+            self.frame_scheduler.request_redraw()
 
     #MAIN LOOP OF THE GAME in this loop we handle all events and update the game
+    #We sleep until there is input or the clock has to be redrawn, so an idle window costs almost no cpu
     def update(self):
-        for event in pygame.event.get():
+        events = self.frame_scheduler.wait_for_events(self.time_until_next_frame())
+        self.update_clock()
+        if events:
+            self.frame_scheduler.request_redraw()
+        for event in events:
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -671,12 +692,28 @@ class Game:
                         self.handle_sidebar_click(event.pos)
                         self.handle_save_game_click(event.pos)
             elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F3:
+                    self.show_profiler = profiler.toggle()
+                    continue
+                if event.key == pygame.K_F4:
+                    self.export_profile()
+                    continue
                 if self.game_mode is None:
                     continue
+                if self.replay is not None and self.game_mode != 'done' and self.handle_replay_key(event.key):
+                    continue
                 if event.key == pygame.K_RETURN:
                     if not self.game_mode:
                         return
-                    if self.game_mode == 'two_rooks' and self.current_turn == 'white':
+                    if self.replay is not None:
+                        #The next move of the file, it was checked when the replay started
+                        if self.replay.ply < len(self.replay):
+                            self.replay.forward()
+                            if self.use_clock and self.clock is not None:
+                                self.clock.switch_player()
+                            self.show_replay_position()
+                            self.check_game_result()
+                    elif self.game_mode == 'two_rooks' and self.current_turn == 'white':
                         if self.two_rooks_algorithm():
                             self.gameMoves.append(self.input_text)
                             self.error_message = None
@@ -713,6 +750,16 @@ class Game:
                     if not self.use_pgn_file and len(self.input_text) < 9:
                         self.input_text += event.unicode
                         self.error_message = None
+        if self.game_mode == 'done':
+            #No pondering on a finished game, e.g. after a resignation or a loss on time
+            self.ponderer.stop()
+        if self.frame_scheduler.needs_redraw:
+            self.draw()
+            self.frame_scheduler.frame_done()
+
+    #Draw the current screen, this is only called by update when a redraw was requested
+    @profiler.timed('frame')
+    def draw(self):
         if self.game_mode is None:
             self.screen.fill((255, 255, 255))
             self.draw_startSelectButtons()
@@ -726,725 +773,137 @@ class Game:
             return
         self.board.print_board()
         self.draw_sidebar()
-        if self.use_clock and self.clock is not None:
-            self.clock.update_clock(pygame.time.get_ticks() - self.last_update)
-            self.last_update = pygame.time.get_ticks()
         self.draw_valid_moves()
         self.draw_input_field()
+        if self.show_profiler:
+            self.draw_profiler_overlay()
         pygame.display.flip()
 
+    #Draw the profiler timers and counters on top of the board (toggle with F3, export with F4)
+    def draw_profiler_overlay(self):
+        lines = profiler.summary_lines() or ["Profiler: no data yet"]
+        stats = move_cache.get_stats()
+        lines.append(f"move cache: {stats['size']}/{stats['max_size']} hit rate {stats['hit_rate']:.0%} ({stats['evictions']} evicted)")
+        line_height = self.font_small.get_linesize()
+        overlay = pygame.Surface((self.board.width, line_height * len(lines) + 10), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 170))
+        for i, line in enumerate(lines):
+            #These texts change every frame, so they don't go through the text cache
+            overlay.blit(self.font_small.render(line, True, (255, 255, 255)), (5, 5 + i * line_height))
+        self.screen.blit(overlay, (0, 0))
+
+    #Write the profiler data as json and as chrome trace next to the game
+    def export_profile(self):
+        directory = os.path.dirname(__file__)
+        profiler.export_json(os.path.join(directory, "profile.json"))
+        profiler.export_chrome_trace(os.path.join(directory, "profile_trace.json"))
+        logger.info("Profile written to %s", directory)
+
     #Check the game result, this is called when a move is played or when a button is clicked
     def check_game_result(self, force_draw=False, force_white_win=False, force_black_win=False):
         if force_draw:
             self.game_mode = 'done'
             self.game_result = 'draw'
+            self.game_end_reason = 'agreement'
             return True
         if force_white_win:
             self.game_mode = 'done'
             self.game_result = 'white_win'
+            self.game_end_reason = 'resignation'
             return True
         if force_black_win:
             self.game_mode = 'done'
             self.game_result = 'black_win'
+            self.game_end_reason = 'resignation'
             return True
-        if self.use_clock and self.clock is not None:
-            if self.clock.white_time <= 0:
-                self.game_mode = 'done'
-                self.game_result = 'black_win'
-                return True
-            if self.clock.black_time <= 0:
-                self.game_mode = 'done'
-                self.game_result = 'white_win'
-                return True
-        if self.board.is_checkmate('white'):
-            self.game_mode = 'done'
-            self.game_result = 'black_win'
-            return True
-        if self.board.is_checkmate('black'):
+        result, reason = get_termination(self.board, self.current_turn, self.clock if self.use_clock else None)
+        if result is not None:
+            logger.info("Game over: %s (%s)", result, reason)
             self.game_mode = 'done'
-            self.game_result = 'white_win'
+            self.game_result = result
+            self.game_end_reason = reason
             return True
         return False
 
     #Parse move entered by the user in standard chess notation and play it with the board functions,
     #Give error messages if the move is invalid
     def play_move(self, text_move):
-        #Convert row and column to 0-7 range
-        file_map = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
-        success = False  # We'll set this True if we successfully do a move.
-        try:
-            # 1) Handle castling
-            if text_move == "O-O":  # Kingside castling
-                rank = 7 if self.current_turn == 'white' else 0
-                color = self.current_turn
-                king_to = (rank, 6)  # g1/g8
-                rook_to = (rank, 5)  # f1/f8
-
-                # Find the king
-                king_pos = None
-                for col in range(8):
-                    piece = self.board.grid[rank][col]
-                    if piece and piece.type == PieceType.KING and piece.color == color:
-                        king_pos = (rank, col)
-                        break
-
-                # Find the rook to the right of the king
-                rook_pos = None
-                if king_pos:
-                    for col in range(king_pos[1] + 1, 8):
-                        piece = self.board.grid[rank][col]
-                        if piece and piece.type == PieceType.ROOK and piece.color == color:
-                            rook_pos = (rank, col)
-                            break
-
-                # Attempt castling if we found king and rook
-                if king_pos and rook_pos:
-                    success = self.board.castle(
-                        king_from=king_pos,
-                        king_to=king_to,
-                        rook_from=rook_pos,
-                        rook_to=rook_to,
-                        current_turn=self.current_turn
-                    )
-
-                if not success:
-                    self.error_message = "Invalid castling move"
-                    return  False# or you could raise an exception, or handle differently
-                return success
-
-            elif text_move == "O-O-O":  # Queenside castling
-                rank = 7 if self.current_turn == 'white' else 0
-                color = self.current_turn
-                king_to = (rank, 2)  # c1/c8
-                rook_to = (rank, 3)  # d1/d8
-
-                # Find the king
-                king_pos = None
-                for col in range(8):
-                    piece = self.board.grid[rank][col]
-                    if piece and piece.type == PieceType.KING and piece.color == color:
-                        king_pos = (rank, col)
-                        break
-
-                # Find the rook to the left of the king
-                rook_pos = None
-                if king_pos:
-                    for col in range(king_pos[1] - 1, -1, -1):
-                        piece = self.board.grid[rank][col]
-                        if piece and piece.type == PieceType.ROOK and piece.color == color:
-                            rook_pos = (rank, col)
-                            break
-
-                # Attempt castling if we found king and rook
-                if king_pos and rook_pos:
-                    success = self.board.castle(
-                        king_from=king_pos,
-                        king_to=king_to,
-                        rook_from=rook_pos,
-                        rook_to=rook_to,
-                        current_turn=self.current_turn
-                    )
-
-                if not success:
-                    self.error_message = "Invalid castling move"
-                    return False
-                return True
-
-            # 2) If it's not a castling move, handle normal moves here.
-            else:
-                # parse something like "e2e4", call your regular move function, etc.
-                # If that move succeeds, set success = True
-                pass
-
-            # 3) If we reach here, we either castled successfully or did a normal move.
-            #    You can do additional steps, like toggling self.current_turn from white <-> black.
-            if success:
-                self.current_turn = 'black' if self.current_turn == 'white' else 'white'
-            else:
-                # Possibly handle normal moves or print some error message for invalid normal move
-                pass
-
-
-            #We save if there is a check or checkmate and at the end we check if there is a check or checkmate on our side
-            is_check = '+' in text_move
-            is_checkmate = '#' in text_move
-            # Remove check/checkmate symbols
-            text_move = text_move.replace('+', '').replace('#', '')
-
-            # Handle pawn promotion
-            #We do the move and then we check for promotion
-            promotion_type = None
-            if '=' in text_move:
-                move_part, promotion_part = text_move.split('=')
-                #We remove the = and the promotion part
-                text_move = move_part
-                piece_map = {
-                    'Q': PieceType.QUEEN,
-                    'R': PieceType.ROOK,
-                    'B': PieceType.BISHOP,
-                    'N': PieceType.KNIGHT
-                }
-                promotion_type = piece_map[promotion_part]
-            
-            # Handle captures
-            is_capture = 'x' in text_move
-            #We remove the x
-            text_move = text_move.replace('x', '')
-
-            # Handle basic pawn moves and captures these are just the first two letters of the move
-            if len(text_move) == 2 and text_move[0].lower() in file_map:  # e.g., "e4"
-                # We get the file from the map. The rank is the secind char but bc. we start at the top left we need to subtract it from 8
-                file = file_map[text_move[0].lower()]
-                rank = 8 - int(text_move[1])
-                from_rank = None
-                #We move the pawn and then we check if there is a promotion
-                success = self.board.move_piece(PieceType.PAWN, (from_rank, file), (rank, file), self.current_turn)
-                if not success:
-                    self.error_message = "Invalid pawn move"
-                if success and promotion_type:
-                    success = self.board.promote_pawn(promotion_type, (rank, file))
-                    if not success:
-                        self.error_message = "Invalid pawn promotion"
-                return success
-
-            # Handle pawn captures (e.g., "exd5") the x is already removed. When the first char is in the file_map we know it is a pawn capture
-            elif len(text_move) == 3 and text_move[0] in file_map and is_capture:
-                src_file = None
-                src_rank = None
-                if text_move[0].isalpha():
-                    src_file = file_map[text_move[0]]
-                    src_rank = None
-                else:
-                    src_file = None
-                    src_rank = 8 - int(text_move[0])
-                dest_file = file_map[text_move[1]]
-                dest_rank = 8 - int(text_move[2])
-                success = self.board.move_piece_capture(PieceType.PAWN, (src_rank, src_file), (dest_rank, dest_file), self.current_turn)
-                if success and promotion_type:
-                    success = self.board.promote_pawn(promotion_type, (dest_rank, dest_file))
-                    if not success:
-                        self.error_message = "Invalid pawn promotion"
-                if not success:
-                    self.error_message = "Invalid pawn capture"
-                return success
-
-            # Handle piece moves other than pawn with possible disambiguation
-            else:
-                piece_map = {
-                    'K': PieceType.KING,
-                    'Q': PieceType.QUEEN,
-                    'R': PieceType.ROOK,
-                    'B': PieceType.BISHOP,
-                    'N': PieceType.KNIGHT
-                }
-                
-                #Check if the first char is a piece. when not this is invalid
-                if text_move[0] in piece_map:
-                    piece_type = piece_map[text_move[0]]
-                    dest_file = file_map[text_move[-2]]
-                    dest_rank = 8 - int(text_move[-1])
-                    
-                    # Handle disambiguation (e.g., "Nbd7" or "R1e2")
-                    src_file = None
-                    src_rank = None
-                    #If there is a second char we know it is a disambiguation
-                    if len(text_move) == 4:
-                        if text_move[1].isalpha():
-                            src_file = file_map[text_move[1].lower()]
-                        else:
-                            src_rank = 8 - int(text_move[1])
-                    #src_rank and src_file will be None if there is no disambiguation. the logic will be handled in the move_piece function
-                    if is_capture:
-                        success = self.board.move_piece_capture(piece_type, (src_rank, src_file), (dest_rank, dest_file), self.current_turn)
-                        if not success:
-                            self.error_message = f"Invalid {piece_type.name.lower()} capture"
-                    else:
-                        success = self.board.move_piece(piece_type, (src_rank, src_file), (dest_rank, dest_file), self.current_turn)
-                        if not success:
-                            self.error_message = f"Invalid {piece_type.name.lower()} move"
-                    return success
-                else:
-                    self.error_message = "Invalid piece notation"
-                    return False
-
-            #If the move is not handled by the above, it is invalid
-            self.error_message = "Invalid move format"
-            return False
-        
-        except (KeyError, ValueError, IndexError):
-            self.error_message = "Invalid move syntax"
-            return False
-
-
-class Board:
+        success, error_message = play_san(self.board, text_move, self.current_turn)
+        if not success:
+            self.error_message = error_message
+        return success
+
+
+#All piece images packed into one surface. The atlas is built once per process on first use and
+#the scaled images are cached per square size, so creating a new board or resizing never reloads files.
+class PieceAtlas:
+    PIECE_NAMES = {
+        PieceType.PAWN: 'pawn',
+        PieceType.KNIGHT: 'knight',
+        PieceType.BISHOP: 'bishop',
+        PieceType.ROOK: 'rook',
+        PieceType.QUEEN: 'queen',
+        PieceType.KING: 'king'
+    }
+    COLORS = ['white', 'black']
+    #Size of one cell in the atlas, the source pngs are much bigger than any square we draw
+    CELL_SIZE = 256
+
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+        self.atlas = None
+        self.scaled_images = {}
+
+    #Load all pngs and blit them into the atlas, row 0 are the white pieces and row 1 the black pieces
+    def load(self):
+        if self.atlas is not None:
+            return self.atlas
+        cell = self.CELL_SIZE
+        atlas = pygame.Surface((cell * len(self.PIECE_NAMES), cell * len(self.COLORS)), pygame.SRCALPHA)
+        for row, color in enumerate(self.COLORS):
+            for col, name in enumerate(self.PIECE_NAMES.values()):
+                image = pygame.image.load(os.path.join(self.image_dir, f"{color}_{name}.png"))
+                atlas.blit(pygame.transform.smoothscale(image, (cell, cell)), (col * cell, row * cell))
+        self.atlas = atlas
+        return atlas
+
+    #Returns a dict (color, PieceType) -> image with the given square size
+    def get_images(self, square_size):
+        images = self.scaled_images.get(square_size)
+        if images is not None:
+            return images
+        atlas = self.load()
+        #We scale the whole atlas once and cut the pieces out of it
+        scaled_atlas = pygame.transform.smoothscale(atlas, (square_size * len(self.PIECE_NAMES), square_size * len(self.COLORS)))
+        if pygame.display.get_surface() is not None:
+            scaled_atlas = scaled_atlas.convert_alpha()
+        images = {}
+        for row, color in enumerate(self.COLORS):
+            for col, piece_type in enumerate(self.PIECE_NAMES):
+                rect = (col * square_size, row * square_size, square_size, square_size)
+                images[(color, piece_type)] = scaled_atlas.subsurface(rect)
+        self.scaled_images[square_size] = images
+        return images
+
+
+piece_atlas = PieceAtlas(os.path.join(os.path.dirname(__file__), "Figuren"))
+
+
+class Board(RulesBoard):
     def __init__(self, width, height, screen):
-        self.grid: list[list[Piece | None]] = [[None for _ in range(8)] for _ in range(8)]
+        super().__init__()
         self.square_size = width // 8
         self.screen = screen
         self.width = width
         self.height = height
-        self.whiteInCheck = False
-        self.blackInCheck = False
-        self.game_mode: str | None = None
-        
-        # Cache for piece images
-        self.piece_images = {}
-        self.load_piece_images()
-    def get_position_representation(self):
-            """
-            Returns a string representation of the board.
-            Each square is represented by two characters:
-            - ".." for an empty square,
-            - Otherwise, the first letter of the piece's color and the first letter of its type.
-            Rows are concatenated with newline characters.
-            """
-            rep = ""
-            for row in range(8):
-                for col in range(8):
-                    piece = self.grid[row][col]
-                    if piece is None:
-                        rep += ".."
-                    else:
-                        # Assume piece.color is a string like 'white' or 'black'
-                        # and piece.type.name gives a string like "KING" or "ROOK".
-                        rep += piece.color[0] + piece.type.name[0]
-                rep += "\n"
-            return rep
-
-
-    def load_piece_images(self):
-        # Load and scale all piece images once
-        piece_types = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
-        colors = ['white', 'black']
-        
-        for color in colors:
-            for piece_type in piece_types:
-                pre_string = f"{color}_{piece_type}"
-                image_path = os.path.join(os.path.dirname(__file__), f"Figuren/{pre_string}.png")
-                image = pygame.image.load(image_path)
-                scaled_image = pygame.transform.scale(image, (self.square_size, self.square_size))
-                self.piece_images[pre_string] = scaled_image
-
-    def setup_pieces(self):
-        #We setup the pieces in the starting position
-        white_pieces = [
-            Piece('white', (7, 0), PieceType.ROOK),
-            Piece('white', (7, 1), PieceType.KNIGHT),
-            Piece('white', (7, 2), PieceType.BISHOP),
-            Piece('white', (7, 3), PieceType.QUEEN),
-            Piece('white', (7, 4), PieceType.KING),
-            Piece('white', (7, 5), PieceType.BISHOP),
-            Piece('white', (7, 6), PieceType.KNIGHT),
-            Piece('white', (7, 7), PieceType.ROOK),
-            Piece('white', (6, 0), PieceType.PAWN),
-            Piece('white', (6, 1), PieceType.PAWN), 
-            Piece('white', (6, 2), PieceType.PAWN),
-            Piece('white', (6, 3), PieceType.PAWN),
-            Piece('white', (6, 4), PieceType.PAWN),
-            Piece('white', (6, 5), PieceType.PAWN),
-            Piece('white', (6, 6), PieceType.PAWN),
-            Piece('white', (6, 7), PieceType.PAWN)
-        ]
-        black_pieces = [
-            Piece('black', (0, 0), PieceType.ROOK),
-            Piece('black', (0, 1), PieceType.KNIGHT),
-            Piece('black', (0, 2), PieceType.BISHOP),
-            Piece('black', (0, 3), PieceType.QUEEN),
-            Piece('black', (0, 4), PieceType.KING),
-            Piece('black', (0, 5), PieceType.BISHOP),
-            Piece('black', (0, 6), PieceType.KNIGHT),
-            Piece('black', (0, 7), PieceType.ROOK),
-            Piece('black', (1, 0), PieceType.PAWN),
-            Piece('black', (1, 1), PieceType.PAWN),
-            Piece('black', (1, 2), PieceType.PAWN),
-            Piece('black', (1, 3), PieceType.PAWN),
-            Piece('black', (1, 4), PieceType.PAWN),
-            Piece('black', (1, 5), PieceType.PAWN),
-            Piece('black', (1, 6), PieceType.PAWN),
-            Piece('black', (1, 7), PieceType.PAWN)
-        ]
-        #We add the pieces to the grid
-        for piece in white_pieces:
-            self.grid[piece.position[0]][piece.position[1]] = piece
-        for piece in black_pieces:
-            self.grid[piece.position[0]][piece.position[1]] = piece
- 
-    # starting position rules: 
-    # pawns are in their usual position
-    # bishops must be on opposite-colored squares
-    # king must be between the two rooks
-
-    def setup_fischer_random(self):
-        print("Fischer Random")      
-        # set up pawns 
-        black_pieces = [
-            Piece('black', (1, 0), PieceType.PAWN),
-            Piece('black', (1, 1), PieceType.PAWN),
-            Piece('black', (1, 2), PieceType.PAWN),
-            Piece('black', (1, 3), PieceType.PAWN),
-            Piece('black', (1, 4), PieceType.PAWN),
-            Piece('black', (1, 5), PieceType.PAWN),
-            Piece('black', (1, 6), PieceType.PAWN),
-            Piece('black', (1, 7), PieceType.PAWN)
-        ]
-        white_pieces = [
-            Piece('white', (6, 0), PieceType.PAWN),
-            Piece('white', (6, 1), PieceType.PAWN), 
-            Piece('white', (6, 2), PieceType.PAWN),
-            Piece('white', (6, 3), PieceType.PAWN),
-            Piece('white', (6, 4), PieceType.PAWN),
-            Piece('white', (6, 5), PieceType.PAWN),
-            Piece('white', (6, 6), PieceType.PAWN),
-            Piece('white', (6, 7), PieceType.PAWN)
-        ]
-
-        # set up white & black bank-rank pieces 
-
-        numbers = list(range(8))  # [0, 1, 2, ..., 8]
-
-        # set up bishops 
-        bish_pos = random.randint(0, 7)
-       
-        if bish_pos%2 == 0: # if bishop is on pink
-            bish_pos2 = random.choice([1, 3, 5, 7,])
-        else:
-            bish_pos2 = random.choice([0, 2, 4, 6])
-        
-        white_pieces.append(Piece('white',(7, bish_pos), PieceType.BISHOP))
-        white_pieces.append(Piece('white',(7, bish_pos2), PieceType.BISHOP))
-        black_pieces.append(Piece('black',(0, bish_pos), PieceType.BISHOP))
-        black_pieces.append(Piece('black',(0, bish_pos2), PieceType.BISHOP))
-
-        numbers.remove(bish_pos)
-        numbers.remove(bish_pos2)
-
-        # set rooks 
-        rook_pos = random.choice(numbers)
-        index = numbers.index(rook_pos)
-        numbers.remove(rook_pos)
-        valid_choices = []
-        for i, num in enumerate(numbers):
-             if abs(i - index) > 1:  # not same index, not neighbor
-                 valid_choices.append(num)
-
-        rook_pos2 = random.choice(valid_choices)
-
-        white_pieces.append(Piece('white', (7, rook_pos), PieceType.ROOK))
-        white_pieces.append(Piece('white', (7, rook_pos2), PieceType.ROOK))
-        black_pieces.append(Piece('black', (0, rook_pos), PieceType.ROOK))
-        black_pieces.append(Piece('black', (0, rook_pos2), PieceType.ROOK))
-        numbers.remove(rook_pos2)
-    
-        # set king
-        # Determine the lower and upper bounds
-        lower = min(rook_pos, rook_pos2)
-        upper = max(rook_pos, rook_pos2)
-        valid_choices2= [num for num in numbers if lower < num < upper]
-        king_pos = random.choice(valid_choices2)
-
-        white_pieces.append(Piece('white', (7, king_pos), PieceType.KING))
-        black_pieces.append(Piece('black', (0, king_pos), PieceType.KING))
-        numbers.remove(king_pos)
-
-        # set Queen
-        queen_pos = random.choice(numbers)
-
-        white_pieces.append(Piece('white', (7, queen_pos), PieceType.QUEEN))
-        black_pieces.append(Piece('black', (0, queen_pos), PieceType.QUEEN))
-        numbers.remove(queen_pos)
-
-        # set knight
-        knight_pos = random.choice(numbers)
-        numbers.remove(knight_pos)
-        knight_pos2 = random.choice(numbers)
-
-        white_pieces.append(Piece('white', (7, knight_pos), PieceType.KNIGHT))
-        white_pieces.append(Piece('white', (7, knight_pos2), PieceType.KNIGHT))
-        black_pieces.append(Piece('black', (0, knight_pos), PieceType.KNIGHT))
-        black_pieces.append(Piece('black', (0, knight_pos2), PieceType.KNIGHT))
-        
-        numbers.remove(knight_pos2)
-
+        self.label_font = None
 
-        for piece in white_pieces:
-            self.grid[piece.position[0]][piece.position[1]] = piece
-        for piece in black_pieces:
-            self.grid[piece.position[0]][piece.position[1]] = piece
-
-
-
-
-    def setup_two_rooks(self):
-        # Place white king (must not be in check)
-        while True:
-            wk_row, wk_col = random.randint(0, 7), random.randint(0, 7)
-            # King ssollte nicht bei der Edge
-            if 1 <= wk_row <= 6 and 1 <= wk_col <= 6:
-                break
-        
-        # Place black king (must not attack white king and not adjacent)
-        while True:
-            bk_row, bk_col = random.randint(0, 7), random.randint(0, 7)
-            # Check distance between kings (must be at least 1 square apart)
-            if (abs(wk_row - bk_row) > 1 or abs(wk_col - bk_col) > 1):
-                # Also make sure black king isn't in check by potential rook
-                break
-        
-        # Place white rook 
-        while True:
-            wr_row, wr_col = random.randint(0, 7), random.randint(0, 7)
-            # Rook kann nicht bei den Kings sein 
-            if (wr_row, wr_col) != (wk_row, wk_col) and (wr_row, wr_col) != (bk_row, bk_col):
-                
-                if wr_row != bk_row and wr_col != bk_col:
-                    break
-        
-        # Place the pieces
-        self.grid[wk_row][wk_col] = Piece('white', (wk_row, wk_col), PieceType.KING)
-        self.grid[wr_row][wr_col] = Piece('white', (wr_row, wr_col), PieceType.ROOK)
-        self.grid[bk_row][bk_col] = Piece('black', (bk_row, bk_col), PieceType.KING)
-        
-        # Verify the position is valid (no checks)
-        if self.is_check('black') or self.is_check('white'):
-            # If invalid, try again recursively (should rarely happen)
-            return self.setup_two_rooks()
-
-    def move_piece(self, piece_type: PieceType, from_pos: tuple[int | None, int | None], to_pos: tuple[int, int], current_turn: str) -> bool:
-        # Find all pieces that match the type and position constraints
-        candidate_pieces = []
-        
-        for row in range(8):
-            for col in range(8):
-                piece = self.grid[row][col]
-                if (piece and 
-                    piece.type == piece_type and 
-                    piece.color == current_turn and  # Make sure it's the current player's piece
-                    (from_pos[0] is None or from_pos[0] == row) and  # Match rank if specified
-                    (from_pos[1] is None or from_pos[1] == col)):    # Match file if specified
-
-                    # Check if this piece can actually move to the target
-                    valid_moves = piece.get_valid_moves(self)
-                    for move in valid_moves:
-                        if move.to_row == to_pos[0] and move.to_col == to_pos[1] and move.is_capture == False:
-                            candidate_pieces.append((piece, move))
-        
-        # If there's exactly one candidate, make the move
-        if len(candidate_pieces) == 1:
-            piece, move = candidate_pieces[0]
-            if piece.type == PieceType.PAWN and piece.has_moved == False and (move.to_row == 3 or move.to_row == 4):
-                piece.pawn_has_moved_two_squares_last_turn = True
-            # Make the move
-            self.grid[move.to_row][move.to_col] = piece
-            self.grid[move.from_row][move.from_col] = None
-            piece.position = (move.to_row, move.to_col)
-            #if we moved a piece and we are in check, we undo the move
-            if self.is_check(piece.color):
-                self.grid[move.to_row][move.to_col] = None
-                self.grid[move.from_row][move.from_col] = piece
-                piece.position = (move.from_row, move.from_col)
-                return False
-            piece.has_moved = True
-            return True
-        
-        return False
-
-    def move_piece_capture(self, piece_type: PieceType, from_pos: tuple[int | None, int | None], to_pos: tuple[int, int], current_turn: str) -> bool:
-        if piece_type == PieceType.PAWN:
-            print(from_pos, to_pos)
-        candidate_pieces = []
-        
-        for row in range(8):
-            for col in range(8):
-                piece = self.grid[row][col]
-                if (piece and 
-                    piece.type == piece_type and 
-                    piece.color == current_turn and  # Make sure it's the current player's piece
-                    (from_pos[0] is None or from_pos[0] == row) and  # Match rank if specified
-                    (from_pos[1] is None or from_pos[1] == col)):    # Match file if specified
-                    
-                    # Check if this piece can actually move to the target
-                    valid_moves = piece.get_valid_moves(self)
-                    for move in valid_moves:
-                        if piece_type == PieceType.PAWN:
-                            print(move.to_row, move.to_col)
-                        #We check if the move is a capture
-                        if move.to_row == to_pos[0] and move.to_col == to_pos[1] and move.is_capture == True:
-                            candidate_pieces.append((piece, move))
-        
-        # If there's exactly one candidate, make the move
-        if len(candidate_pieces) == 1:
-            piece, move = candidate_pieces[0]
-            piece_before = self.grid[move.to_row][move.to_col]
-            if move.is_enPassant:
-                self.grid[move.from_row][move.to_col] = None
-            # Make the move
-            self.grid[move.to_row][move.to_col] = piece
-            self.grid[move.from_row][move.from_col] = None
-            #if we moved a piece and we are in check, we undo the move
-            if self.is_check(piece.color):
-                self.grid[move.to_row][move.to_col] = piece_before
-                self.grid[move.from_row][move.from_col] = piece
-                piece.position = (move.from_row, move.from_col)
-                return False
-            piece.position = (move.to_row, move.to_col)
-            piece.has_moved = True
-            return True
-        
-        return False
-
-    def castle(self, king_from: tuple[int, int], king_to: tuple[int, int],
-            rook_from: tuple[int, int], rook_to: tuple[int, int],
-            current_turn: str) -> bool:
-        # Retrieve the king and rook from the board.
-        king = self.grid[king_from[0]][king_from[1]]
-        rook = self.grid[rook_from[0]][rook_from[1]]
-
-        # 1) Verify that the pieces are correct.
-        if not king or king.type != PieceType.KING:
-            return False
-        if not rook or rook.type != PieceType.ROOK:
-            return False
-
-        # 2) Check if they have moved before.
-        if king.has_moved or rook.has_moved:
-            return False
-
-        # 3) They must be on the same row (no vertical castling).
-        if king_from[0] != rook_from[0]:
-            return False
-        row = king_from[0]
-
-        # 4) Ensure all squares between the king and rook are empty (except king/rook).
-        #    We only check the *strictly* in-between squares.
-        col_start = min(king_from[1], rook_from[1]) + 1
-        col_end = max(king_from[1], rook_from[1])
-        for col in range(col_start, col_end):
-            if self.grid[row][col] is not None:
-                return False
-
-        # 5) Ensure the king is not currently in check.
-        if (current_turn == 'white' and self.whiteInCheck) or \
-        (current_turn == 'black' and self.blackInCheck):
-            return False
-
-        # 6) Check that none of the squares the king passes through (including destination)
-        #    are under attack.
-        step = 1 if king_to[1] > king_from[1] else -1
-        for col in range(king_from[1] + step, king_to[1] + step, step):
-            if self.is_square_under_attack(king.color, row, col):
-                return False
-
-        # 7) Ensure the final squares (king_to, rook_to) are empty
-        #    (Castling cannot capture any piece, whether friendly or enemy.)
-        if self.grid[king_to[0]][king_to[1]] is not None:
-            return False
-        if self.grid[rook_to[0]][rook_to[1]] is not None:
-            return False
-
-        # --- If we reach here, castling is valid. Perform the move. ---
-        self.grid[king_to[0]][king_to[1]] = king
-        self.grid[king_from[0]][king_from[1]] = None
-        king.position = king_to
-        king.has_moved = True
-
-        self.grid[rook_to[0]][rook_to[1]] = rook
-        self.grid[rook_from[0]][rook_from[1]] = None
-        rook.position = rook_to
-        rook.has_moved = True
-
-        return True
-
-    def promote_pawn(self, piece_type: PieceType, pos: tuple[int, int]) -> bool:
-        piece = self.grid[pos[0]][pos[1]]
-        # Check that there's a pawn at the specified position
-        if not piece or piece.type != PieceType.PAWN:
-            return False
-        
-        # Check that the pawn is at the last rank
-        if (piece.color == 'white' and pos[0] != 0) or (piece.color == 'black' and pos[0] != 7):
-            return False
-        
-        # Promote the pawn
-        piece.type = piece_type
-        return True
-
-    def get_king_position(self, color: str) -> tuple[int, int] | None:
-        for row in range(8):
-            for col in range(8):
-                piece = self.grid[row][col]
-                if piece and piece.type == PieceType.KING and piece.color == color:
-                    return (row, col)
-        return None
-
-    #Checks if the king is in check of the given color
-    def is_check(self, color: str) -> bool:
-        king = self.get_king_position(color)
-        if not king:
-            return False
-        opponent_color = 'black' if color == 'white' else 'white'
-        for row in range(8):
-            for col in range(8):
-                piece = self.grid[row][col]
-                if piece and piece.color == opponent_color:
-                    valid_moves = piece.get_valid_moves(self)
-                    for move in valid_moves:
-                        if move.to_row == king[0] and move.to_col == king[1]:
-                            return True
-        return False
-                    
-    #Checks if the king is in checkmate of the given color
-    def is_checkmate(self, color: str) -> bool:
-        king_pos = self.get_king_position(color)
-        if not king_pos:
-            return False
-        
-        if not self.is_check(color):
-            return False
-
-        for row in range(8):
-            for col in range(8):
-                piece = self.grid[row][col]
-                if piece and piece.color == color:
-                    valid_moves = piece.get_valid_moves(self)
-                    for move in valid_moves:
-                        #Try to do the move and check if it is a check
-                        original_piece = self.grid[move.to_row][move.to_col]
-                        self.grid[move.to_row][move.to_col] = piece
-                        self.grid[move.from_row][move.from_col] = None
-                        old_position = piece.position
-                        piece.position = (move.to_row, move.to_col)
-                        if not self.is_check(color):
-                            self.grid[move.from_row][move.from_col] = piece
-                            self.grid[move.to_row][move.to_col] = original_piece
-                            piece.position = old_position
-                            return False
-                        #Undo the move
-                        self.grid[move.from_row][move.from_col] = piece
-                        self.grid[move.to_row][move.to_col] = original_piece
-                        piece.position = old_position
-                        
-        return True
-
-    #Checks if a square is under attack by any piece of the opposite color. we need this to see if we can castle
-    def is_square_under_attack(self, color: str, row: int, col: int) -> bool:
-        opponent_color = 'black' if color == 'white' else 'white'
-        
-        for r in range(8):
-            for c in range(8):
-                piece = self.grid[r][c]
-                if piece and piece.color == opponent_color:
-                    # Check if this piece can attack the square
-                    valid_moves = piece.get_valid_moves(self)
-                    for move in valid_moves:
-                        if move.to_row == row and move.to_col == col:
-                            return True
-        
-        return False
 
     #print the game with pygame
     def print_board(self):
         WHITE = (240, 217, 181)
         PINK = (255, 166, 201)
+        CHECK_RED = (200, 30, 30)
         self.screen.fill(WHITE)
         
         # Draw board squares
@@ -1455,168 +914,46 @@ class Board:
                 else:
                     color = (PINK)
                 pygame.draw.rect(self.screen, color, (col * self.square_size, row * self.square_size, self.square_size, self.square_size))
+
+        # Mark a king in check and the pieces that give check, the check state is kept up to date by the moves
+        for king_color in ('white', 'black'):
+            if self.in_check(king_color):
+                for row, col in [self.get_king_position(king_color)] + self.checkers(king_color):
+                    pygame.draw.rect(self.screen, CHECK_RED, (col * self.square_size, row * self.square_size, self.square_size, self.square_size), 4)
         
-        # Draw pieces using cached images
+        # Draw pieces using the images from the atlas, they are scaled the first time this square size is drawn
+        piece_images = piece_atlas.get_images(self.square_size)
         for row in range(8):
             for col in range(8):
                 piece = self.grid[row][col]
                 if piece:
-                    piece_types = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
-                    pre_string = "white_" if piece.color == "white" else "black_"
-                    pre_string = pre_string + piece_types[piece.type.value - 1]
-                    # Use cached image
-                    self.screen.blit(self.piece_images[pre_string], (col * self.square_size, row * self.square_size))
+                    self.screen.blit(piece_images[(piece.color, piece.type)], (col * self.square_size, row * self.square_size))
                         
-        # Draw coordinates
-        font = pygame.font.SysFont(None, 24)
+        # Draw coordinates, the font is created once because SysFont has to search the system fonts
+        if self.label_font is None:
+            self.label_font = pygame.font.SysFont(None, 24)
+        font = self.label_font
         
         # Draw column labels (a-h)
         for col in range(8):
             label = chr(ord('a') + col)
-            text = font.render(label, True, (0, 0, 0))
+            text = text_cache.render(font, label, (0, 0, 0))
             text_rect = text.get_rect(center=(col * self.square_size + self.square_size // 2, self.height + 5))
             self.screen.blit(text, text_rect)
         
         # Draw row labels (1-8)
         for row in range(8):
             label = str(8 - row)  # 8-1 from top to bottom
-            text = font.render(label, True, (0, 0, 0))
+            text = text_cache.render(font, label, (0, 0, 0))
             text_rect = text.get_rect(center=(5, row * self.square_size + self.square_size // 2))
             self.screen.blit(text, text_rect)
 
-#This class is used to store the move when we get the valid moves
-class Move:
-    def __init__(self, from_col, from_row, to_col, to_row, is_capture, is_enPassant=False):
-        self.from_col = from_col
-        self.from_row = from_row
-        self.to_col = to_col
-        self.to_row = to_row
-        self.is_capture = is_capture
-        self.is_enPassant = is_enPassant
-
-class Piece:
-    def __init__(self, color, position, type):
-        self.color = color
-        self.position = position
-        self.type = type
-        self.has_moved = False
-        self.pawn_has_moved_two_squares_last_turn = False
-
-    def get_valid_moves(self, board) -> list[Move]:
-        valid_moves = []  # List of tuples (row, col, is_capture)
-        row, col = self.position
-        opponent_color = 'black' if self.color == 'white' else 'white'
-        if self.type == PieceType.PAWN:
-            direction = -1 if self.color == 'white' else 1
-            start_row = 6 if self.color == 'white' else 1
-
-            # One square forward without captures for that: 1. Square has to be valid 2. Square has to be empty
-            if 0 <= row + direction < 8 and board.grid[row + direction][col] is None:
-                valid_moves.append(Move(col, row, col, row + direction, False))
-                # Two squares forward from starting position
-                if row == start_row and board.grid[row + 2*direction][col] is None:
-                    valid_moves.append(Move(col, row, col, row + 2*direction, False))
-            
-            # Captures (diagonally) for that: 1. Square has to be valid 2. Square has to have an opponent piece
-            for capture_col in [col-1, col+1]:
-                if 0 <= capture_col < 8 and 0 <= row + direction < 8:
-                    target = board.grid[row + direction][capture_col]
-                    if target and target.color == opponent_color:
-                        valid_moves.append(Move(col, row, capture_col, row + direction, True))
-
-            #En passant
-            if col-1 >= 0 and board.grid[row][col-1] is not None and board.grid[row][col-1].type == PieceType.PAWN and board.grid[row][col-1].pawn_has_moved_two_squares_last_turn == True:
-                valid_moves.append(Move(col, row, col-1, row + direction, True, True))
-            if col+1 < 8 and board.grid[row][col+1] is not None and board.grid[row][col+1].type == PieceType.PAWN and board.grid[row][col+1].pawn_has_moved_two_squares_last_turn == True:
-                valid_moves.append(Move(col, row, col+1, row + direction, True, True))
-
-        elif self.type == PieceType.KNIGHT:
-             # Knights move in L-shape
-            moves = [
-                (-2, -1), (-2, 1), (-1, -2), (-1, 2),
-                (1, -2), (1, 2), (2, -1), (2, 1)
-            ]
-            for move_row, move_col in moves:
-                new_row, new_col = row + move_row, col + move_col
-                #We check if the move is valid: 1. Square has to be on the board 2. Square has to be empty or have an opponent piece
-                if (0 <= new_row < 8 and 0 <= new_col < 8):
-                    if board.grid[new_row][new_col] is None:
-                        valid_moves.append(Move(col, row, new_col, new_row, False))
-                    elif board.grid[new_row][new_col].color != self.color:
-                        valid_moves.append(Move(col, row, new_col, new_row, True))
-        elif self.type == PieceType.BISHOP:
-            # Check all diagonal directions
-            directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-            for dir_row, dir_col in directions:
-                # Start from current position and look along entire diagonal
-                new_row, new_col = row, col
-                while True:
-                    new_row += dir_row
-                    new_col += dir_col
-                    # Stop if we go off the board
-                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
-                        break
-                    # Empty square is valid move
-                    if board.grid[new_row][new_col] is None:
-                        valid_moves.append(Move(col, row, new_col, new_row, False))
-                    # Square has a piece
-                    else:
-                        # Can capture opponent piece but then must stop
-                        if board.grid[new_row][new_col].color != self.color:
-                            valid_moves.append(Move(col, row, new_col, new_row, True))
-                        break
-        elif self.type == PieceType.ROOK:
-            # Same logic as bishop but only for the horizontal and vertical directions
-            directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-            for dir_row, dir_col in directions:
-                new_row, new_col = row, col
-                while True:
-                    new_row += dir_row
-                    new_col += dir_col
-                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
-                        break
-                    if board.grid[new_row][new_col] is None:
-                        valid_moves.append(Move(col, row, new_col, new_row, False))
-                    else:
-                        if board.grid[new_row][new_col].color != self.color:
-                            valid_moves.append(Move(col, row, new_col, new_row, True))
-                        break
-        elif self.type == PieceType.QUEEN:
-            directions = [
-                (-1, -1), (-1, 0), (-1, 1),
-                (0, -1),           (0, 1),
-                (1, -1),  (1, 0),  (1, 1)
-            ]
-            for dir_row, dir_col in directions:
-                new_row, new_col = row, col
-                while True:
-                    new_row += dir_row
-                    new_col += dir_col
-                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
-                        break
-                    if board.grid[new_row][new_col] is None:
-                        valid_moves.append(Move(col, row, new_col, new_row, False))
-                    else:
-                        if board.grid[new_row][new_col].color != self.color:
-                            valid_moves.append(Move(col, row, new_col, new_row, True))
-                        break
-        elif self.type == PieceType.KING:
-            #King moves one square in any direction
-            moves = [(-1, -1), (-1, 0), (-1, 1),
-                     (0, -1),           (0, 1),
-                     (1, -1),  (1, 0),  (1, 1)]
-            for move_row, move_col in moves:
-                new_row, new_col = row + move_row, col + move_col
-                #We check if the move is valid: 1. Square has to be on the board 2. Square has to be empty or have an opponent piece
-                if  0 <= new_row < 8 and 0 <= new_col < 8:
-                    if board.grid[new_row][new_col] is None:
-                        valid_moves.append(Move(col, row, new_col, new_row, False))
-                    elif board.grid[new_row][new_col].color != self.color:
-                        valid_moves.append(Move(col, row, new_col, new_row, True))
-        return valid_moves
     
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("CHESS_LOG_LEVEL", "WARNING").upper())
+    if os.environ.get("CHESS_PROFILE"):
+        profiler.enable()
     pygame.init()
     game = Game()
 
@@ -0,0 +1,483 @@
+import threading
+import time
+
+from evaluation import Evaluator
+from profiling import profiler
+from rules import FIFTY_MOVE_PLIES, Move, PieceType, choose_two_rooks_move
+
+#Search engine: iterative deepening alpha-beta (negamax) with a quiescence search for captures
+#and a transposition table keyed by the Zobrist hash. Scores are in centipawns from the view of
+#the side to move, a mate is MATE_SCORE minus the number of plies until the mate.
+
+MATE_SCORE = 100000
+#Scores above this are mates
+MATE_BOUND = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+
+
+#Mate scores count the plies from the root, in the transposition table they count from the position itself,
+#so a position reached at another ply gets the right mate distance
+def score_to_table(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+#Values for the order of the captures, the evaluation is in evaluation.py
+PIECE_VALUES = {
+    PieceType.PAWN: 100,
+    PieceType.KNIGHT: 320,
+    PieceType.BISHOP: 330,
+    PieceType.ROOK: 500,
+    PieceType.QUEEN: 900,
+    PieceType.KING: 0
+}
+
+#Kinds of scores in the transposition table
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+def other_color(color):
+    return 'black' if color == 'white' else 'white'
+
+
+#Identifies a move independent of the Move object, so moves from different generate_moves calls can be compared
+def move_key(move):
+    return (move.from_row, move.from_col, move.to_row, move.to_col, move.promotion, move.rook_from)
+
+
+#All legal moves of a color, as a new list because the lists of the move cache must not be changed
+def legal_moves(board, color):
+    return list(board.legal_moves(color))
+
+
+class SearchLimits:
+    def __init__(self, depth=None, nodes=None, movetime=None, wtime=None, btime=None, winc=0, binc=0,
+                 movestogo=None, move_number=1):
+        self.depth = depth
+        self.nodes = nodes
+        #Milliseconds
+        self.movetime = movetime
+        #Clock times and increments of both players in milliseconds like in UCI, the time manager divides the
+        #time of the side to move over the rest of the game
+        self.wtime = wtime
+        self.btime = btime
+        self.winc = winc
+        self.binc = binc
+        #Moves until the next time control, None when the whole game has to be played with the time
+        self.movestogo = movestogo
+        self.move_number = move_number
+
+
+#Limits for a computer move with the time of a Clock (seconds)
+def clock_limits(clock, move_number):
+    return SearchLimits(wtime=max(0, int(clock.white_time * 1000)), btime=max(0, int(clock.black_time * 1000)),
+                        winc=clock.increment * 1000, binc=clock.increment * 1000, move_number=move_number)
+
+
+#Time for one move from the remaining time on the clock. The search should stop after the soft limit when it
+#starts no new iteration, it is stopped inside an iteration at the hard limit. All times are in seconds
+class TimeManager:
+    #Kept for the move transfer and drawing, so a move never arrives after the flag fell
+    OVERHEAD = 0.05
+    #A game is expected to last at least this many more moves
+    MIN_MOVES_LEFT = 20
+    #The soft limit is multiplied by these when the best move stayed the same for 0, 1, 2 or more iterations
+    STABILITY_FACTORS = (1.5, 1.0, 0.7, 0.5)
+    #Every iteration takes longer than all before it together, one that starts after this part of the soft limit
+    #would most likely be stopped at the hard limit
+    ITERATION_START = 0.6
+
+    def __init__(self, time_left, increment=0.0, move_number=1, moves_to_go=None):
+        available = max(0.0, time_left - self.OVERHEAD)
+        moves_left = moves_to_go if moves_to_go else max(self.MIN_MOVES_LEFT, 50 - move_number)
+        self.soft = min(available / moves_left + 0.75 * increment, 0.4 * available)
+        self.hard = min(4 * self.soft, 0.5 * available)
+
+    @classmethod
+    def from_limits(cls, limits, color):
+        time_left = limits.wtime if color == 'white' else limits.btime
+        if time_left is None:
+            return None
+        increment = limits.winc if color == 'white' else limits.binc
+        return cls(time_left / 1000, (increment or 0) / 1000, limits.move_number, limits.movestogo)
+
+    #Called after every iteration. stable_iterations counts the iterations in a row that found the same best move
+    def start_next_iteration(self, elapsed, stable_iterations):
+        factor = self.STABILITY_FACTORS[min(stable_iterations, len(self.STABILITY_FACTORS) - 1)]
+        return elapsed < self.ITERATION_START * self.soft * factor
+
+
+class SearchResult:
+    def __init__(self, best_move, score, depth, nodes, elapsed, pv):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        #Seconds
+        self.elapsed = elapsed
+        self.pv = pv
+
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class Searcher:
+    #How many nodes are searched between two checks of the time limit
+    CHECK_INTERVAL = 256
+    MAX_DEPTH = 64
+
+    def __init__(self, table_size=1 << 20, debug=False):
+        self.table = {}
+        #With debug the incremental evaluation is checked against a full evaluation in every position
+        self.debug = debug
+        self.evaluator = None
+        self.table_size = table_size
+        self.nodes = 0
+        self.stopped = False
+        self.limits = SearchLimits()
+        self.deadline = None
+        self.time_manager = None
+        #Time from which the time manager measures, the start of the search or the ponder hit
+        self.search_start = 0.0
+        self.next_check = 0
+        #Limits given by ponderhit, the lock is held while the limits of a search are set
+        self.ponder_limits = None
+        self.lock = threading.Lock()
+        #Called with the SearchResult of every completed iteration, e.g. for the info lines of UCI
+        self.report = None
+
+    def clear(self):
+        self.table.clear()
+
+    def stop(self):
+        self.stopped = True
+
+    #Call before the thread of a ponder search is started
+    def start_ponder(self):
+        self.ponder_limits = None
+        self.stopped = False
+
+    #Search the position and return the best move of the deepest completed iteration.
+    #A ponder search has no limits until ponderhit gives it the limits of the normal search. It runs in a thread
+    #and does not clear the stop flag: the owner clears it before the thread starts (start_ponder), so a stop that
+    #comes before the thread gets here is not lost
+    @profiler.timed('search')
+    def search(self, board, color, limits=None, ponder=False):
+        self.nodes = 0
+        if not ponder:
+            self.stopped = False
+        self.next_check = self.CHECK_INTERVAL
+        start = time.perf_counter()
+        #The ponder hit can come before the ponder search thread gets here
+        with self.lock:
+            if ponder:
+                limits = self.ponder_limits or SearchLimits()
+            self.limits = limits or SearchLimits(depth=3)
+            self.set_time_limits(self.limits, color, start)
+        max_depth = self.limits.depth or self.MAX_DEPTH
+        self.evaluator = Evaluator(board, self.debug)
+
+        moves = self.order_moves(board, legal_moves(board, color), None)
+        if not moves:
+            score = -MATE_SCORE if board.in_check(color) else 0
+            return SearchResult(None, score, 0, 0, time.perf_counter() - start, [])
+        result = SearchResult(moves[0], self.evaluator.evaluate(color), 0, 0, 0.0, [moves[0]])
+        stable_iterations = 0
+        for depth in range(1, max_depth + 1):
+            best_move, score = self.search_root(board, color, moves, depth)
+            if self.stopped and best_move is None:
+                break
+            stable_iterations = stable_iterations + 1 if best_move is result.best_move and depth > 1 else 0
+            result = SearchResult(best_move, score, depth, self.nodes, time.perf_counter() - start, self.principal_variation(board, color, best_move))
+            if self.report is not None:
+                self.report(result)
+            #Search the best move first in the next iteration
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            if self.stopped or abs(score) >= MATE_BOUND or len(moves) == 1 and depth >= 1 and self.limits.depth is None:
+                break
+            time_manager = self.time_manager
+            if time_manager is not None and not time_manager.start_next_iteration(time.perf_counter() - self.search_start, stable_iterations):
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        profiler.count('search.nodes', self.nodes)
+        return result
+
+    def set_time_limits(self, limits, color, start):
+        self.search_start = start
+        deadline = start + limits.movetime / 1000 if limits.movetime is not None else None
+        time_manager = TimeManager.from_limits(limits, color)
+        if time_manager is not None:
+            deadline = start + time_manager.hard if deadline is None else min(deadline, start + time_manager.hard)
+        self.deadline = deadline
+        self.time_manager = time_manager
+
+    #The opponent played the expected move: the running ponder search goes on as a normal search with these limits.
+    #The time is counted from the start of pondering, which did not cost any time on the own clock, so after a long
+    #ponder the move is played almost at once. Called from another thread than the search
+    def ponderhit(self, limits, color):
+        with self.lock:
+            self.ponder_limits = limits
+            self.limits = limits
+            self.set_time_limits(limits, color, self.search_start)
+            if self.time_manager is not None and time.perf_counter() - self.search_start >= self.time_manager.soft:
+                self.stopped = True
+
+    def search_root(self, board, color, moves, depth):
+        alpha = -INFINITY
+        best_move = None
+        for move in moves:
+            undo = self.evaluator.make_move(move)
+            score = -self.negamax(board, other_color(color), depth - 1, -INFINITY, -alpha, 1)
+            self.evaluator.unmake_move(undo)
+            if self.stopped:
+                #A partly searched iteration is only used when its best move is already better
+                break
+            if score > alpha or best_move is None:
+                alpha = score
+                best_move = move
+        return best_move, alpha
+
+    def check_limits(self):
+        self.next_check = self.nodes + self.CHECK_INTERVAL
+        if self.limits.nodes is not None and self.nodes >= self.limits.nodes:
+            self.stopped = True
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+
+    def negamax(self, board, color, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        if self.stopped:
+            return 0
+        #A position that was reached before in the game or the search is scored as a draw, like the repetition
+        #it would lead to
+        if board.halfmove_clock >= FIFTY_MOVE_PLIES or board.repetition_count(color) >= 2:
+            return 0
+        if depth <= 0:
+            return self.quiescence(board, color, alpha, beta, ply)
+
+        key = board.zobrist_hash(color)
+        entry = self.table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_kind, table_move = entry
+            entry_score = score_from_table(entry_score, ply)
+            if entry_depth >= depth:
+                if entry_kind == EXACT:
+                    return entry_score
+                if entry_kind == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if entry_kind == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        original_alpha = alpha
+        opponent = other_color(color)
+        best_score = -INFINITY
+        best_move = None
+        legal_count = 0
+        for move in self.staged_moves(board, color, table_move):
+            if move.rook_from is not None and not board.is_legal_move(move, color):
+                continue
+            undo = self.evaluator.make_move(move)
+            if board.in_check(color):
+                self.evaluator.unmake_move(undo)
+                continue
+            legal_count += 1
+            score = -self.negamax(board, opponent, depth - 1, -beta, -alpha, ply + 1)
+            self.evaluator.unmake_move(undo)
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if legal_count == 0:
+            return -MATE_SCORE + ply if board.in_check(color) else 0
+
+        if best_score <= original_alpha:
+            kind = UPPER_BOUND
+        elif best_score >= beta:
+            kind = LOWER_BOUND
+        else:
+            kind = EXACT
+        self.store(key, depth, score_to_table(best_score, ply), kind, move_key(best_move))
+        return best_score
+
+    def quiescence(self, board, color, alpha, beta, ply):
+        stand_pat = self.evaluator.evaluate(color)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        opponent = other_color(color)
+        #The capture stage of iter_moves is already ordered by the most valuable victim and least valuable attacker
+        for move in board.iter_moves(color, quiet=False):
+            self.nodes += 1
+            undo = self.evaluator.make_move(move)
+            if board.in_check(color):
+                self.evaluator.unmake_move(undo)
+                continue
+            score = -self.quiescence(board, opponent, -beta, -alpha, ply + 1)
+            self.evaluator.unmake_move(undo)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    #The move of the transposition table first, then the stages of iter_moves. Most nodes are cut off by one of
+    #the first moves, so the quiet moves are often never generated
+    def staged_moves(self, board, color, table_move):
+        if table_move is not None and table_move[5] is None:
+            from_row, from_col, to_row, to_col, promotion, _ = table_move
+            piece = board.grid[from_row][from_col]
+            if piece is not None and piece.color == color:
+                for move in piece.get_valid_moves(board):
+                    if move.to_row == to_row and move.to_col == to_col:
+                        if promotion is not None:
+                            move = Move(move.from_col, move.from_row, move.to_col, move.to_row, move.is_capture, promotion=promotion)
+                        yield move
+                        break
+        for move in board.iter_moves(color):
+            if move_key(move) != table_move:
+                yield move
+
+    #Move of the transposition table first, then captures with the most valuable victim and least valuable attacker
+    def order_moves(self, board, moves, table_move):
+        def priority(move):
+            if table_move is not None and move_key(move) == table_move:
+                return -100000
+            score = 0
+            if move.is_capture:
+                victim = board.grid[move.from_row][move.to_col] if move.is_enPassant else board.grid[move.to_row][move.to_col]
+                attacker = board.grid[move.from_row][move.from_col]
+                score -= 10 * PIECE_VALUES[victim.type] - PIECE_VALUES[attacker.type] + 10000
+            if move.promotion is not None:
+                score -= PIECE_VALUES[move.promotion]
+            return score
+        return sorted(moves, key=priority)
+
+    def store(self, key, depth, score, kind, best_move):
+        #When the table is full we start again, this is cheaper than a replacement scheme in Python
+        if len(self.table) >= self.table_size and key not in self.table:
+            self.table.clear()
+        self.table[key] = (depth, score, kind, best_move)
+
+    #Follow the best moves in the transposition table
+    def principal_variation(self, board, color, best_move, max_length=16):
+        pv = [best_move]
+        undos = [board.make_move(best_move)]
+        seen = set()
+        color = other_color(color)
+        while len(pv) < max_length:
+            key = board.zobrist_hash(color)
+            entry = self.table.get(key)
+            if entry is None or key in seen:
+                break
+            seen.add(key)
+            next_move = None
+            for move in legal_moves(board, color):
+                if move_key(move) == entry[3]:
+                    next_move = move
+                    break
+            if next_move is None:
+                break
+            pv.append(next_move)
+            undos.append(board.make_move(next_move))
+            color = other_color(color)
+        for undo in reversed(undos):
+            board.unmake_move(undo)
+        return pv
+
+
+#Searches on the time of the opponent: after the computer moved, the expected reply (the second move of the
+#principal variation) is played on a copy of the board and the position after it is searched in a thread.
+#When the opponent plays that move the ponder search continues as the normal search, otherwise it is stopped.
+#Both use the same Searcher, so the transposition table filled while pondering is kept in either case
+class Ponderer:
+    def __init__(self, searcher=None):
+        self.searcher = searcher or Searcher()
+        self.thread = None
+        self.ponder_result = None
+        #Hash of the position that is pondered, with the color to move
+        self.ponder_key = None
+        #Result of the last normal search, its principal variation has the expected reply
+        self.last_result = None
+        self.hits = 0
+        self.misses = 0
+
+    #Same as Searcher.search, but takes over the ponder search when the position is the pondered one
+    def search(self, board, color, limits):
+        if self.thread is not None and board.zobrist_hash(color) == self.ponder_key:
+            self.hits += 1
+            self.searcher.ponderhit(limits, color)
+            self.thread.join()
+            self.thread = None
+            result = self.ponder_result
+        else:
+            if self.thread is not None:
+                self.misses += 1
+            self.stop()
+            result = self.searcher.search(board, color, limits)
+        self.last_result = result
+        return result
+
+    #Start pondering after the computer (color) played the best move of the last search
+    def start(self, board, color):
+        self.stop()
+        if self.last_result is None or len(self.last_result.pv) < 2:
+            return False
+        opponent = other_color(color)
+        expected = move_key(self.last_result.pv[1])
+        ponder_board = board.copy()
+        for move in legal_moves(ponder_board, opponent):
+            if move_key(move) == expected:
+                ponder_board.make_move(move)
+                self.ponder_key = ponder_board.zobrist_hash(color)
+                self.searcher.start_ponder()
+                self.thread = threading.Thread(target=self.run, args=(ponder_board, color), daemon=True)
+                self.thread.start()
+                return True
+        return False
+
+    def run(self, board, color):
+        self.ponder_result = self.searcher.search(board, color, ponder=True)
+
+    def stop(self):
+        if self.thread is not None:
+            self.searcher.stop()
+            self.thread.join()
+            self.thread = None
+        self.ponder_key = None
+
+
+#Computer move in the rook+king vs king endgame. With a clock the search plays, with the time the time manager
+#gives it, without a clock the move of the box method. Returns (piece_type, from_pos, to_pos) or None
+#searcher can also be a Ponderer
+def choose_endgame_move(board, color, clock=None, move_number=1, searcher=None):
+    if clock is None:
+        return choose_two_rooks_move(board)
+    result = (searcher or Searcher()).search(board, color, clock_limits(clock, move_number))
+    if result.best_move is None:
+        return None
+    move = result.best_move
+    return board.grid[move.from_row][move.from_col].type, (move.from_row, move.from_col), (move.to_row, move.to_col)
@@ -0,0 +1,244 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from archive import ArchiveError, replay_san_moves
+from engine import Searcher, SearchLimits
+from rules import board_from_fen, move_to_san
+
+logger = logging.getLogger(__name__)
+
+#Test suites in EPD: a position (the first four fields of a FEN) and operations like
+#  r1b1k2r/ppppnppp/2n2q2/2b5/3NP3/2P1B3/PP3PPP/RN1QKB1R w KQkq - bm Nf5; id "position 1";
+#bm are the best moves, am the moves to avoid. Every position is searched with the same budget in a process pool;
+#a position is solved when the engine plays a bm move (and no am move). The time to solution is the time of the
+#first iteration from which the engine kept a right move until the end, so a faster engine shows up even when both
+#solve the same positions. The results are written as JSON, one file per run, to follow them over time.
+
+#An operation: opcode and operands separated by spaces, quoted operands may contain spaces and semicolons
+_OPERATION = re.compile(r'\s*([A-Za-z][A-Za-z0-9_]*)((?:\s+(?:"[^"]*"|[^\s;"]+))*)\s*;')
+_OPERAND = re.compile(r'"([^"]*)"|([^\s;"]+)')
+
+
+class EpdRecord:
+    def __init__(self, fen, operations):
+        #Full FEN, the move counters come from the hmvc and fmvn operations
+        self.fen = fen
+        #opcode -> list of operands
+        self.operations = operations
+
+    @property
+    def id(self):
+        return ' '.join(self.operations.get('id', [])) or None
+
+    @property
+    def best_moves(self):
+        return self.operations.get('bm', [])
+
+    @property
+    def avoid_moves(self):
+        return self.operations.get('am', [])
+
+
+def parse_epd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"An EPD line needs at least 4 fields: {line}")
+    rest = fields[4] if len(fields) > 4 else ''
+    operations = {}
+    position = 0
+    while rest[position:].strip():
+        match = _OPERATION.match(rest, position)
+        if match is None:
+            raise ValueError(f"Invalid operation: {rest[position:]}")
+        operations[match.group(1)] = [operand.group(1) if operand.group(1) is not None else operand.group(2)
+                                      for operand in _OPERAND.finditer(match.group(2))]
+        position = match.end()
+    halfmove_clock = operations.get('hmvc', ['0'])[0]
+    move_number = operations.get('fmvn', ['1'])[0]
+    return EpdRecord(' '.join(fields[:4] + [halfmove_clock, move_number]), operations)
+
+
+#Yields one EpdRecord for every position of the file, empty lines and lines starting with # are skipped
+def read_epd(path):
+    with open(path, 'r') as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                yield parse_epd(line)
+            except ValueError as error:
+                logger.warning("%s:%d skipped: %s", path, number, error)
+
+
+#The legal move of a move in standard notation. Annotations like ! and ? are ignored, 0-0 is read as O-O
+def find_san_move(board, san, color):
+    san = san.rstrip('!?').replace('0-0', 'O-O')
+    for moves, index, _ in replay_san_moves(board.copy(), [san], color):
+        return moves[index]
+
+
+def same_move(move, other):
+    return (move.from_row, move.from_col, move.to_row, move.to_col, move.promotion) == \
+        (other.from_row, other.from_col, other.to_row, other.to_col, other.promotion)
+
+
+class EpdResult:
+    def __init__(self, id, fen, solved, best_move, targets, time_to_solution, depth, nodes, elapsed, error=None):
+        self.id = id
+        self.fen = fen
+        self.solved = solved
+        #Move of the engine in standard notation
+        self.best_move = best_move
+        #'bm ...' or 'am ...' as in the file
+        self.targets = targets
+        #Seconds from the start of the search, None when the position was not solved
+        self.time_to_solution = time_to_solution
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        #Why the position could not be searched, e.g. an invalid FEN or bm move
+        self.error = error
+
+    def to_json(self):
+        return dict(self.__dict__)
+
+
+def describe_targets(record):
+    parts = []
+    if record.best_moves:
+        parts.append('bm ' + ' '.join(record.best_moves))
+    if record.avoid_moves:
+        parts.append('am ' + ' '.join(record.avoid_moves))
+    return '; '.join(parts)
+
+
+#Runs in a worker process. The record is sent as it was read, its FEN is parsed in the worker
+def solve_position(task):
+    record, limits, table_size = task
+    targets = describe_targets(record)
+    try:
+        board, color, _ = board_from_fen(record.fen)
+        best_moves = [find_san_move(board, san, color) for san in record.best_moves]
+        avoid_moves = [find_san_move(board, san, color) for san in record.avoid_moves]
+    except (ValueError, ArchiveError) as error:
+        return EpdResult(record.id, record.fen, False, None, targets, None, 0, 0, 0.0, str(error))
+    if not best_moves and not avoid_moves:
+        return EpdResult(record.id, record.fen, False, None, targets, None, 0, 0, 0.0, "no bm or am operation")
+
+    def is_right(move):
+        if move is None or any(same_move(move, avoid) for avoid in avoid_moves):
+            return False
+        return not best_moves or any(same_move(move, best) for best in best_moves)
+
+    #Elapsed time of the first iteration of the current run of right moves
+    solution = []
+
+    def report(result):
+        if not is_right(result.best_move):
+            solution.clear()
+        elif not solution:
+            solution.append(result.elapsed)
+
+    searcher = Searcher(table_size)
+    searcher.report = report
+    result = searcher.search(board, color, limits)
+    solved = is_right(result.best_move)
+    best_move = None
+    if result.best_move is not None:
+        best_move = move_to_san(board, result.best_move, color, result.best_move.promotion)
+    time_to_solution = (solution[0] if solution else result.elapsed) if solved else None
+    return EpdResult(record.id, record.fen, solved, best_move, targets, time_to_solution, result.depth,
+                     result.nodes, result.elapsed)
+
+
+def run_suite(records, limits, workers=None, table_size=1 << 20, callback=None):
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    results = []
+    #Every position costs about the same, one position per task keeps all workers busy until the end
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(solve_position, ((record, limits, table_size) for record in records)):
+            results.append(result)
+            if callback is not None:
+                callback(result)
+    elapsed = time.perf_counter() - start
+    return results, summarize(results, elapsed)
+
+
+def summarize(results, elapsed):
+    solved = [result for result in results if result.solved]
+    nodes = sum(result.nodes for result in results)
+    search_time = sum(result.elapsed for result in results)
+    return {
+        'positions': len(results),
+        'solved': len(solved),
+        'errors': sum(1 for result in results if result.error is not None),
+        'time_to_solution': sum(result.time_to_solution for result in solved),
+        'nodes': nodes,
+        'time': elapsed,
+        #All workers together, and one search alone
+        'nodes_per_second': nodes / elapsed if elapsed > 0 else 0.0,
+        'nodes_per_second_per_search': nodes / search_time if search_time > 0 else 0.0,
+    }
+
+
+def budget(limits):
+    return {'depth': limits.depth, 'nodes': limits.nodes, 'movetime': limits.movetime}
+
+
+def write_results(path, suite, limits, workers, results, summary):
+    with open(path, 'w') as file:
+        json.dump({
+            'suite': suite,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'workers': workers,
+            'limits': budget(limits),
+            'summary': summary,
+            'positions': [result.to_json() for result in results],
+        }, file, indent=2)
+
+
+def print_result(result):
+    if result.error is not None:
+        status = f"error: {result.error}"
+    elif result.solved:
+        status = f"solved in {result.time_to_solution:.2f}s"
+    else:
+        status = "not solved"
+    print(f"{result.id or result.fen}: {result.best_move} ({result.targets}) {status}, depth {result.depth}, "
+          f"{result.nodes} nodes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the bm and am positions of an EPD test suite")
+    parser.add_argument('epd')
+    parser.add_argument('-o', '--output', default=None, help="write the results to this JSON file")
+    budget_group = parser.add_mutually_exclusive_group()
+    budget_group.add_argument('--nodes', type=int, default=None, help="nodes per position")
+    budget_group.add_argument('--movetime', type=int, default=None, help="milliseconds per position")
+    budget_group.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--table', type=int, default=1 << 20, help="transposition table entries")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print every position")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    limits = SearchLimits(depth=args.depth, nodes=args.nodes, movetime=args.movetime)
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        limits.movetime = 1000
+    records = list(read_epd(args.epd))
+    results, summary = run_suite(records, limits, args.workers, args.table, print_result if args.verbose else None)
+    print(f"{summary['solved']} of {summary['positions']} solved"
+          f" ({summary['errors']} not searched), time to solution {summary['time_to_solution']:.2f}s")
+    print(f"{summary['nodes']} nodes in {summary['time']:.2f}s, {summary['nodes_per_second']:.0f} nodes/sec "
+          f"({summary['nodes_per_second_per_search']:.0f} per search)")
+    if args.output:
+        write_results(args.output, os.path.basename(args.epd), limits, args.workers, results, summary)
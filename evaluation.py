@@ -0,0 +1,377 @@
+import random
+
+from rules import ZOBRIST_PIECES, PieceType
+
+#Evaluation with material and piece-square tables for the middlegame and the endgame. The two scores are
+#mixed by the game phase (tapered evaluation): with all pieces on the board only the middlegame score counts,
+#with only kings and pawns only the endgame score.
+#The Evaluator keeps the scores, the phase and a key of the material up to date on every make_move and
+#unmake_move of the search, so a position is evaluated without looking at the board. full_evaluation computes
+#the same from the grid and is used to check the incremental scores.
+#The pawn structure changes only when a pawn moves or is captured. It is scored from the pawns alone and kept in
+#a PawnTable keyed by a Zobrist key of only the pawns, so most positions don't look at the pawns at all.
+
+MIDGAME_VALUES = {
+    PieceType.PAWN: 82,
+    PieceType.KNIGHT: 337,
+    PieceType.BISHOP: 365,
+    PieceType.ROOK: 477,
+    PieceType.QUEEN: 1025,
+    PieceType.KING: 0
+}
+
+ENDGAME_VALUES = {
+    PieceType.PAWN: 94,
+    PieceType.KNIGHT: 281,
+    PieceType.BISHOP: 297,
+    PieceType.ROOK: 512,
+    PieceType.QUEEN: 936,
+    PieceType.KING: 0
+}
+
+#How much every piece counts for the game phase, all pieces of the start position are MAX_PHASE
+PHASE_WEIGHTS = {
+    PieceType.PAWN: 0,
+    PieceType.KNIGHT: 1,
+    PieceType.BISHOP: 1,
+    PieceType.ROOK: 2,
+    PieceType.QUEEN: 4,
+    PieceType.KING: 0
+}
+MAX_PHASE = 24
+
+
+#Distance to the four center squares, 0 in the center and 3 in the corners
+def _center_distance(row, col):
+    return int(max(abs(3.5 - row), abs(3.5 - col)))
+
+
+#Piece-square bonus for a white piece on (row, col). Row 0 is the eighth rank, where white pawns promote
+def _midgame_bonus(piece_type, row, col):
+    rank = 8 - row
+    distance = _center_distance(row, col)
+    if piece_type == PieceType.PAWN:
+        if rank in (1, 8):
+            return 0
+        bonus = (rank - 2) * 5
+        #Central pawns are worth more in the opening, a pawn left on d2/e2 blocks the bishops
+        if col in (3, 4):
+            bonus += 20 if rank in (4, 5) else -10 if rank == 2 else 0
+        return bonus
+    if piece_type == PieceType.KNIGHT:
+        return 15 - 12 * distance
+    if piece_type == PieceType.BISHOP:
+        return 10 - 6 * distance - (5 if rank == 1 else 0)
+    if piece_type == PieceType.ROOK:
+        return 20 if rank == 7 else 5 if col in (3, 4) else 0
+    if piece_type == PieceType.QUEEN:
+        return 5 - 3 * distance
+    #The king stays behind its pawns, best on the castled squares
+    if rank == 1:
+        return 20 if col in (1, 2, 6) else 0
+    return -15 * (rank - 1)
+
+
+def _endgame_bonus(piece_type, row, col):
+    rank = 8 - row
+    distance = _center_distance(row, col)
+    if piece_type == PieceType.PAWN:
+        return 0 if rank in (1, 8) else (rank - 2) * 15
+    if piece_type == PieceType.KNIGHT:
+        return 10 - 10 * distance
+    if piece_type == PieceType.BISHOP:
+        return 5 - 5 * distance
+    if piece_type == PieceType.ROOK:
+        return 10 if rank == 7 else 0
+    if piece_type == PieceType.QUEEN:
+        return 10 - 5 * distance
+    #In the endgame the king belongs in the center
+    return 25 - 15 * distance
+
+
+#(color, piece type) -> score of the piece including its value on each of the 64 squares (row * 8 + col).
+#Black uses the white table mirrored vertically
+def _square_tables(values, bonus):
+    tables = {}
+    for piece_type in PieceType:
+        white = [values[piece_type] + bonus(piece_type, square // 8, square % 8) for square in range(64)]
+        tables[('white', piece_type)] = white
+        tables[('black', piece_type)] = [white[(7 - square // 8) * 8 + square % 8] for square in range(64)]
+    return tables
+
+
+MIDGAME_TABLES = _square_tables(MIDGAME_VALUES, _midgame_bonus)
+ENDGAME_TABLES = _square_tables(ENDGAME_VALUES, _endgame_bonus)
+
+#Key of the material: one random number for every (color, type, count), the key of a position is the XOR of
+#the numbers of its piece counts. Positions with the same pieces have the same key wherever the pieces are
+_material_random = random.Random(0x3A7E)
+MATERIAL_KEYS = {
+    (color, piece_type): [_material_random.getrandbits(64) for _ in range(11)]
+    for color in ('white', 'black') for piece_type in PieceType
+}
+
+
+#Pawn structure, (midgame, endgame) per pawn
+DOUBLED_PENALTY = (10, 20)
+ISOLATED_PENALTY = (10, 15)
+BACKWARD_PENALTY = (8, 10)
+#By the rank of the pawn seen from its own side (index 1 is the second rank)
+PASSED_BONUS_MIDGAME = [0, 0, 5, 10, 15, 30, 50, 0]
+PASSED_BONUS_ENDGAME = [0, 10, 15, 25, 40, 65, 100, 0]
+#Endgame bonus of a passed pawn whose next square is empty, this depends on the other pieces so it is not cached
+FREE_PASSER_BONUS = [0, 0, 5, 5, 10, 15, 25, 0]
+
+
+#Fixed size table of pawn structure scores, the slot of a pawn key are its low bits. A new entry replaces the
+#old one in its slot. An entry is (pawn key, midgame, endgame, white passed pawns, black passed pawns), the passed
+#pawns are masks with bit row * 8 + col set for every passed pawn
+class PawnTable:
+    def __init__(self, size_bits=16):
+        self.mask = (1 << size_bits) - 1
+        self.entries = [None] * (1 << size_bits)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board, pawn_key):
+        slot = pawn_key & self.mask
+        entry = self.entries[slot]
+        if entry is not None and entry[0] == pawn_key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = (pawn_key,) + pawn_structure(board)
+        self.entries[slot] = entry
+        return entry
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': sum(entry is not None for entry in self.entries),
+            'max_size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+#Shared by all searches of the process, the entries only depend on the pawns
+pawn_table = PawnTable()
+
+
+#Zobrist key of only the pawns, with the numbers of the position hash
+def compute_pawn_key(board):
+    key = 0
+    for row in board.grid:
+        for piece in row:
+            if piece is not None and piece.type == PieceType.PAWN:
+                key ^= ZOBRIST_PIECES[(piece.color, PieceType.PAWN)][piece.position[0] * 8 + piece.position[1]]
+    return key
+
+
+#Doubled, isolated, backward and passed pawns: (midgame, endgame, white passed pawns, black passed pawns).
+#The scores are from the view of white
+def pawn_structure(board):
+    pawns = {'white': [], 'black': []}
+    for row in board.grid:
+        for piece in row:
+            if piece is not None and piece.type == PieceType.PAWN:
+                pawns[piece.color].append(piece.position)
+    #Rows of the pawns of every file, with an empty file on both sides so col - 1 and col + 1 always exist
+    files = {color: [[] for _ in range(10)] for color in pawns}
+    for color, positions in pawns.items():
+        for row, col in positions:
+            files[color][col + 1].append(row)
+    midgame = 0
+    endgame = 0
+    passed = {'white': 0, 'black': 0}
+    for color, sign, forward in (('white', 1, -1), ('black', -1, 1)):
+        own = files[color]
+        enemy = files[other_color(color)]
+        for row, col in pawns[color]:
+            file_index = col + 1
+            penalty_midgame = 0
+            penalty_endgame = 0
+            if len(own[file_index]) > 1:
+                #Both pawns of a doubled pair get half of the penalty
+                penalty_midgame += DOUBLED_PENALTY[0] // 2
+                penalty_endgame += DOUBLED_PENALTY[1] // 2
+            neighbours = own[file_index - 1] + own[file_index + 1]
+            if not neighbours:
+                penalty_midgame += ISOLATED_PENALTY[0]
+                penalty_endgame += ISOLATED_PENALTY[1]
+            #No pawn on the neighbour files next to or behind it and the square in front attacked by an enemy pawn
+            elif all((other_row - row) * forward > 0 for other_row in neighbours) and \
+                    row + 2 * forward in enemy[file_index - 1] + enemy[file_index + 1]:
+                penalty_midgame += BACKWARD_PENALTY[0]
+                penalty_endgame += BACKWARD_PENALTY[1]
+            midgame -= sign * penalty_midgame
+            endgame -= sign * penalty_endgame
+            #No enemy pawn in front of it on its own or a neighbour file
+            if not any((enemy_row - row) * forward > 0 for index in (file_index - 1, file_index, file_index + 1)
+                       for enemy_row in enemy[index]):
+                rank = 7 - row if color == 'white' else row
+                midgame += sign * PASSED_BONUS_MIDGAME[rank]
+                endgame += sign * PASSED_BONUS_ENDGAME[rank]
+                passed[color] |= 1 << (row * 8 + col)
+    return midgame, endgame, passed['white'], passed['black']
+
+
+#Endgame bonus for passed pawns that can move, from the view of white
+def free_passer_bonus(board, white_passed, black_passed):
+    bonus = 0
+    for mask, sign, forward in ((white_passed, 1, -1), (black_passed, -1, 1)):
+        while mask:
+            square = (mask & -mask).bit_length() - 1
+            mask &= mask - 1
+            row, col = divmod(square, 8)
+            if board.grid[row + forward][col] is None:
+                bonus += sign * FREE_PASSER_BONUS[7 - row if sign == 1 else row]
+    return bonus
+
+
+def other_color(color):
+    return 'black' if color == 'white' else 'white'
+
+
+#Without pawns one minor piece can't win, a side with only that is scored as at most a draw
+def can_win(material, color):
+    if material[(color, PieceType.PAWN)] or material[(color, PieceType.ROOK)] or material[(color, PieceType.QUEEN)]:
+        return True
+    return material[(color, PieceType.KNIGHT)] + material[(color, PieceType.BISHOP)] >= 2
+
+
+#(midgame score, endgame score, phase, material key, pawn key) of the position computed from the grid.
+#The scores are from the view of white and don't contain the pawn structure
+def full_evaluation(board):
+    midgame = 0
+    endgame = 0
+    phase = 0
+    counts = {(color, piece_type): 0 for color in ('white', 'black') for piece_type in PieceType}
+    for row in board.grid:
+        for piece in row:
+            if piece is None:
+                continue
+            table_key = (piece.color, piece.type)
+            square = piece.position[0] * 8 + piece.position[1]
+            sign = 1 if piece.color == 'white' else -1
+            midgame += sign * MIDGAME_TABLES[table_key][square]
+            endgame += sign * ENDGAME_TABLES[table_key][square]
+            phase += PHASE_WEIGHTS[piece.type]
+            counts[table_key] += 1
+    material_key = 0
+    for table_key, count in counts.items():
+        material_key ^= MATERIAL_KEYS[table_key][min(count, 10)]
+    return midgame, endgame, phase, material_key, compute_pawn_key(board)
+
+
+#Mix the two scores by the phase and scale it for the material. From the view of white
+def tapered_score(board, midgame, endgame, phase):
+    phase = min(phase, MAX_PHASE)
+    score = (midgame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    if score > 0 and not can_win(board.material, 'white'):
+        return 0
+    if score < 0 and not can_win(board.material, 'black'):
+        return 0
+    return score
+
+
+#Evaluation of a position from the view of the given color, without an Evaluator
+def evaluate(board, color):
+    midgame, endgame, phase, _, _ = full_evaluation(board)
+    pawn_midgame, pawn_endgame, white_passed, black_passed = pawn_structure(board)
+    endgame += pawn_endgame + free_passer_bonus(board, white_passed, black_passed)
+    score = tapered_score(board, midgame + pawn_midgame, endgame, phase)
+    return score if color == 'white' else -score
+
+
+class Evaluator:
+    def __init__(self, board, debug=False, table=None):
+        #With debug every evaluation is compared with full_evaluation
+        self.debug = debug
+        self.pawn_table = table if table is not None else pawn_table
+        self.reset(board)
+
+    #Take the scores from the grid, after the board was changed without make_move of the Evaluator
+    def reset(self, board):
+        self.board = board
+        self.midgame, self.endgame, self.phase, self.material_key, self.pawn_key = full_evaluation(board)
+        self.stack = []
+
+    def evaluate(self, color):
+        if self.debug:
+            self.check()
+        _, pawn_midgame, pawn_endgame, white_passed, black_passed = self.pawn_table.get(self.board, self.pawn_key)
+        endgame = self.endgame + pawn_endgame
+        if white_passed or black_passed:
+            endgame += free_passer_bonus(self.board, white_passed, black_passed)
+        score = tapered_score(self.board, self.midgame + pawn_midgame, endgame, self.phase)
+        return score if color == 'white' else -score
+
+    def check(self):
+        expected = full_evaluation(self.board)
+        actual = (self.midgame, self.endgame, self.phase, self.material_key, self.pawn_key)
+        if actual != expected:
+            raise AssertionError(f"Incremental evaluation {actual} differs from the full evaluation {expected}")
+        entry = self.pawn_table.get(self.board, self.pawn_key)
+        if entry[1:] != pawn_structure(self.board):
+            raise AssertionError(f"Pawn table entry {entry[1:]} differs from the pawn structure {pawn_structure(self.board)}")
+
+    #Like Board.make_move, the change of the scores is computed from the pieces on the squares of the move
+    def make_move(self, move):
+        board = self.board
+        grid = board.grid
+        self.stack.append((self.midgame, self.endgame, self.phase, self.material_key, self.pawn_key))
+        piece = grid[move.from_row][move.from_col]
+        sign = 1 if piece.color == 'white' else -1
+        table_key = (piece.color, piece.type)
+        from_square = move.from_row * 8 + move.from_col
+        to_square = move.to_row * 8 + move.to_col
+        midgame = self.midgame - sign * MIDGAME_TABLES[table_key][from_square]
+        endgame = self.endgame - sign * ENDGAME_TABLES[table_key][from_square]
+        if piece.type == PieceType.PAWN:
+            pawn_zobrist = ZOBRIST_PIECES[table_key]
+            self.pawn_key ^= pawn_zobrist[from_square]
+            if move.promotion is None:
+                self.pawn_key ^= pawn_zobrist[to_square]
+        if move.rook_from is not None:
+            rook_key = (piece.color, PieceType.ROOK)
+            rook_from = move.rook_from[0] * 8 + move.rook_from[1]
+            rook_to = move.rook_to[0] * 8 + move.rook_to[1]
+            midgame += sign * (MIDGAME_TABLES[rook_key][rook_to] - MIDGAME_TABLES[rook_key][rook_from])
+            endgame += sign * (ENDGAME_TABLES[rook_key][rook_to] - ENDGAME_TABLES[rook_key][rook_from])
+        else:
+            captured = grid[move.from_row][move.to_col] if move.is_enPassant else grid[move.to_row][move.to_col]
+            if captured is not None:
+                captured_key = (captured.color, captured.type)
+                captured_square = captured.position[0] * 8 + captured.position[1]
+                #The captured piece is of the other color, its score is added back
+                midgame += sign * MIDGAME_TABLES[captured_key][captured_square]
+                endgame += sign * ENDGAME_TABLES[captured_key][captured_square]
+                self.phase -= PHASE_WEIGHTS[captured.type]
+                self.change_count(board, captured_key, -1)
+                if captured.type == PieceType.PAWN:
+                    self.pawn_key ^= ZOBRIST_PIECES[captured_key][captured_square]
+            if move.promotion is not None:
+                self.phase += PHASE_WEIGHTS[move.promotion]
+                self.change_count(board, table_key, -1)
+                table_key = (piece.color, move.promotion)
+                self.change_count(board, table_key, 1)
+        self.midgame = midgame + sign * MIDGAME_TABLES[table_key][to_square]
+        self.endgame = endgame + sign * ENDGAME_TABLES[table_key][to_square]
+        return board.make_move(move)
+
+    #Called before the board changes, the material key is updated from the counts of the board
+    def change_count(self, board, table_key, change):
+        count = board.material[table_key]
+        keys = MATERIAL_KEYS[table_key]
+        self.material_key ^= keys[min(count, 10)] ^ keys[min(count + change, 10)]
+
+    def unmake_move(self, undo):
+        self.board.unmake_move(undo)
+        self.midgame, self.endgame, self.phase, self.material_key, self.pawn_key = self.stack.pop()
@@ -0,0 +1,237 @@
+import argparse
+import time
+
+import numpy as np
+
+from archive import PIECE_CODES, ArchiveReader, encode_position
+from evaluation import ENDGAME_TABLES, MAX_PHASE, MIDGAME_TABLES, PHASE_WEIGHTS
+from rules import PieceType
+
+#Features and a linear evaluation of many positions at once with NumPy.
+#A batch of N positions is an array of shape (N, 12, 64): one plane of 64 squares (row * 8 + col, row 0 is the
+#eighth rank) for every piece, in the order of the archive codes (white pawn ... white king, black pawn ...
+#black king), or bitboards (N, 12) with bit i for square i. The features are computed on the bitboards with
+#array operations on the whole batch (shifts for the attacks, popcounts for the sums), there is no Python loop
+#over the positions. Only turning a Board into a plane costs a loop over its squares, positions from a game
+#archive are converted in bulk from the 32 byte position encoding.
+
+PLANE_KEYS = sorted(PIECE_CODES, key=PIECE_CODES.get)
+WHITE = 0
+BLACK = 6
+
+#Features, all from the view of white (white minus black)
+FEATURE_NAMES = [
+    'pawns', 'knights', 'bishops', 'rooks', 'queens',
+    'knight_mobility', 'bishop_mobility', 'rook_mobility', 'queen_mobility',
+    'attacked_squares', 'king_attacks', 'pawn_shield'
+]
+
+#Centipawns per unit of a feature. The material is already part of the piece-square scores, so it has no weight
+DEFAULT_WEIGHTS = np.array([0, 0, 0, 0, 0, 4, 5, 2, 1, 1, 6, 8])
+
+#Piece-square tables of evaluation.py as arrays (12, 64), black negative so the sum is from the view of white
+MIDGAME_ARRAY = np.array([[(1 if color == 'white' else -1) * value for value in MIDGAME_TABLES[(color, piece_type)]]
+                          for color, piece_type in PLANE_KEYS])
+ENDGAME_ARRAY = np.array([[(1 if color == 'white' else -1) * value for value in ENDGAME_TABLES[(color, piece_type)]]
+                          for color, piece_type in PLANE_KEYS])
+PHASE_ARRAY = np.array([PHASE_WEIGHTS[piece_type] for _, piece_type in PLANE_KEYS])
+
+#(row, column) steps, row 0 is the eighth rank
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+#Planes of one board, shape (12, 64)
+def board_planes(board):
+    return packed_planes(np.frombuffer(encode_position(board), dtype=np.uint8)[None, :])[0]
+
+
+#Planes of positions in the encoding of archive.encode_position, shape (N, 32) -> (N, 12, 64)
+def packed_planes(packed):
+    codes = np.empty((packed.shape[0], 64), dtype=np.uint8)
+    codes[:, 0::2] = packed >> 4
+    codes[:, 1::2] = packed & 15
+    return codes[:, None, :] == np.arange(1, 13, dtype=np.uint8)[None, :, None]
+
+
+#Bitboards (N, 12) of unsigned 64 bit integers, bit i is square i -> planes (N, 12, 64)
+def bitboard_planes(bitboards):
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    return ((bitboards[..., None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+
+
+def planes_to_bitboards(planes):
+    packed = np.packbits(np.asarray(planes, dtype=bool), axis=-1, bitorder='little')
+    return np.ascontiguousarray(packed).view('<u8')[..., 0]
+
+
+#Squares of a column, and the squares a piece can move d_col columns from without leaving the board
+COLUMN_MASKS = [sum(1 << (row * 8 + col) for row in range(8)) for col in range(8)]
+SOURCE_MASKS = {d_col: np.uint64(sum(COLUMN_MASKS[col] for col in range(8) if 0 <= col + d_col < 8))
+                for d_col in range(-2, 3)}
+
+
+#Move all squares of bitboards (N,) by d_row and d_col, squares that leave the board are dropped
+def shift(bitboards, d_row, d_col):
+    bitboards = bitboards & SOURCE_MASKS[d_col]
+    distance = d_row * 8 + d_col
+    if distance > 0:
+        return bitboards << np.uint64(distance)
+    return bitboards >> np.uint64(-distance)
+
+
+#Bits set in every byte value, for NumPy before 2.0 that has no bitwise_count
+BYTE_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(bitboards):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bitboards).astype(np.int64)
+    bitboards = np.ascontiguousarray(bitboards, dtype=np.uint64)
+    counts = BYTE_POPCOUNT[bitboards.view(np.uint8)].reshape(bitboards.shape + (8,))
+    return counts.sum(axis=-1, dtype=np.int64)
+
+
+#Attacks of one side split into sets that never contain a square twice for the same piece type: every knight
+#jump, every ray direction and both pawn captures are one set. A square in k sets is attacked by k pieces,
+#because the nearer of two sliders in one direction blocks the other
+def attack_sets(bitboards, offset, empty, forward):
+    pawns, knights, bishops, rooks, queens, king = (bitboards[:, offset + index] for index in range(6))
+    sets = {PieceType.PAWN: [shift(pawns, forward, -1), shift(pawns, forward, 1)]}
+    sets[PieceType.KNIGHT] = [shift(knights, d_row, d_col) for d_row, d_col in KNIGHT_OFFSETS]
+    sets[PieceType.BISHOP] = [slider_attacks(bishops, empty, direction) for direction in BISHOP_DIRECTIONS]
+    sets[PieceType.ROOK] = [slider_attacks(rooks, empty, direction) for direction in ROOK_DIRECTIONS]
+    sets[PieceType.QUEEN] = [slider_attacks(queens, empty, direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS]
+    sets[PieceType.KING] = [shift(king, d_row, d_col) for d_row, d_col in KING_OFFSETS]
+    return sets
+
+
+#Squares attacked in one direction, a ray stops at the first occupied square
+def slider_attacks(pieces, empty, direction):
+    d_row, d_col = direction
+    ray = shift(pieces, d_row, d_col)
+    attacks = ray
+    for _ in range(6):
+        ray = shift(ray & empty, d_row, d_col)
+        attacks = attacks | ray
+    return attacks
+
+
+def king_zone(king):
+    zone = king
+    for d_row, d_col in KING_OFFSETS:
+        zone = zone | shift(king, d_row, d_col)
+    return zone
+
+
+#Features of one side: material, mobility per piece type, attacked squares, attacks on the opponent king zone
+#and own pawns in front of the king. Shape (N, 12) in the order of FEATURE_NAMES
+def side_features(bitboards, offset, own, sets, opponent_king, forward):
+    not_own = ~own
+    zone = king_zone(opponent_king)
+    king = bitboards[:, offset + 5]
+    shield = shift(king, forward, -1) | shift(king, forward, 0) | shift(king, forward, 1)
+    columns = [popcount(bitboards[:, offset + index]) for index in range(5)]
+    for piece_type in (PieceType.KNIGHT, PieceType.BISHOP, PieceType.ROOK, PieceType.QUEEN):
+        columns.append(sum(popcount(attacks & not_own) for attacks in sets[piece_type]))
+    all_sets = [attacks for piece_sets in sets.values() for attacks in piece_sets]
+    attacked = np.bitwise_or.reduce(np.stack(all_sets), axis=0)
+    columns.append(popcount(attacked))
+    columns.append(sum(popcount(attacks & zone) for attacks in all_sets))
+    columns.append(popcount(shield & bitboards[:, offset]))
+    return np.stack(columns, axis=1)
+
+
+#Features of a batch of bitboards (N, 12) -> (N, len(FEATURE_NAMES)), from the view of white
+def bitboard_features(bitboards):
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    white = np.bitwise_or.reduce(bitboards[:, WHITE:WHITE + 6], axis=1)
+    black = np.bitwise_or.reduce(bitboards[:, BLACK:BLACK + 6], axis=1)
+    empty = ~(white | black)
+    #White pawns move to row 0
+    white_sets = attack_sets(bitboards, WHITE, empty, -1)
+    black_sets = attack_sets(bitboards, BLACK, empty, 1)
+    white_features = side_features(bitboards, WHITE, white, white_sets, bitboards[:, BLACK + 5], -1)
+    black_features = side_features(bitboards, BLACK, black, black_sets, bitboards[:, WHITE + 5], 1)
+    return white_features - black_features
+
+
+#Features of a batch of planes (N, 12, 64)
+def extract_features(planes):
+    return bitboard_features(planes_to_bitboards(np.asarray(planes).reshape(-1, 12, 64)))
+
+
+#Without pawns one minor piece can't win, like evaluation.can_win
+def can_win(counts, offset):
+    heavy = counts[:, offset] + counts[:, offset + 3] + counts[:, offset + 4]
+    return (heavy > 0) | (counts[:, offset + 1] + counts[:, offset + 2] >= 2)
+
+
+#Tapered piece-square score like evaluation.evaluate plus the weighted features, from the view of white.
+#The pawn structure of evaluation.py is not part of it, with all weights 0 the scores are the tapered
+#piece-square scores of evaluation.full_evaluation
+def evaluate_batch(planes, weights=DEFAULT_WEIGHTS, features=None):
+    planes = np.asarray(planes)
+    #Float matrix products are much faster than integer ones and exact for these small sums
+    flat = planes.reshape(-1, 12 * 64).astype(np.float64)
+    counts = popcount(planes_to_bitboards(planes.reshape(-1, 12, 64)))
+    midgame = (flat @ MIDGAME_ARRAY.ravel()).astype(np.int64)
+    endgame = (flat @ ENDGAME_ARRAY.ravel()).astype(np.int64)
+    phase = np.minimum(counts @ PHASE_ARRAY, MAX_PHASE)
+    score = (midgame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    if features is None:
+        features = extract_features(planes)
+    score = score + features @ np.asarray(weights)
+    score[(score > 0) & ~can_win(counts, WHITE)] = 0
+    score[(score < 0) & ~can_win(counts, BLACK)] = 0
+    return score
+
+
+#Encoded positions (N, 32) of all games of an archive, in batches of at most batch_size positions,
+#with the color to move (True for white) of every position
+def archive_batches(path, batch_size=4096):
+    positions = []
+    white_to_move = []
+    with ArchiveReader(path) as reader:
+        for number in range(len(reader)):
+            for board, move, color in reader.replay(number):
+                positions.append(encode_position(board))
+                white_to_move.append(color == 'white')
+                if len(positions) >= batch_size:
+                    yield np.frombuffer(b''.join(positions), dtype=np.uint8).reshape(-1, 32), np.array(white_to_move)
+                    positions = []
+                    white_to_move = []
+    if positions:
+        yield np.frombuffer(b''.join(positions), dtype=np.uint8).reshape(-1, 32), np.array(white_to_move)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute features and evaluations of all positions of a game archive")
+    parser.add_argument('archive')
+    parser.add_argument('-o', '--output', default='features.npz')
+    parser.add_argument('--batch-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    feature_batches = []
+    score_batches = []
+    color_batches = []
+    feature_time = 0.0
+    start = time.perf_counter()
+    for packed, white_to_move in archive_batches(args.archive, args.batch_size):
+        batch_start = time.perf_counter()
+        planes = packed_planes(packed)
+        features = extract_features(planes)
+        score_batches.append(evaluate_batch(planes, features=features))
+        feature_batches.append(features)
+        color_batches.append(white_to_move)
+        feature_time += time.perf_counter() - batch_start
+    elapsed = time.perf_counter() - start
+    features = np.concatenate(feature_batches) if feature_batches else np.zeros((0, len(FEATURE_NAMES)), dtype=np.int64)
+    scores = np.concatenate(score_batches) if score_batches else np.zeros(0, dtype=np.int64)
+    white_to_move = np.concatenate(color_batches) if color_batches else np.zeros(0, dtype=bool)
+    np.savez_compressed(args.output, features=features, scores=scores, white_to_move=white_to_move,
+                        feature_names=np.array(FEATURE_NAMES))
+    print(f"{len(scores)} positions in {elapsed:.2f}s (features and evaluation {feature_time:.2f}s, "
+          f"{len(scores) / feature_time if feature_time > 0 else 0:.0f} positions/sec), written to {args.output}")
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import os
+import time
+
+from server import GameServer
+
+#Load test for the game server: many human vs human games are played at the same time,
+#every game replays the moves of a pgn file. Reports moves per second and the move latency.
+
+
+def load_pgn_moves(path):
+    with open(path, 'r') as file:
+        return [move for move in file.read().split() if not move.endswith('.') and not move.startswith('$')]
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    #Send a command and wait for its reply, pushed lines (MOVED, RESULT, ...) are skipped
+    async def request(self, line):
+        self.writer.write(line.encode() + b"\n")
+        await self.writer.drain()
+        while True:
+            reply = await self.reader.readline()
+            if not reply:
+                raise ConnectionError("Server closed the connection")
+            reply = reply.decode().strip()
+            if reply.startswith(("OK", "ERR", "GAME", "CLOCK", "BOARD")):
+                return reply
+
+    async def close(self):
+        self.writer.write(b"QUIT\n")
+        self.writer.close()
+
+
+async def play_game(host, port, moves, latencies, clock):
+    white = await Client.connect(host, port)
+    black = await Client.connect(host, port)
+    try:
+        game_id = (await white.request(f"NEW normal human {clock}")).split()[1]
+        await black.request(f"JOIN {game_id}")
+        players = [white, black]
+        for index, move in enumerate(moves):
+            start = time.perf_counter()
+            reply = await players[index % 2].request(f"MOVE {move}")
+            latencies.append(time.perf_counter() - start)
+            if not reply.startswith("OK"):
+                raise RuntimeError(f"Move {move} was rejected: {reply}")
+    finally:
+        await white.close()
+        await black.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(games, pgn_path, host, port, clock):
+    moves = load_pgn_moves(pgn_path)
+    game_server = None
+    if host is None:
+        host = '127.0.0.1'
+        game_server = GameServer()
+        server = await game_server.start(host, 0)
+        port = server.sockets[0].getsockname()[1]
+    latencies = []
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(play_game(host, port, moves, latencies, clock) for _ in range(games)), return_exceptions=True)
+    finally:
+        if game_server is not None:
+            await game_server.stop()
+    elapsed = time.perf_counter() - start
+    failures = [result for result in results if isinstance(result, Exception)]
+    print(f"games: {games} ({len(failures)} failed), moves: {len(latencies)}, time: {elapsed:.2f}s")
+    if failures:
+        print(f"first failure: {failures[0]!r}")
+    if latencies:
+        print(f"moves/sec: {len(latencies) / elapsed:.0f}")
+        print(f"latency p50: {percentile(latencies, 0.5) * 1000:.2f}ms  p99: {percentile(latencies, 0.99) * 1000:.2f}ms  "
+              f"max: {max(latencies) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many games at once against the game server")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--pgn", default=os.path.join(os.path.dirname(__file__), "game.pgn"))
+    parser.add_argument("--host", default=None, help="server to test, by default a server is started in this process")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--clock", default="15+10")
+    args = parser.parse_args()
+    asyncio.run(run(args.games, args.pgn, args.host, args.port, args.clock))
@@ -0,0 +1,355 @@
+import argparse
+import time
+
+from profiling import profiler
+from rules import board_from_fen, move_to_san
+
+#Mate solver with depth-first proof-number search (df-pn). Instead of searching every move to a fixed depth like
+#alpha-beta, it always expands the move that looks easiest to prove or to refute: the one whose subtree needs the
+#fewest positions to be solved. Lines where the defender has few replies, e.g. after checks, are followed deep at
+#once, so long forced mates are found with few positions, and a position without a forced mate is proven as such.
+#
+#Every position has two numbers for the side to move: phi, how many positions at least have to be solved so the side
+#reaches its goal (the attacker mates, the defender escapes), and delta, the same for the opponent. phi = 0 means the
+#side to move reaches its goal. A position is the minimum of the deltas of its moves and the sum of their phis.
+#The numbers are kept in a bounded table keyed by the Zobrist hash. The mate found is forced, but not always the
+#shortest one, solve(shortest=True) shortens it.
+
+INFINITE = 10 ** 9
+
+
+class SolverStopped(Exception):
+    pass
+
+
+class MateResult:
+    def __init__(self, status, moves, nodes, elapsed):
+        #'mate', 'no_mate' or 'unknown' when a limit stopped the solver
+        self.status = status
+        #Moves of the mate, attacker first and the defender always playing its longest defence
+        self.moves = moves
+        self.mate_in = (len(moves) + 1) // 2 if status == 'mate' else None
+        #The mate is proven to be the shortest one, only with solve(shortest=True)
+        self.shortest = False
+        self.nodes = nodes
+        #Seconds
+        self.elapsed = elapsed
+
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class MateSolver:
+    #How many positions are searched between two checks of the limits
+    CHECK_INTERVAL = 1024
+
+    #table_size: positions in the table, when it is full the half with the least work is removed.
+    #max_plies: lines longer than this count as no mate. checks_only: the attacker only plays checks, which finds
+    #mates by a series of checks much faster
+    def __init__(self, table_size=1 << 20, max_plies=120, checks_only=False):
+        self.table_size = table_size
+        self.max_plies = max_plies
+        self.checks_only = checks_only
+        #key -> (phi, delta, plies to mate when the attacker mates, work, first ply). A no mate that comes from the
+        #max_plies limit or a repetition holds only on this ply and deeper ones, first ply is 0 for the others
+        self.table = {}
+        self.attacker = None
+        self.nodes = 0
+        self.max_nodes = None
+        self.deadline = None
+        self.next_check = 0
+        #Positions on the current line, a repetition is a draw and so no mate
+        self.path = set()
+
+    def clear(self):
+        self.table.clear()
+
+    #Is there a forced mate for color, who is to move? The board is not changed. With shortest the mate found is
+    #shortened: the position is solved again with max_plies below the length of the mate until there is no mate,
+    #all passes share the limits. When a limit stops it, the shortest mate so far is returned
+    @profiler.timed('mate.solve')
+    def solve(self, board, color, max_nodes=None, max_time=None, shortest=False):
+        board = board.copy()
+        self.attacker = color
+        self.nodes = 0
+        self.max_nodes = max_nodes
+        start = time.perf_counter()
+        self.deadline = start + max_time if max_time is not None else None
+        self.next_check = self.CHECK_INTERVAL
+        status, moves = self.solve_pass(board, color)
+        proven = False
+        if status == 'mate' and shortest:
+            max_plies = self.max_plies
+            bound = len(moves) - 2
+            try:
+                while bound > 0:
+                    #A proof or disproof with another ply limit is not valid for this one
+                    self.clear()
+                    self.max_plies = bound
+                    pass_status, pass_moves = self.solve_pass(board, color)
+                    if pass_status != 'mate':
+                        proven = pass_status == 'no_mate' and len(moves) <= bound + 2
+                        break
+                    if len(pass_moves) < len(moves) and self.ends_in_mate(board, color, pass_moves):
+                        moves = pass_moves
+                    bound = min(bound, len(moves)) - 2
+                else:
+                    proven = True
+            finally:
+                self.max_plies = max_plies
+        profiler.count('mate.nodes', self.nodes)
+        result = MateResult(status, moves, self.nodes, time.perf_counter() - start)
+        result.shortest = proven
+        return result
+
+    #One search from the root, returns (status, mate line)
+    def solve_pass(self, board, color):
+        self.path = set()
+        try:
+            phi, delta = self.mid(board, color, INFINITE, INFINITE, 0)
+        except SolverStopped:
+            return 'unknown', []
+        moves = self.mate_line(board.copy(), color) if phi == 0 else []
+        return ('mate' if phi == 0 else 'no_mate'), moves
+
+    #A line that is cut by max_plies may end before the mate
+    def ends_in_mate(self, board, color, moves):
+        board = board.copy()
+        for move in moves:
+            board.make_move(move)
+            color = 'black' if color == 'white' else 'white'
+        return color != self.attacker and board.in_check(color) and not board.legal_moves(color)
+
+    def check_limits(self):
+        self.next_check = self.nodes + self.CHECK_INTERVAL
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SolverStopped()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SolverStopped()
+
+    #Search the position until its phi or delta reaches its threshold, returns (phi, delta)
+    def mid(self, board, color, phi_threshold, delta_threshold, ply):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        key = board.zobrist_hash(color)
+        opponent = 'black' if color == 'white' else 'white'
+        attacking = color == self.attacker
+        moves = board.legal_moves(color)
+        if not moves:
+            #Only a mate of the defender is a success of the attacker, a stalemate is not
+            if not attacking and board.in_check(color):
+                self.store(key, INFINITE, 0, 0, 1)
+                return INFINITE, 0
+            if attacking:
+                self.store(key, INFINITE, 0, None, 1)
+                return INFINITE, 0
+            self.store(key, 0, INFINITE, None, 1)
+            return 0, INFINITE
+        phi, delta = (INFINITE, 0) if attacking else (0, INFINITE)
+        if ply >= self.max_plies:
+            self.store(key, phi, delta, None, 1, ply)
+            return phi, delta
+        children = None
+        if not board.is_insufficient_material():
+            children = self.expand(board, color, opponent, moves, attacking)
+        if not children:
+            #No mate: not enough material or with checks_only no check. It is stored like every result, otherwise
+            #the parent would search the position again and again
+            self.store(key, phi, delta, None, 1)
+            return phi, delta
+        self.path.add(key)
+        work = self.nodes
+        while True:
+            phi, delta, best, best_phi, second_delta = self.select(children, opponent, ply + 1)
+            if phi >= phi_threshold or delta >= delta_threshold:
+                break
+            child_phi_threshold = min(INFINITE, delta_threshold - delta + best_phi)
+            #A little more than the second best, so the search does not switch back and forth between two moves
+            child_delta_threshold = min(phi_threshold, second_delta + 1 + second_delta // 4)
+            move = children[best][0]
+            undo = board.make_move(move)
+            try:
+                self.mid(board, opponent, child_phi_threshold, child_delta_threshold, ply + 1)
+            finally:
+                board.unmake_move(undo)
+        distance = None
+        first_ply = 0
+        if attacking and phi == 0:
+            distance = 1 + min(self.distance(child_key) for _, child_key, start in children
+                               if self.values(child_key, opponent, start, ply + 1)[1] == 0)
+        elif not attacking and delta == 0:
+            distance = 1 + max(self.distance(child_key) for _, child_key, _ in children)
+        elif attacking and delta == 0:
+            #No move mates, the result holds as far as the least general of them
+            first_ply = max(self.first_ply(child_key, ply + 1) for _, child_key, _ in children) - 1
+        elif not attacking and phi == 0:
+            first_ply = min(self.first_ply(child_key, ply + 1) for _, child_key, start in children
+                            if self.values(child_key, opponent, start, ply + 1)[1] == 0) - 1
+        self.path.discard(key)
+        self.store(key, phi, delta, distance, self.nodes - work + 1, max(first_ply, 0))
+        return phi, delta
+
+    #The moves with the hash after them and the first numbers of the position after them. After a move of the
+    #attacker the defender has to refute each of its replies, so the number of replies is the first guess of how
+    #hard the position is to prove: moves that leave few replies (checks, a boxed in king) are tried first.
+    #The replies go to the move cache, where the search finds them again
+    def expand(self, board, color, opponent, moves, attacking):
+        children = []
+        for move in moves:
+            undo = board.make_move(move)
+            check = board.in_check(opponent)
+            child_key = board.zobrist_hash(opponent)
+            start = (1, 1)
+            if attacking and not (self.checks_only and not check):
+                replies = len(board.legal_moves(opponent))
+                if replies == 0:
+                    #Mate or stalemate, solved already
+                    start = (INFINITE, 0) if check else (0, INFINITE)
+                    self.store(child_key, start[0], start[1], 0 if check else None, 1)
+                else:
+                    start = (1, replies)
+            board.unmake_move(undo)
+            if attacking and self.checks_only and not check:
+                continue
+            children.append((move, child_key, start))
+        if attacking:
+            children.sort(key=lambda child: child[2][1])
+        return children
+
+    #phi and delta of the position after a move on ply, from the view of the side to move there
+    def values(self, key, color, start, ply):
+        if key in self.path:
+            #A repetition is a draw: the attacker did not mate, the defender escaped
+            return (INFINITE, 0) if color == self.attacker else (0, INFINITE)
+        entry = self.table.get(key)
+        if entry is not None and entry[4] <= ply:
+            return entry[0], entry[1]
+        return start if start is not None else (1, 1)
+
+    #The first ply from which the no mate of a position holds: a repetition on the current line only holds here
+    def first_ply(self, key, ply):
+        if key in self.path:
+            return ply
+        entry = self.table.get(key)
+        return entry[4] if entry is not None else 0
+
+    #(phi, delta) of the position from its moves, the index of the move to search next with its phi, and the
+    #second smallest delta of the moves
+    def select(self, children, opponent, ply):
+        phi = INFINITE
+        delta = 0
+        best = 0
+        best_phi = INFINITE
+        second_delta = INFINITE
+        for index, (move, child_key, start) in enumerate(children):
+            child_phi, child_delta = self.values(child_key, opponent, start, ply)
+            #Only a move that is solved makes the sum infinite, a large sum stays below
+            delta = INFINITE if child_phi == INFINITE or delta == INFINITE else min(INFINITE - 1, delta + child_phi)
+            if child_delta < phi:
+                second_delta = phi
+                phi = child_delta
+                best = index
+                best_phi = child_phi
+            elif child_delta < second_delta:
+                second_delta = child_delta
+        return phi, delta, best, best_phi, second_delta
+
+    def distance(self, key):
+        entry = self.table.get(key)
+        return entry[2] if entry is not None and entry[2] is not None else INFINITE
+
+    def store(self, key, phi, delta, distance, work, first_ply=0):
+        if len(self.table) >= self.table_size and key not in self.table:
+            #Keep the positions that were expensive to solve, the others are found again quickly
+            entries = sorted(self.table.items(), key=lambda item: item[1][3], reverse=True)
+            self.table = dict(entries[:self.table_size // 2])
+        self.table[key] = (phi, delta, distance, work, first_ply)
+
+    #Follow the proof: the attacker plays the move to the shortest proven mate, the defender its longest defence.
+    #Positions that were removed from the table are solved again
+    def mate_line(self, board, color):
+        line = []
+        while len(line) < self.max_plies:
+            moves = board.legal_moves(color)
+            if not moves:
+                break
+            opponent = 'black' if color == 'white' else 'white'
+            attacking = color == self.attacker
+            best = self.best_move(board, opponent, moves, attacking, False)
+            if best is None and attacking:
+                best = self.best_move(board, opponent, moves, attacking, True)
+            if best is None:
+                break
+            line.append(best)
+            board.make_move(best)
+            color = opponent
+        return line
+
+    #The attacker's move with the shortest mate after it or the defender's move with the longest one.
+    #Without solve only the moves whose positions are proven in the table are looked at
+    def best_move(self, board, opponent, moves, attacking, solve):
+        best = None
+        best_distance = None
+        for move in moves:
+            undo = board.make_move(move)
+            distance = self.mate_distance(board, opponent, solve or not attacking)
+            board.unmake_move(undo)
+            if distance is None:
+                continue
+            if best is None or (distance < best_distance if attacking else distance > best_distance):
+                best, best_distance = move, distance
+        return best
+
+    #Plies to mate for a position that the attacker mates in, None otherwise
+    def mate_distance(self, board, color, solve):
+        key = board.zobrist_hash(color)
+        entry = self.table.get(key)
+        if solve and (entry is None or entry[2] is None and entry[0] != 0 and entry[1] != 0):
+            self.path = set()
+            self.mid(board, color, INFINITE, INFINITE, 0)
+            entry = self.table.get(key)
+        if entry is None:
+            return None
+        mated = entry[0] == 0 if color == self.attacker else entry[1] == 0
+        return entry[2] if mated else None
+
+
+def format_line(board, color, moves, move_number=1):
+    board = board.copy()
+    tokens = []
+    for move in moves:
+        if color == 'white':
+            tokens.append(f"{move_number}.")
+        elif not tokens:
+            tokens.append(f"{move_number}...")
+        tokens.append(move_to_san(board, move, color, move.promotion))
+        board.make_move(move)
+        if color == 'black':
+            move_number += 1
+        color = 'black' if color == 'white' else 'white'
+    return ' '.join(tokens)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find a forced mate for the side to move")
+    parser.add_argument('fen')
+    parser.add_argument('--nodes', type=int, default=None)
+    parser.add_argument('--time', type=float, default=None, help="seconds")
+    parser.add_argument('--checks-only', action='store_true', help="only look for mates by a series of checks")
+    parser.add_argument('--shortest', action='store_true', help="shorten the mate found until it is the shortest one")
+    args = parser.parse_args()
+
+    board, color, move_number = board_from_fen(args.fen)
+    result = MateSolver(checks_only=args.checks_only).solve(board, color, args.nodes, args.time, args.shortest)
+    if result.status == 'mate':
+        line = format_line(board, color, result.moves, move_number)
+        if result.shortest:
+            print(f"Mate in {result.mate_in}: {line}")
+        else:
+            print(f"Forced mate found in {result.mate_in} moves (not necessarily the shortest): {line}")
+    elif result.status == 'no_mate':
+        print("No forced mate")
+    else:
+        print("No result within the limits")
+    print(f"{result.nodes} positions in {result.elapsed:.2f}s ({result.nodes_per_second():.0f} positions/sec)")
@@ -0,0 +1,117 @@
+import re
+
+from rules import Board, board_from_fen
+
+#Reading and writing of games in PGN. The reader understands tag pairs, comments, variations,
+#numeric annotations and move numbers, so it also reads files that were written by other programs.
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+_TAG = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+_TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+')
+
+
+class PgnGame:
+    def __init__(self, headers=None, moves=None, result='*'):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result
+
+
+#Yields one PgnGame for every game in the file
+def read_games(path):
+    with open(path, 'r') as file:
+        yield from parse_games(file)
+
+
+def parse_games(lines):
+    headers = {}
+    movetext = []
+    for line in lines:
+        stripped = line.strip()
+        tag = _TAG.match(stripped)
+        if tag:
+            #A tag after the moves starts the next game (the last game may have no result)
+            if movetext:
+                game = _parse_movetext(headers, ' '.join(movetext))
+                if game.moves:
+                    yield game
+                headers, movetext = {}, []
+            headers[tag.group(1)] = tag.group(2)
+            continue
+        if stripped:
+            movetext.append(stripped)
+            if stripped.split()[-1] in RESULTS:
+                yield _parse_movetext(headers, ' '.join(movetext))
+                headers, movetext = {}, []
+    if movetext:
+        game = _parse_movetext(headers, ' '.join(movetext))
+        if game.moves:
+            yield game
+
+
+def _parse_movetext(headers, text):
+    moves = []
+    result = headers.get('Result', '*')
+    variation_depth = 0
+    for token in _TOKEN.findall(text):
+        if token == '(':
+            variation_depth += 1
+        elif token == ')':
+            variation_depth = max(0, variation_depth - 1)
+        elif variation_depth or token[0] in '{;$' or token[0].isdigit() and token.rstrip('.').isdigit():
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            #Annotations like "!" or "?!" are not part of the move
+            moves.append(token.rstrip('!?'))
+    return PgnGame(headers, moves, result)
+
+
+#The start board and the color to move of a game: the position of its FEN tag (games from another start, e.g.
+#Chess960 or the openings of tournament.py) or the normal start position. Raises ValueError for an invalid FEN
+def start_position(game):
+    fen = game.headers.get('FEN')
+    if fen is None:
+        board = Board()
+        board.setup_pieces()
+        return board, 'white'
+    board, color, _ = board_from_fen(fen)
+    return board, color
+
+
+#Write one game with its tags, comments is an optional dict ply -> text that is written after the move.
+#A game with a FEN tag is numbered from the side to move and the move number of the FEN
+def write_game(file, moves, headers=None, result='*', comments=None):
+    headers = dict(headers or {})
+    headers.setdefault('Result', result)
+    for name, value in headers.items():
+        file.write(f'[{name} "{value}"]\n')
+    file.write('\n')
+    fields = headers.get('FEN', '').split()
+    #Plies before the first move, counted from white's first move
+    offset = 1 if len(fields) > 1 and fields[1] == 'b' else 0
+    if len(fields) > 5 and fields[5].isdigit():
+        offset += 2 * (max(int(fields[5]), 1) - 1)
+    tokens = []
+    for ply, move in enumerate(moves):
+        number = (ply + offset) // 2 + 1
+        if (ply + offset) % 2 == 0:
+            tokens.append(f"{number}.")
+        elif ply == 0 or (comments and ply - 1 in comments):
+            #A move of black that does not follow the move of white directly
+            tokens.append(f"{number}...")
+        tokens.append(move)
+        if comments and ply in comments:
+            tokens.append('{' + comments[ply] + '}')
+    tokens.append(result)
+    #Lines are wrapped at 80 characters like most programs do
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            file.write(line + '\n')
+            line = token
+        else:
+            line = token if not line else line + ' ' + token
+    file.write(line + '\n\n')
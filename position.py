@@ -0,0 +1,82 @@
+from archive import decode_position, encode_position
+
+#An immutable position: what a Board is without its Piece objects. It is small (the 32 byte encoding of the
+#archive and a few numbers), so it is cheap to pickle for a worker process, hashable by its Zobrist hash and can
+#be shared by threads without a lock. A copy is the same object, a move gives a new Position.
+#The repetitions of the game before the position are not part of it, a board made from it counts only this position.
+
+
+class Position:
+    __slots__ = ('placement', 'color', 'unmoved', 'en_passant', 'halfmove_clock', 'key')
+
+    #placement: encode_position of the grid, unmoved: bit row * 8 + col for every piece that did not move yet,
+    #en_passant: square of the pawn that can be captured en passant or None, key: Zobrist hash with the color to move
+    def __init__(self, placement, color, unmoved, en_passant, halfmove_clock, key):
+        object.__setattr__(self, 'placement', placement)
+        object.__setattr__(self, 'color', color)
+        object.__setattr__(self, 'unmoved', unmoved)
+        object.__setattr__(self, 'en_passant', en_passant)
+        object.__setattr__(self, 'halfmove_clock', halfmove_clock)
+        object.__setattr__(self, 'key', key)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Position is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Position is immutable")
+
+    def __reduce__(self):
+        return Position, (self.placement, self.color, self.unmoved, self.en_passant, self.halfmove_clock, self.key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return (self.key == other.key and self.placement == other.placement and self.color == other.color and
+                self.unmoved == other.unmoved and self.en_passant == other.en_passant and
+                self.halfmove_clock == other.halfmove_clock)
+
+    def __hash__(self):
+        return self.key
+
+    def __repr__(self):
+        return f"Position({self.color} to move, key {self.key:016x})"
+
+    #Immutable, so the copy is the position itself
+    def copy(self):
+        return self
+
+    @classmethod
+    def from_board(cls, board, color):
+        unmoved = 0
+        for row in range(8):
+            for col in range(8):
+                piece = board.grid[row][col]
+                if piece is not None and not piece.has_moved:
+                    unmoved |= 1 << (row * 8 + col)
+        en_passant = None
+        if board.en_passant_pawn is not None:
+            row, col = board.en_passant_pawn.position
+            en_passant = row * 8 + col
+        return cls(encode_position(board), color, unmoved, en_passant, board.halfmove_clock, board.zobrist_hash(color))
+
+    #A new Board of the rules with its own pieces, e.g. for a search in a worker
+    def to_board(self):
+        board = decode_position(self.placement)
+        for row in range(8):
+            for col in range(8):
+                piece = board.grid[row][col]
+                if piece is not None:
+                    piece.has_moved = not self.unmoved >> (row * 8 + col) & 1
+        if self.en_passant is not None:
+            pawn = board.grid[self.en_passant // 8][self.en_passant % 8]
+            board.en_passant_pawn = pawn
+            pawn.pawn_has_moved_two_squares_last_turn = True
+        board.reset_state(self.color)
+        board.halfmove_clock = self.halfmove_clock
+        return board
+
+    #The position after a move from the legal moves of this position
+    def play(self, move):
+        board = self.to_board()
+        board.make_move(move)
+        return Position.from_board(board, 'black' if self.color == 'white' else 'white')
@@ -0,0 +1,188 @@
+import argparse
+import logging
+import sqlite3
+import time
+
+from archive import ArchiveError, ArchiveReader, replay_san_moves
+from pgn import read_games, start_position
+from rules import Board, move_to_uci, play_san
+
+logger = logging.getLogger(__name__)
+
+#Position database: for every position of every stored game the Zobrist hash, the game and the ply are saved
+#in SQLite, together with the move that was played next. A position is found with one lookup in the hash index.
+#Games are ingested headlessly from PGN files or from a binary game archive.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    white TEXT,
+    black TEXT,
+    event TEXT,
+    result TEXT,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS positions (
+    hash INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    next_move TEXT
+);
+"""
+
+#The index is created after a bulk ingest, inserting into an indexed table is much slower
+INDEX = "CREATE INDEX IF NOT EXISTS positions_hash ON positions(hash)"
+
+
+#SQLite integers are signed, so the unsigned 64 bit hash is stored as a signed number
+def to_signed(key):
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class PositionDatabase:
+    def __init__(self, path, batch_size=10000):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def add_game(self, cursor, headers, result, source):
+        cursor.execute("INSERT INTO games (white, black, event, result, source) VALUES (?, ?, ?, ?, ?)",
+                       (headers.get('White'), headers.get('Black'), headers.get('Event'), result, source))
+        return cursor.lastrowid
+
+    #Stream games into the database. games yields (headers, result, source, plies) where plies yields
+    #(hash, next move) for every position. Rows are inserted in batches in one transaction
+    def ingest(self, games):
+        cursor = self.connection.cursor()
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("DROP INDEX IF EXISTS positions_hash")
+        rows = []
+        game_count = 0
+        position_count = 0
+        with self.connection:
+            for headers, result, source, plies in games:
+                game_id = self.add_game(cursor, headers, result, source)
+                for ply, (key, next_move) in enumerate(plies):
+                    rows.append((to_signed(key), game_id, ply, next_move))
+                if len(rows) >= self.batch_size:
+                    cursor.executemany("INSERT INTO positions VALUES (?, ?, ?, ?)", rows)
+                    position_count += len(rows)
+                    rows = []
+                game_count += 1
+            cursor.executemany("INSERT INTO positions VALUES (?, ?, ?, ?)", rows)
+            position_count += len(rows)
+            cursor.execute(INDEX)
+        return game_count, position_count
+
+    def ingest_pgn(self, paths):
+        def games():
+            for path in paths:
+                for number, game in enumerate(read_games(path), 1):
+                    try:
+                        board, color = start_position(game)
+                    except ValueError as error:
+                        logger.warning("%s game %d skipped: %s", path, number, error)
+                        continue
+                    yield game.headers, game.result, path, pgn_plies(game.moves, board, color)
+        return self.ingest(games())
+
+    def ingest_archive(self, path):
+        def games():
+            with ArchiveReader(path) as reader:
+                for number in range(len(reader)):
+                    yield {}, reader.result(number), f"{path}#{number}", archive_plies(reader, number)
+        return self.ingest(games())
+
+    #All (game id, ply) in which the position was reached
+    def find_games(self, board, color, limit=1000):
+        rows = self.connection.execute("SELECT game_id, ply FROM positions WHERE hash = ? LIMIT ?",
+                                       (to_signed(board.zobrist_hash(color)), limit))
+        return rows.fetchall()
+
+    #What was played in this position: for every next move how often it was played and the results
+    def move_statistics(self, board, color):
+        rows = self.connection.execute("""
+            SELECT positions.next_move, COUNT(*),
+                   SUM(games.result = '1-0'), SUM(games.result = '1/2-1/2'), SUM(games.result = '0-1')
+            FROM positions JOIN games ON games.id = positions.game_id
+            WHERE positions.hash = ? AND positions.next_move IS NOT NULL
+            GROUP BY positions.next_move
+            ORDER BY COUNT(*) DESC
+        """, (to_signed(board.zobrist_hash(color)),))
+        return [
+            {'move': move, 'games': count, 'white_wins': white_wins, 'draws': draws, 'black_wins': black_wins}
+            for move, count, white_wins, draws, black_wins in rows
+        ]
+
+
+#(hash, next move) for every position of a game in standard notation, from the normal start position when no
+#board is given. The last position has no next move
+def pgn_plies(san_moves, board=None, color='white'):
+    if board is None:
+        board = Board()
+        board.setup_pieces()
+    key = board.zobrist_hash(color)
+    try:
+        for moves, index, color in replay_san_moves(board, san_moves, color):
+            yield key, move_to_uci(moves[index])
+            key = board.zobrist_hash('black' if color == 'white' else 'white')
+    except ArchiveError as error:
+        #The positions before an invalid move are kept
+        logger.warning("Game stopped early: %s", error)
+    yield key, None
+
+
+def archive_plies(reader, number):
+    color = 'white'
+    board = None
+    for board, move, color in reader.replay(number):
+        yield board.zobrist_hash(color), move_to_uci(move)
+    if board is not None:
+        yield board.zobrist_hash('black' if color == 'white' else 'white'), None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query a database of the positions of many games")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="add the games of PGN files or game archives (.cga)")
+    build_parser.add_argument('database')
+    build_parser.add_argument('sources', nargs='+')
+    query_parser = subparsers.add_parser('query', help="show the statistics of the position after the given moves")
+    query_parser.add_argument('database')
+    query_parser.add_argument('moves', nargs='*', help="moves in standard notation from the start position")
+    args = parser.parse_args()
+
+    with PositionDatabase(args.database) as database:
+        if args.command == 'build':
+            start = time.perf_counter()
+            for source in args.sources:
+                if source.endswith('.cga'):
+                    games, positions = database.ingest_archive(source)
+                else:
+                    games, positions = database.ingest_pgn([source])
+                print(f"{source}: {games} games, {positions} positions")
+            print(f"{time.perf_counter() - start:.2f}s")
+        else:
+            board = Board()
+            board.setup_pieces()
+            color = 'white'
+            for san in args.moves:
+                success, error_message = play_san(board, san, color)
+                if not success:
+                    parser.error(f"{san}: {error_message}")
+                color = 'black' if color == 'white' else 'white'
+            start = time.perf_counter()
+            statistics = database.move_statistics(board, color)
+            elapsed = time.perf_counter() - start
+            for entry in statistics:
+                print(f"{entry['move']:6} {entry['games']:6} games  +{entry['white_wins']} ={entry['draws']} -{entry['black_wins']}")
+            print(f"{len(database.find_games(board, color))} games reached this position ({elapsed * 1000:.1f}ms)")
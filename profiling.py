@@ -0,0 +1,145 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+#Counters and timers for the hot paths (move generation, legality checks, checkmate, SAN parsing, frames).
+#The profiler is off by default. While it is off a timed function only costs one attribute check,
+#so it can stay on the hot paths all the time.
+class Profiler:
+    def __init__(self, max_trace_events=100000):
+        self.enabled = False
+        self.counters = {}
+        # name -> [calls, total seconds, max seconds]
+        self.timers = {}
+        # Complete events for the chrome trace, the oldest are dropped when full
+        self.trace_events = deque(maxlen=max_trace_events)
+        # Thread id -> name of the threads that recorded events
+        self.thread_names = {}
+        self.start_time = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+        self.trace_events.clear()
+        self.thread_names.clear()
+        self.start_time = time.perf_counter()
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, start, end):
+        duration = end - start
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, duration, duration]
+        else:
+            timer[0] += 1
+            timer[1] += duration
+            if duration > timer[2]:
+                timer[2] = duration
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        self.trace_events.append((name, start, duration, thread_id))
+
+    #Decorator that measures every call of the function under the given name
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add_time(name, start, time.perf_counter())
+            return wrapper
+        return decorator
+
+    #Context manager for timing a block of code, e.g. "with profiler.span('search'):"
+    def span(self, name):
+        return _Span(self, name)
+
+    #Summary of all timers and counters, sorted by total time
+    def report(self):
+        timers = {}
+        for name, (calls, total, longest) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            timers[name] = {
+                'calls': calls,
+                'total_ms': total * 1000,
+                'avg_us': total / calls * 1e6,
+                'max_us': longest * 1e6
+            }
+        return {'timers': timers, 'counters': dict(self.counters)}
+
+    #Lines for the in-game overlay
+    def summary_lines(self, limit=8):
+        lines = []
+        for name, stats in list(self.report()['timers'].items())[:limit]:
+            lines.append(f"{name}: {stats['calls']}x {stats['total_ms']:.1f}ms avg {stats['avg_us']:.0f}us")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        return lines
+
+    def export_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    #Write the recorded calls in the chrome trace event format (open with chrome://tracing or perfetto).
+    #Every thread gets its own track, e.g. the ponder thread next to the main loop
+    def export_chrome_trace(self, path):
+        pid = os.getpid()
+        events = []
+        #Copies, other threads may still add events
+        for thread_id, thread_name in list(self.thread_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        for name, start, duration, thread_id in list(self.trace_events):
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.start_time) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': thread_id
+            })
+        for name, value in self.counters.items():
+            events.append({'name': name, 'ph': 'C', 'ts': (time.perf_counter() - self.start_time) * 1e6,
+                           'pid': pid, 'tid': threading.get_ident(), 'args': {name: value}})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.profiler.enabled and hasattr(self, 'start'):
+            self.profiler.add_time(self.name, self.start, time.perf_counter())
+        return False
+
+
+#Shared profiler of the process
+profiler = Profiler()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from position import Position
+from rules import PIECE_LETTERS, Board, PieceType, RandomPositions
+
+#Many random legal positions of a material signature, e.g. to check a tablebase, as a benchmark corpus or as
+#training data. The positions are drawn by RandomPositions of the rules (uniform over all legal placements) and
+#turned into Position objects or, without a Board, FEN lines. Batches are drawn in a process pool; every batch has
+#its own seed made from the seed of the run, so a run with a seed gives the same positions with any number of workers.
+#  python random_positions.py KRvK 1000000 -o krk.fen --seed 1
+
+BATCH_SIZE = 10000
+
+
+#Through a Board, so the flags of the pieces and the key are the same as for every other Position
+def to_position(placement, color):
+    board = Board()
+    board.setup_placement(placement, color)
+    return Position.from_board(board, color)
+
+
+def to_fen(placement, color):
+    letters = [None] * 64
+    for square, piece_color, piece_type in placement:
+        letter = 'P' if piece_type == PieceType.PAWN else PIECE_LETTERS[piece_type]
+        letters[square] = letter if piece_color == 'white' else letter.lower()
+    rows = []
+    for row in range(8):
+        text = ''
+        empty = 0
+        for letter in letters[row * 8:row * 8 + 8]:
+            if letter is None:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            text += letter
+        rows.append(text + (str(empty) if empty else ''))
+    return f"{'/'.join(rows)} {'w' if color == 'white' else 'b'} - - 0 1"
+
+
+#Runs in a worker process: one batch of FEN lines
+def fen_batch(task):
+    signature, count, color, allow_check, seed = task
+    sampler = RandomPositions(signature, seed)
+    return [to_fen(placement, to_move) for placement, to_move in sampler.batch(count, color, allow_check)]
+
+
+#Batches of Position objects in this process, for callers that use the positions directly
+def position_batches(signature, count, color=None, allow_check=True, seed=None, batch_size=BATCH_SIZE):
+    sampler = RandomPositions(signature, seed)
+    while count > 0:
+        size = min(batch_size, count)
+        yield [to_position(placement, to_move) for placement, to_move in sampler.batch(size, color, allow_check)]
+        count -= size
+
+
+#Batches of FEN lines from a process pool, in the order of their seeds
+def fen_batches(signature, count, color=None, allow_check=True, seed=None, workers=None, batch_size=BATCH_SIZE):
+    #Fails here and not in every worker when the signature is invalid
+    RandomPositions(signature)
+    tasks = []
+    for index, start in enumerate(range(0, count, batch_size)):
+        batch_seed = None if seed is None else f"{seed}:{index}"
+        tasks.append((signature, min(batch_size, count - start), color, allow_check, batch_seed))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        yield from executor.map(fen_batch, tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write random legal positions of a material signature as FEN lines")
+    parser.add_argument('signature', help="pieces of white, v, pieces of black, e.g. KRvK, KQvKR or KPvK")
+    parser.add_argument('count', type=int)
+    parser.add_argument('-o', '--output', default='positions.fen')
+    parser.add_argument('--side', choices=('white', 'black'), default=None, help="color to move, random by default")
+    parser.add_argument('--no-check', action='store_true', help="the side to move is not in check either")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written = 0
+    with open(args.output, 'w') as file:
+        for batch in fen_batches(args.signature, args.count, args.side, not args.no_check, args.seed, args.workers):
+            file.write('\n'.join(batch) + '\n')
+            written += len(batch)
+    elapsed = time.perf_counter() - start
+    print(f"{written} positions in {elapsed:.2f}s ({written / elapsed:.0f} positions/sec), written to {args.output}")
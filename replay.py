@@ -0,0 +1,81 @@
+import logging
+
+from archive import ArchiveError, replay_san_moves
+
+logger = logging.getLogger(__name__)
+
+#Navigation in a game that is replayed from its moves, e.g. the PGN file in the game. The moves are checked and
+#turned into Move objects once, after that a position is reached with make_move and unmake_move only.
+#Every interval plies a copy of the board is kept, and the moves played since the last jump are on an undo stack,
+#so any seek costs at most about interval moves: back with the undo stack or forward from the nearest copy.
+
+
+class Replay:
+    DEFAULT_INTERVAL = 16
+
+    #board is in the start position, it is the board that shows the replay and is changed by every seek
+    def __init__(self, board, san_moves, color='white', interval=DEFAULT_INTERVAL):
+        self.board = board
+        self.start_color = color
+        self.interval = interval
+        self.moves = []
+        self.san_moves = []
+        #Why the replay stopped before the last move, None when all moves are valid
+        self.error = None
+        try:
+            for moves, index, _ in replay_san_moves(board.copy(), san_moves, color):
+                self.moves.append(moves[index])
+                self.san_moves.append(san_moves[len(self.moves) - 1])
+        except ArchiveError as error:
+            self.error = str(error)
+            logger.warning("Replay stops after %d plies: %s", len(self.moves), error)
+        #ply -> copy of the board after ply moves. They are made with make_move like every seek, play_san counts
+        #the position before a promotion for the repetitions
+        self.snapshots = {0: board.copy()}
+        work_board = board.copy()
+        for ply, move in enumerate(self.moves, 1):
+            work_board.make_move(move)
+            if ply % interval == 0:
+                self.snapshots[ply] = work_board.copy()
+        self.ply = 0
+        #Undo information of the moves from the last snapshot that was restored up to self.ply
+        self.undo_stack = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    #Color to move after the current ply
+    def color(self):
+        if self.ply % 2 == 0:
+            return self.start_color
+        return 'black' if self.start_color == 'white' else 'white'
+
+    #Go to the position after ply moves (0 is the start). Returns the ply that was reached
+    def seek(self, ply):
+        ply = max(0, min(ply, len(self.moves)))
+        snapshot = ply - ply % self.interval
+        if ply < self.ply:
+            #Back with the undo stack when it reaches and that is cheaper than forward from the snapshot
+            if self.ply - ply <= len(self.undo_stack) and self.ply - ply <= ply - snapshot:
+                while self.ply > ply:
+                    self.board.unmake_move(self.undo_stack.pop())
+                    self.ply -= 1
+                return self.ply
+            self.restore(snapshot)
+        elif ply - self.ply > ply - snapshot:
+            self.restore(snapshot)
+        while self.ply < ply:
+            self.undo_stack.append(self.board.make_move(self.moves[self.ply]))
+            self.ply += 1
+        return self.ply
+
+    def forward(self, plies=1):
+        return self.seek(self.ply + plies)
+
+    def back(self, plies=1):
+        return self.seek(self.ply - plies)
+
+    def restore(self, snapshot):
+        self.board.copy_from(self.snapshots[snapshot])
+        self.ply = snapshot
+        self.undo_stack = []
@@ -0,0 +1,1934 @@
+from enum import Enum, auto
+import random
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+class PieceType(Enum):
+    PAWN   = auto()
+    KNIGHT = auto()
+    BISHOP = auto()
+    ROOK   = auto()
+    QUEEN  = auto()
+    KING   = auto()
+
+
+#The piece types a pawn can be promoted to, in the order generate_moves creates the promotion moves
+PROMOTION_TYPES = [PieceType.QUEEN, PieceType.ROOK, PieceType.BISHOP, PieceType.KNIGHT]
+
+
+#Random numbers for the Zobrist hash of a position. They have their own generator with a fixed seed,
+#so a position has the same hash in every process and in every stored database
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {
+    (color, piece_type): [_zobrist_random.getrandbits(64) for _ in range(64)]
+    for color in ('white', 'black') for piece_type in PieceType
+}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+#Kings and rooks that did not move yet, this stands for the castling rights
+ZOBRIST_UNMOVED = [_zobrist_random.getrandbits(64) for _ in range(64)]
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+
+
+#Precomputed attacks for every square (row * 8 + col): the squares a knight or king attacks from there and
+#the rays of the sliding pieces, every ray is a list of squares from near to far
+def _jump_targets(row, col, offsets):
+    return [(row + d_row, col + d_col) for d_row, d_col in offsets if 0 <= row + d_row < 8 and 0 <= col + d_col < 8]
+
+
+def _ray(row, col, d_row, d_col):
+    squares = []
+    row, col = row + d_row, col + d_col
+    while 0 <= row < 8 and 0 <= col < 8:
+        squares.append((row, col))
+        row, col = row + d_row, col + d_col
+    return squares
+
+
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+KNIGHT_TARGETS = [_jump_targets(square // 8, square % 8, KNIGHT_OFFSETS) for square in range(64)]
+KING_TARGETS = [_jump_targets(square // 8, square % 8, KING_OFFSETS) for square in range(64)]
+ROOK_RAYS = [[_ray(square // 8, square % 8, d_row, d_col) for d_row, d_col in ((-1, 0), (1, 0), (0, -1), (0, 1))] for square in range(64)]
+BISHOP_RAYS = [[_ray(square // 8, square % 8, d_row, d_col) for d_row, d_col in ((-1, -1), (-1, 1), (1, -1), (1, 1))] for square in range(64)]
+
+
+#The same attacks as bit masks (bit row * 8 + col), to test many positions for checks without a Board
+def _mask(squares):
+    mask = 0
+    for row, col in squares:
+        mask |= 1 << (row * 8 + col)
+    return mask
+
+
+KNIGHT_MASKS = [_mask(targets) for targets in KNIGHT_TARGETS]
+KING_MASKS = [_mask(targets) for targets in KING_TARGETS]
+#Squares from which a pawn of the color attacks the square: white pawns capture towards row 0
+PAWN_ATTACKER_MASKS = {
+    'white': [_mask(_jump_targets(square // 8, square % 8, [(1, -1), (1, 1)])) for square in range(64)],
+    'black': [_mask(_jump_targets(square // 8, square % 8, [(-1, -1), (-1, 1)])) for square in range(64)],
+}
+#All squares of the rays, a slider that is not on them can't attack the square whatever stands between
+ROOK_LINES = [_mask(square for ray in rays for square in ray) for rays in ROOK_RAYS]
+BISHOP_LINES = [_mask(square for ray in rays for square in ray) for rays in BISHOP_RAYS]
+ROOK_RAY_SQUARES = [[[row * 8 + col for row, col in ray] for ray in rays] for rays in ROOK_RAYS]
+BISHOP_RAY_SQUARES = [[[row * 8 + col for row, col in ray] for ray in rays] for rays in BISHOP_RAYS]
+
+
+#Is the square attacked by the pieces in masks (piece type -> bit mask of the squares of the attacking color)?
+#occupied is the mask of all pieces, it blocks the rays
+def is_attacked_by_masks(square, occupied, masks, color):
+    if KNIGHT_MASKS[square] & masks[PieceType.KNIGHT] or KING_MASKS[square] & masks[PieceType.KING]:
+        return True
+    if PAWN_ATTACKER_MASKS[color][square] & masks[PieceType.PAWN]:
+        return True
+    for lines, rays, slider in ((ROOK_LINES, ROOK_RAY_SQUARES, PieceType.ROOK), (BISHOP_LINES, BISHOP_RAY_SQUARES, PieceType.BISHOP)):
+        sliders = masks[slider] | masks[PieceType.QUEEN]
+        if not lines[square] & sliders:
+            continue
+        for ray in rays[square]:
+            for target in ray:
+                bit = 1 << target
+                if bit & occupied:
+                    if bit & sliders:
+                        return True
+                    break
+    return False
+
+
+#The pieces of a material signature like "KRvK" or "KQRRBNPPPPvKQRBNNPPPP": the pieces of white, "v" and
+#the pieces of black, each side with one king. Returns a list of (color, piece type), pawns first
+def parse_material(signature):
+    sides = signature.upper().split('V')
+    if len(sides) != 2:
+        raise ValueError(f"A material signature needs the pieces of white and black, e.g. KRvK: {signature}")
+    pieces = []
+    for color, letters in zip(('white', 'black'), sides):
+        for letter in letters:
+            piece_type = FEN_PIECES.get(letter.lower())
+            if piece_type is None:
+                raise ValueError(f"Invalid piece {letter} in {signature}")
+            pieces.append((color, piece_type))
+        if letters.count('K') != 1:
+            raise ValueError(f"Every side needs one king: {signature}")
+        if letters.count('P') > 8:
+            raise ValueError(f"More than 8 pawns: {signature}")
+    if len(pieces) > 32:
+        raise ValueError(f"More than 32 pieces: {signature}")
+    pieces.sort(key=lambda piece: piece[1] != PieceType.PAWN)
+    return pieces
+
+
+#Uniformly random legal positions of a material signature. Every piece gets a random square (pawns not on the first
+#and last rank), a position where the side that just moved is in check is thrown away and drawn again, so every
+#legal placement is equally likely. The check test uses the attack masks, no Board is made.
+#Castling and en passant are never possible, pawns on their start rank may move two squares
+class RandomPositions:
+    PAWN_SQUARES = list(range(8, 56))
+    #A signature where this many tries in a row give no legal position has (almost) none
+    MAX_TRIES = 10000
+
+    def __init__(self, signature, seed=None):
+        self.signature = signature
+        self.pieces = parse_material(signature)
+        self.pawn_count = sum(1 for _, piece_type in self.pieces if piece_type == PieceType.PAWN)
+        self.random = random.Random(seed)
+
+    #One position: a list of (square, color, piece type) and the color to move, random when it is None.
+    #With allow_check False the side to move is not in check either. condition is an optional test of the
+    #placement, positions that don't pass it are drawn again like illegal ones
+    def sample(self, color=None, allow_check=True, condition=None):
+        for _ in range(self.MAX_TRIES):
+            squares = self.random.sample(self.PAWN_SQUARES, self.pawn_count)
+            taken = set(squares)
+            free = [square for square in range(64) if square not in taken]
+            squares += self.random.sample(free, len(self.pieces) - self.pawn_count)
+            to_move = color or self.random.choice(('white', 'black'))
+            placement = [(square, piece_color, piece_type) for square, (piece_color, piece_type) in zip(squares, self.pieces)]
+            if self.is_legal(placement, to_move, allow_check) and (condition is None or condition(placement)):
+                return placement, to_move
+        raise ValueError(f"No legal position found for {self.signature}")
+
+    #count positions, see sample
+    def batch(self, count, color=None, allow_check=True, condition=None):
+        return [self.sample(color, allow_check, condition) for _ in range(count)]
+
+    @staticmethod
+    def is_legal(placement, color, allow_check=True):
+        occupied = 0
+        masks = {side: {piece_type: 0 for piece_type in PieceType} for side in ('white', 'black')}
+        kings = {}
+        for square, piece_color, piece_type in placement:
+            bit = 1 << square
+            occupied |= bit
+            masks[piece_color][piece_type] |= bit
+            if piece_type == PieceType.KING:
+                kings[piece_color] = square
+        opponent = 'black' if color == 'white' else 'white'
+        if is_attacked_by_masks(kings[opponent], occupied, masks[color], color):
+            return False
+        return allow_check or not is_attacked_by_masks(kings[color], occupied, masks[opponent], opponent)
+
+
+class Clock:
+    def __init__(self, minutes, increment=0):
+        self.minutes = minutes
+        self.increment = increment
+        self.white_time = minutes * 60  # Convert to seconds
+        self.black_time = minutes * 60
+        self.is_running = False
+        self.current_player = 'white'
+
+    def start_clock(self):
+        self.is_running = True
+
+    def stop_clock(self):
+        self.is_running = False
+    
+    def update_clock(self, delta_time):
+        delta_time = delta_time / 1000
+        if self.is_running:
+            if self.current_player == 'white':
+                self.white_time -= delta_time
+            else:
+                self.black_time -= delta_time
+
+    def switch_player(self):
+        if self.current_player == 'white':
+            self.white_time += self.increment
+            self.current_player = 'black'
+        else:
+            self.black_time += self.increment
+            self.current_player = 'white'        
+        
+
+    def get_time_string(self, time_in_seconds):
+        time_in_seconds = int(time_in_seconds)
+        minutes = time_in_seconds // 60
+        seconds = time_in_seconds % 60
+        return f"{minutes:02d}:{seconds:02d}"
+
+    def get_white_time_string(self):
+        return self.get_time_string(self.white_time)
+
+    def get_black_time_string(self):
+        return self.get_time_string(self.black_time)
+
+    #Milliseconds until the displayed time of the running player changes, None if nothing will change
+    def time_until_next_second(self):
+        if not self.is_running:
+            return None
+        time_left = self.white_time if self.current_player == 'white' else self.black_time
+        if time_left <= 0:
+            return None
+        return (time_left - math.floor(time_left)) * 1000
+
+
+#Least recently used cache of the legal moves of positions, keyed by the Zobrist hash (which contains the color
+#to move). The UI, the notation parser and the game end check ask for the moves of the same position many times.
+#The cached lists and moves are shared, so they must never be changed
+class MoveCache:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        #The ponder thread and the game use the same cache, an eviction between get and move_to_end would fail
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            moves = self.entries.get(key)
+            if moves is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return moves
+
+    def put(self, key, moves):
+        with self.lock:
+            self.entries[key] = moves
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+#Shared by all boards of the process
+move_cache = MoveCache()
+
+
+#The chess board with all the rules, without any drawing. chess.py adds the pygame drawing on top of it
+class Board:
+    def __init__(self):
+        self.grid: list[list[Piece | None]] = [[None for _ in range(8)] for _ in range(8)]
+        #Check state of the current position, updated by every move and setup (update_check_state).
+        #The checkers are the positions of the pieces that give check
+        self.whiteInCheck = False
+        self.blackInCheck = False
+        self.whiteCheckers: list[tuple[int, int]] = []
+        self.blackCheckers: list[tuple[int, int]] = []
+        #King pieces found by get_king_position, so the board does not have to be searched every time
+        self.kings: dict[str, Piece] = {}
+        self.game_mode: str | None = None
+        #The pawn that moved two squares in the last move, only this pawn can be captured en passant
+        self.en_passant_pawn: Piece | None = None
+        #Counters that every move updates, so the game end rules cost almost nothing per move (see reset_state):
+        #the Zobrist hash without the color to move, the plies since the last capture or pawn move,
+        #the number of pieces of every (color, type) and how often every position (hash with color) was reached
+        self.key = 0
+        self.halfmove_clock = 0
+        self.material: dict[tuple[str, PieceType], int] = {}
+        self.repetitions: dict[int, int] = {}
+
+    #Compute all incremental state from the grid. The setup functions call this, other code that places
+    #pieces on the grid itself has to call it too. color is the color to move in the position
+    def reset_state(self, color: str = 'white'):
+        self.key = self.compute_zobrist_hash('white')
+        self.halfmove_clock = 0
+        self.material = {(piece_color, piece_type): 0 for piece_color in ('white', 'black') for piece_type in PieceType}
+        for row in self.grid:
+            for piece in row:
+                if piece is not None:
+                    self.material[(piece.color, piece.type)] += 1
+        self.repetitions = {self.zobrist_hash(color): 1}
+        self.update_check_state()
+
+    #A copy with its own pieces, e.g. for a search in another thread. It is always a Board of the rules without
+    #the drawing of chess.py
+    def copy(self) -> 'Board':
+        board = Board()
+        board.copy_from(self)
+        return board
+
+    #Set this board to the position of another board, with new pieces. The drawing board of chess.py uses this
+    #to show a position that was kept as a copy, e.g. a snapshot of a replayed game
+    def copy_from(self, other: 'Board'):
+        self.game_mode = other.game_mode
+        self.grid = [[None for _ in range(8)] for _ in range(8)]
+        self.kings = {}
+        for row in range(8):
+            for col in range(8):
+                piece = other.grid[row][col]
+                if piece is not None:
+                    new_piece = Piece(piece.color, piece.position, piece.type)
+                    new_piece.has_moved = piece.has_moved
+                    new_piece.pawn_has_moved_two_squares_last_turn = piece.pawn_has_moved_two_squares_last_turn
+                    self.grid[row][col] = new_piece
+        self.en_passant_pawn = None
+        if other.en_passant_pawn is not None:
+            row, col = other.en_passant_pawn.position
+            self.en_passant_pawn = self.grid[row][col]
+        self.whiteInCheck = other.whiteInCheck
+        self.blackInCheck = other.blackInCheck
+        self.whiteCheckers = list(other.whiteCheckers)
+        self.blackCheckers = list(other.blackCheckers)
+        self.key = other.key
+        self.halfmove_clock = other.halfmove_clock
+        self.material = dict(other.material)
+        self.repetitions = dict(other.repetitions)
+
+    def get_position_representation(self):
+            """
+            Returns a string representation of the board.
+            Each square is represented by two characters:
+            - ".." for an empty square,
+            - Otherwise, the first letter of the piece's color and the first letter of its type.
+            Rows are concatenated with newline characters.
+            """
+            rep = ""
+            for row in range(8):
+                for col in range(8):
+                    piece = self.grid[row][col]
+                    if piece is None:
+                        rep += ".."
+                    else:
+                        # Assume piece.color is a string like 'white' or 'black'
+                        # and piece.type.name gives a string like "KING" or "ROOK".
+                        rep += piece.color[0] + piece.type.name[0]
+                rep += "\n"
+            return rep
+
+
+    def setup_pieces(self):
+        #We setup the pieces in the starting position
+        white_pieces = [
+            Piece('white', (7, 0), PieceType.ROOK),
+            Piece('white', (7, 1), PieceType.KNIGHT),
+            Piece('white', (7, 2), PieceType.BISHOP),
+            Piece('white', (7, 3), PieceType.QUEEN),
+            Piece('white', (7, 4), PieceType.KING),
+            Piece('white', (7, 5), PieceType.BISHOP),
+            Piece('white', (7, 6), PieceType.KNIGHT),
+            Piece('white', (7, 7), PieceType.ROOK),
+            Piece('white', (6, 0), PieceType.PAWN),
+            Piece('white', (6, 1), PieceType.PAWN), 
+            Piece('white', (6, 2), PieceType.PAWN),
+            Piece('white', (6, 3), PieceType.PAWN),
+            Piece('white', (6, 4), PieceType.PAWN),
+            Piece('white', (6, 5), PieceType.PAWN),
+            Piece('white', (6, 6), PieceType.PAWN),
+            Piece('white', (6, 7), PieceType.PAWN)
+        ]
+        black_pieces = [
+            Piece('black', (0, 0), PieceType.ROOK),
+            Piece('black', (0, 1), PieceType.KNIGHT),
+            Piece('black', (0, 2), PieceType.BISHOP),
+            Piece('black', (0, 3), PieceType.QUEEN),
+            Piece('black', (0, 4), PieceType.KING),
+            Piece('black', (0, 5), PieceType.BISHOP),
+            Piece('black', (0, 6), PieceType.KNIGHT),
+            Piece('black', (0, 7), PieceType.ROOK),
+            Piece('black', (1, 0), PieceType.PAWN),
+            Piece('black', (1, 1), PieceType.PAWN),
+            Piece('black', (1, 2), PieceType.PAWN),
+            Piece('black', (1, 3), PieceType.PAWN),
+            Piece('black', (1, 4), PieceType.PAWN),
+            Piece('black', (1, 5), PieceType.PAWN),
+            Piece('black', (1, 6), PieceType.PAWN),
+            Piece('black', (1, 7), PieceType.PAWN)
+        ]
+        #We add the pieces to the grid
+        for piece in white_pieces:
+            self.grid[piece.position[0]][piece.position[1]] = piece
+        for piece in black_pieces:
+            self.grid[piece.position[0]][piece.position[1]] = piece
+        self.reset_state()
+ 
+    # starting position rules: 
+    # pawns are in their usual position
+    # bishops must be on opposite-colored squares
+    # king must be between the two rooks
+
+    def setup_fischer_random(self):
+        # set up pawns 
+        black_pieces = [
+            Piece('black', (1, 0), PieceType.PAWN),
+            Piece('black', (1, 1), PieceType.PAWN),
+            Piece('black', (1, 2), PieceType.PAWN),
+            Piece('black', (1, 3), PieceType.PAWN),
+            Piece('black', (1, 4), PieceType.PAWN),
+            Piece('black', (1, 5), PieceType.PAWN),
+            Piece('black', (1, 6), PieceType.PAWN),
+            Piece('black', (1, 7), PieceType.PAWN)
+        ]
+        white_pieces = [
+            Piece('white', (6, 0), PieceType.PAWN),
+            Piece('white', (6, 1), PieceType.PAWN), 
+            Piece('white', (6, 2), PieceType.PAWN),
+            Piece('white', (6, 3), PieceType.PAWN),
+            Piece('white', (6, 4), PieceType.PAWN),
+            Piece('white', (6, 5), PieceType.PAWN),
+            Piece('white', (6, 6), PieceType.PAWN),
+            Piece('white', (6, 7), PieceType.PAWN)
+        ]
+
+        # set up white & black bank-rank pieces 
+
+        numbers = list(range(8))  # [0, 1, 2, ..., 8]
+
+        # set up bishops 
+        bish_pos = random.randint(0, 7)
+       
+        if bish_pos%2 == 0: # if bishop is on pink
+            bish_pos2 = random.choice([1, 3, 5, 7,])
+        else:
+            bish_pos2 = random.choice([0, 2, 4, 6])
+        
+        white_pieces.append(Piece('white',(7, bish_pos), PieceType.BISHOP))
+        white_pieces.append(Piece('white',(7, bish_pos2), PieceType.BISHOP))
+        black_pieces.append(Piece('black',(0, bish_pos), PieceType.BISHOP))
+        black_pieces.append(Piece('black',(0, bish_pos2), PieceType.BISHOP))
+
+        numbers.remove(bish_pos)
+        numbers.remove(bish_pos2)
+
+        # set rooks 
+        rook_pos = random.choice(numbers)
+        index = numbers.index(rook_pos)
+        numbers.remove(rook_pos)
+        valid_choices = []
+        for i, num in enumerate(numbers):
+             if abs(i - index) > 1:  # not same index, not neighbor
+                 valid_choices.append(num)
+
+        rook_pos2 = random.choice(valid_choices)
+
+        white_pieces.append(Piece('white', (7, rook_pos), PieceType.ROOK))
+        white_pieces.append(Piece('white', (7, rook_pos2), PieceType.ROOK))
+        black_pieces.append(Piece('black', (0, rook_pos), PieceType.ROOK))
+        black_pieces.append(Piece('black', (0, rook_pos2), PieceType.ROOK))
+        numbers.remove(rook_pos2)
+    
+        # set king
+        # Determine the lower and upper bounds
+        lower = min(rook_pos, rook_pos2)
+        upper = max(rook_pos, rook_pos2)
+        valid_choices2= [num for num in numbers if lower < num < upper]
+        king_pos = random.choice(valid_choices2)
+
+        white_pieces.append(Piece('white', (7, king_pos), PieceType.KING))
+        black_pieces.append(Piece('black', (0, king_pos), PieceType.KING))
+        numbers.remove(king_pos)
+
+        # set Queen
+        queen_pos = random.choice(numbers)
+
+        white_pieces.append(Piece('white', (7, queen_pos), PieceType.QUEEN))
+        black_pieces.append(Piece('black', (0, queen_pos), PieceType.QUEEN))
+        numbers.remove(queen_pos)
+
+        # set knight
+        knight_pos = random.choice(numbers)
+        numbers.remove(knight_pos)
+        knight_pos2 = random.choice(numbers)
+
+        white_pieces.append(Piece('white', (7, knight_pos), PieceType.KNIGHT))
+        white_pieces.append(Piece('white', (7, knight_pos2), PieceType.KNIGHT))
+        black_pieces.append(Piece('black', (0, knight_pos), PieceType.KNIGHT))
+        black_pieces.append(Piece('black', (0, knight_pos2), PieceType.KNIGHT))
+        
+        numbers.remove(knight_pos2)
+
+
+        for piece in white_pieces:
+            self.grid[piece.position[0]][piece.position[1]] = piece
+        for piece in black_pieces:
+            self.grid[piece.position[0]][piece.position[1]] = piece
+        self.reset_state()
+
+
+
+
+    #King and rook against king: white to move, nobody in check and the white king not on the edge
+    def setup_two_rooks(self):
+        def king_inside(placement):
+            for square, piece_color, piece_type in placement:
+                if piece_color == 'white' and piece_type == PieceType.KING:
+                    return 1 <= square // 8 <= 6 and 1 <= square % 8 <= 6
+            return False
+        placement, color = RandomPositions('KRvK').sample('white', allow_check=False, condition=king_inside)
+        self.setup_placement(placement, color)
+
+    #Set up a position of RandomPositions: a list of (square, color, piece type). Pawns on their start rank
+    #may move two squares, the other pieces count as moved (no castling)
+    def setup_placement(self, placement, color='white'):
+        self.grid = [[None for _ in range(8)] for _ in range(8)]
+        self.en_passant_pawn = None
+        for square, piece_color, piece_type in placement:
+            row, col = divmod(square, 8)
+            piece = Piece(piece_color, (row, col), piece_type)
+            piece.has_moved = not (piece_type == PieceType.PAWN and row == (6 if piece_color == 'white' else 1))
+            self.grid[row][col] = piece
+        self.reset_state(color)
+
+    #The legal moves of pieces of the given type that match the position constraints (None matches any row or
+    #column) and go to the target. A promotion is one move per piece, the pawn is promoted with promote_pawn.
+    #When the legal moves of the position are cached they are used, otherwise only the matching pieces are looked at
+    def find_candidate_moves(self, piece_type: PieceType, from_pos: tuple[int | None, int | None], to_pos: tuple[int, int],
+                             current_turn: str, is_capture: bool) -> list['Move']:
+        def matches(move):
+            return (move.to_row == to_pos[0] and move.to_col == to_pos[1] and move.is_capture == is_capture and
+                    move.rook_from is None and
+                    (from_pos[0] is None or from_pos[0] == move.from_row) and  # Match rank if specified
+                    (from_pos[1] is None or from_pos[1] == move.from_col))     # Match file if specified
+
+        candidates = []
+        cached_moves = move_cache.get(self.zobrist_hash(current_turn))
+        if cached_moves is not None:
+            for move in cached_moves:
+                if matches(move) and move.promotion in (None, PieceType.QUEEN) and self.grid[move.from_row][move.from_col].type == piece_type:
+                    if move.promotion is not None:
+                        move = Move(move.from_col, move.from_row, move.to_col, move.to_row, move.is_capture)
+                    candidates.append(move)
+            return candidates
+        for row in range(8):
+            for col in range(8):
+                piece = self.grid[row][col]
+                if piece and piece.type == piece_type and piece.color == current_turn:
+                    for move in piece.get_valid_moves(self):
+                        if matches(move) and self.is_legal_move(move, current_turn):
+                            candidates.append(move)
+        return candidates
+
+    @profiler.timed('move_piece')
+    def move_piece(self, piece_type: PieceType, from_pos: tuple[int | None, int | None], to_pos: tuple[int, int], current_turn: str) -> bool:
+        # Find all pieces that match the type and position constraints and can legally move to the target
+        candidates = self.find_candidate_moves(piece_type, from_pos, to_pos, current_turn, False)
+
+        # If there's exactly one candidate, make the move
+        if len(candidates) == 1:
+            self.make_move(candidates[0])
+            return True
+
+        return False
+
+    @profiler.timed('move_piece_capture')
+    def move_piece_capture(self, piece_type: PieceType, from_pos: tuple[int | None, int | None], to_pos: tuple[int, int], current_turn: str) -> bool:
+        #We only look at captures, including en passant
+        candidates = self.find_candidate_moves(piece_type, from_pos, to_pos, current_turn, True)
+
+        logger.debug("Capture %s -> %s has %d candidates", from_pos, to_pos, len(candidates))
+        # If there's exactly one candidate, make the move
+        if len(candidates) == 1:
+            self.make_move(candidates[0])
+            return True
+
+        return False
+
+    def castle(self, king_from: tuple[int, int], king_to: tuple[int, int],
+            rook_from: tuple[int, int], rook_to: tuple[int, int],
+            current_turn: str) -> bool:
+        # Retrieve the king and rook from the board.
+        king = self.grid[king_from[0]][king_from[1]]
+        rook = self.grid[rook_from[0]][rook_from[1]]
+
+        # 1) Verify that the pieces are correct.
+        if not king or king.type != PieceType.KING:
+            return False
+        if not rook or rook.type != PieceType.ROOK:
+            return False
+
+        # 2) Check if they have moved before.
+        if king.has_moved or rook.has_moved:
+            return False
+
+        # 3) They must be on the same row (no vertical castling).
+        if king_from[0] != rook_from[0]:
+            return False
+        row = king_from[0]
+
+        # 4) Ensure all squares between the king and rook are empty (except king/rook).
+        #    We only check the *strictly* in-between squares.
+        col_start = min(king_from[1], rook_from[1]) + 1
+        col_end = max(king_from[1], rook_from[1])
+        for col in range(col_start, col_end):
+            if self.grid[row][col] is not None:
+                return False
+
+        # 5) Ensure the king is not currently in check.
+        if (current_turn == 'white' and self.whiteInCheck) or \
+        (current_turn == 'black' and self.blackInCheck):
+            return False
+
+        # 6) Check that none of the squares the king passes through (including destination)
+        #    are under attack.
+        step = 1 if king_to[1] > king_from[1] else -1
+        for col in range(king_from[1] + step, king_to[1] + step, step):
+            if self.is_square_under_attack(king.color, row, col):
+                return False
+
+        # 7) Ensure the final squares (king_to, rook_to) are empty
+        #    (Castling cannot capture any piece, whether friendly or enemy.)
+        if self.grid[king_to[0]][king_to[1]] is not None:
+            return False
+        if self.grid[rook_to[0]][rook_to[1]] is not None:
+            return False
+
+        # --- If we reach here, castling is valid. Perform the move. ---
+        self.make_move(Move(king_from[1], king_from[0], king_to[1], king_to[0], False, rook_from=rook_from, rook_to=rook_to))
+
+        return True
+
+    #64 bit Zobrist hash of the position with the given color to move. Besides the pieces it contains
+    #the kings and rooks that did not move yet (castling rights) and the file of the en passant pawn.
+    #The moves keep self.key up to date, so this costs nothing
+    def zobrist_hash(self, color: str) -> int:
+        return self.key ^ ZOBRIST_BLACK_TO_MOVE if color == 'black' else self.key
+
+    #The same hash computed from the grid, to set up self.key and to verify it while debugging
+    def compute_zobrist_hash(self, color: str) -> int:
+        key = ZOBRIST_BLACK_TO_MOVE if color == 'black' else 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.grid[row][col]
+                if piece is None:
+                    continue
+                square = row * 8 + col
+                key ^= ZOBRIST_PIECES[(piece.color, piece.type)][square]
+                if not piece.has_moved and (piece.type == PieceType.KING or piece.type == PieceType.ROOK):
+                    key ^= ZOBRIST_UNMOVED[square]
+        if self.en_passant_pawn is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_pawn.position[1]]
+        return key
+
+    #Only the pawn that moved two squares in the last move keeps its en passant flag
+    def set_en_passant_pawn(self, pawn):
+        if self.en_passant_pawn is not None:
+            self.en_passant_pawn.pawn_has_moved_two_squares_last_turn = False
+            self.key ^= ZOBRIST_EN_PASSANT[self.en_passant_pawn.position[1]]
+        if pawn is not None:
+            pawn.pawn_has_moved_two_squares_last_turn = True
+            self.key ^= ZOBRIST_EN_PASSANT[pawn.position[1]]
+        self.en_passant_pawn = pawn
+
+    #All moves of a color in a fixed order: the moves of every piece from a8 to h1 (a promotion is one
+    #move per piece type) followed by the castling moves. The moves can still leave the own king in check,
+    #use is_legal_move to filter them
+    @profiler.timed('movegen.all')
+    def generate_moves(self, color: str) -> list['Move']:
+        moves = []
+        for row in range(8):
+            for col in range(8):
+                piece = self.grid[row][col]
+                if piece is None or piece.color != color:
+                    continue
+                for move in piece.get_valid_moves(self):
+                    if piece.type == PieceType.PAWN and (move.to_row == 0 or move.to_row == 7):
+                        for promotion in PROMOTION_TYPES:
+                            moves.append(Move(move.from_col, move.from_row, move.to_col, move.to_row, move.is_capture, promotion=promotion))
+                    else:
+                        moves.append(move)
+        moves.extend(self.generate_castling_moves(color))
+        return moves
+
+    #Castling moves with the same rules as castle() and play_san, except the check for attacked squares
+    #which is done in is_legal_move
+    def generate_castling_moves(self, color: str) -> list['Move']:
+        rank = 7 if color == 'white' else 0
+        king = None
+        for col in range(8):
+            piece = self.grid[rank][col]
+            if piece and piece.type == PieceType.KING and piece.color == color:
+                king = piece
+                break
+        if king is None or king.has_moved:
+            return []
+        king_col = king.position[1]
+        moves = []
+        # Kingside uses the first rook right of the king, queenside the first rook left of the king
+        for step, king_to_col, rook_to_col in ((1, 6, 5), (-1, 2, 3)):
+            rook = None
+            col = king_col + step
+            while 0 <= col < 8:
+                piece = self.grid[rank][col]
+                if piece and piece.type == PieceType.ROOK and piece.color == color:
+                    rook = piece
+                    break
+                col += step
+            if rook is None or rook.has_moved:
+                continue
+            rook_col = rook.position[1]
+            if any(self.grid[rank][col] is not None for col in range(min(king_col, rook_col) + 1, max(king_col, rook_col))):
+                continue
+            if self.grid[rank][king_to_col] is not None or self.grid[rank][rook_to_col] is not None:
+                continue
+            moves.append(Move(king_col, rank, king_to_col, rank, False, rook_from=(rank, rook_col), rook_to=(rank, rook_to_col)))
+        return moves
+
+    #The same moves as generate_moves, but produced lazily in stages so the caller can stop at the first move it
+    #needs: when in check the king moves first, then captures (most valuable victim first, each by the least
+    #valuable attacker) and promotions, then the quiet moves piece by piece and castling.
+    #Captures are found from the victims with attackers_of, so no full move list is built for them.
+    #With quiet=False only the first two stages are produced. With captures_first=False the captures are not
+    #searched first but come with the moves of each piece, which finds any move sooner.
+    #The moves can leave the own king in check
+    def iter_moves(self, color: str, quiet: bool = True, captures_first: bool = True):
+        grid = self.grid
+        opponent_color = 'black' if color == 'white' else 'white'
+        in_check = self.in_check(color)
+        king_pos = self.get_king_position(color)
+        # 1) King evasions
+        if in_check and king_pos:
+            yield from grid[king_pos[0]][king_pos[1]].get_valid_moves(self)
+            if len(self.checkers(color)) > 1:
+                #Only the king can answer a double check
+                return
+        promotion_row = 0 if color == 'white' else 7
+        if not captures_first:
+            for row in range(8):
+                for col in range(8):
+                    piece = grid[row][col]
+                    if piece is None or piece.color != color or (piece.type == PieceType.KING and in_check):
+                        continue
+                    for move in piece.get_valid_moves(self):
+                        if piece.type == PieceType.PAWN and move.to_row == promotion_row:
+                            for promotion in PROMOTION_TYPES:
+                                yield Move(move.from_col, move.from_row, move.to_col, move.to_row, move.is_capture, promotion=promotion)
+                        else:
+                            yield move
+            if not in_check:
+                yield from self.generate_castling_moves(color)
+            return
+        # 2) Captures, including promotions with a capture, en passant and promotions without a capture
+        victims = sorted((piece for row in grid for piece in row if piece and piece.color == opponent_color and piece.type != PieceType.KING),
+                         key=lambda piece: -piece.type.value)
+        for victim in victims:
+            to_row, to_col = victim.position
+            attackers = self.attackers_of(to_row, to_col, color)
+            attackers.sort(key=lambda position: grid[position[0]][position[1]].type.value)
+            for from_row, from_col in attackers:
+                attacker = grid[from_row][from_col]
+                if attacker.type == PieceType.KING and in_check:
+                    continue
+                if attacker.type == PieceType.PAWN and to_row == promotion_row:
+                    for promotion in PROMOTION_TYPES:
+                        yield Move(from_col, from_row, to_col, to_row, True, promotion=promotion)
+                else:
+                    yield Move(from_col, from_row, to_col, to_row, True)
+        direction = -1 if color == 'white' else 1
+        if self.en_passant_pawn is not None and self.en_passant_pawn.color == opponent_color:
+            pawn_row, pawn_col = self.en_passant_pawn.position
+            for from_col in (pawn_col - 1, pawn_col + 1):
+                if 0 <= from_col < 8:
+                    piece = grid[pawn_row][from_col]
+                    if piece and piece.color == color and piece.type == PieceType.PAWN:
+                        yield Move(from_col, pawn_row, pawn_col, pawn_row + direction, True, True)
+        for col in range(8):
+            piece = grid[promotion_row - direction][col]
+            if piece and piece.color == color and piece.type == PieceType.PAWN and grid[promotion_row][col] is None:
+                for promotion in PROMOTION_TYPES:
+                    yield Move(col, promotion_row - direction, col, promotion_row, False, promotion=promotion)
+        if not quiet:
+            return
+        # 3) Quiet moves, promotions were already produced
+        for row in range(8):
+            for col in range(8):
+                piece = grid[row][col]
+                if piece is None or piece.color != color or (piece.type == PieceType.KING and in_check):
+                    continue
+                for move in piece.get_valid_moves(self):
+                    if not move.is_capture and not (piece.type == PieceType.PAWN and move.to_row == promotion_row):
+                        yield move
+        if not in_check:
+            yield from self.generate_castling_moves(color)
+
+    #The legal moves of iter_moves, also lazily
+    def iter_legal_moves(self, color: str, quiet: bool = True, captures_first: bool = True):
+        for move in self.iter_moves(color, quiet, captures_first):
+            if self.is_legal_move(move, color):
+                yield move
+
+    #All legal moves of a color, from the move cache when the position was seen before
+    def legal_moves(self, color: str) -> list['Move']:
+        key = self.zobrist_hash(color)
+        moves = move_cache.get(key)
+        if moves is None:
+            moves = [move for move in self.generate_moves(color) if self.is_legal_move(move, color)]
+            move_cache.put(key, moves)
+        return moves
+
+    #Play a move from generate_moves without checking if it is legal. This is much faster than move_piece
+    #and is used where the move is known to be legal (replays) or is checked afterwards.
+    #The hash, halfmove clock, material, repetitions and check state are updated on the way.
+    #Returns what is needed to take the move back with unmake_move
+    def make_move(self, move: 'Move'):
+        piece = self.grid[move.from_row][move.from_col]
+        had_moved = piece.has_moved
+        previous_state = (self.en_passant_pawn, self.whiteCheckers, self.blackCheckers, self.key, self.halfmove_clock)
+        from_square = move.from_row * 8 + move.from_col
+        to_square = move.to_row * 8 + move.to_col
+        key = self.key ^ ZOBRIST_PIECES[(piece.color, piece.type)][from_square]
+        if move.rook_from is not None:
+            rook = self.grid[move.rook_from[0]][move.rook_from[1]]
+            rook_from_square = move.rook_from[0] * 8 + move.rook_from[1]
+            rook_zobrist = ZOBRIST_PIECES[(rook.color, PieceType.ROOK)]
+            key ^= ZOBRIST_UNMOVED[from_square] ^ ZOBRIST_UNMOVED[rook_from_square] ^ rook_zobrist[rook_from_square]
+            key ^= ZOBRIST_PIECES[(piece.color, piece.type)][to_square] ^ rook_zobrist[move.rook_to[0] * 8 + move.rook_to[1]]
+            self.grid[move.from_row][move.from_col] = None
+            self.grid[move.rook_from[0]][move.rook_from[1]] = None
+            self.grid[move.to_row][move.to_col] = piece
+            self.grid[move.rook_to[0]][move.rook_to[1]] = rook
+            piece.position = (move.to_row, move.to_col)
+            rook.position = move.rook_to
+            piece.has_moved = True
+            rook.has_moved = True
+            self.key = key
+            self.halfmove_clock += 1
+            self.set_en_passant_pawn(None)
+            self.finish_move(piece.color)
+            return (move, piece, None, None, had_moved, previous_state)
+        if not had_moved and (piece.type == PieceType.KING or piece.type == PieceType.ROOK):
+            key ^= ZOBRIST_UNMOVED[from_square]
+        captured_pos = (move.from_row, move.to_col) if move.is_enPassant else (move.to_row, move.to_col)
+        captured_piece = self.grid[captured_pos[0]][captured_pos[1]]
+        if captured_piece is not None:
+            captured_square = captured_pos[0] * 8 + captured_pos[1]
+            key ^= ZOBRIST_PIECES[(captured_piece.color, captured_piece.type)][captured_square]
+            if not captured_piece.has_moved and captured_piece.type == PieceType.ROOK:
+                key ^= ZOBRIST_UNMOVED[captured_square]
+            self.material[(captured_piece.color, captured_piece.type)] -= 1
+        if piece.type == PieceType.PAWN or captured_piece is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.grid[captured_pos[0]][captured_pos[1]] = None
+        self.grid[move.to_row][move.to_col] = piece
+        self.grid[move.from_row][move.from_col] = None
+        piece.position = (move.to_row, move.to_col)
+        moved_two_squares = piece.type == PieceType.PAWN and not had_moved and not move.is_capture and (move.to_row == 3 or move.to_row == 4)
+        piece.has_moved = True
+        if move.promotion is not None:
+            self.material[(piece.color, PieceType.PAWN)] -= 1
+            self.material[(piece.color, move.promotion)] += 1
+            piece.type = move.promotion
+        self.key = key ^ ZOBRIST_PIECES[(piece.color, piece.type)][to_square]
+        self.set_en_passant_pawn(piece if moved_two_squares else None)
+        self.finish_move(piece.color)
+        return (move, piece, captured_piece, captured_pos, had_moved, previous_state)
+
+    #Count the new position for the repetition rule and update the check state
+    def finish_move(self, color: str):
+        key = self.zobrist_hash('black' if color == 'white' else 'white')
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+        self.update_check_state()
+
+    def unmake_move(self, undo):
+        move, piece, captured_piece, captured_pos, had_moved, previous_state = undo
+        key = self.zobrist_hash('black' if piece.color == 'white' else 'white')
+        count = self.repetitions[key] - 1
+        if count:
+            self.repetitions[key] = count
+        else:
+            del self.repetitions[key]
+        if move.rook_from is not None:
+            rook = self.grid[move.rook_to[0]][move.rook_to[1]]
+            self.grid[move.to_row][move.to_col] = None
+            self.grid[move.rook_to[0]][move.rook_to[1]] = None
+            self.grid[move.from_row][move.from_col] = piece
+            self.grid[move.rook_from[0]][move.rook_from[1]] = rook
+            rook.position = move.rook_from
+            #Castling is only possible when the rook did not move before
+            rook.has_moved = False
+        else:
+            self.grid[move.to_row][move.to_col] = None
+            self.grid[move.from_row][move.from_col] = piece
+            self.grid[captured_pos[0]][captured_pos[1]] = captured_piece
+            if captured_piece is not None:
+                self.material[(captured_piece.color, captured_piece.type)] += 1
+            if move.promotion is not None:
+                self.material[(piece.color, move.promotion)] -= 1
+                self.material[(piece.color, PieceType.PAWN)] += 1
+                piece.type = PieceType.PAWN
+        piece.position = (move.from_row, move.from_col)
+        piece.has_moved = had_moved
+        previous_en_passant, self.whiteCheckers, self.blackCheckers, key, self.halfmove_clock = previous_state
+        self.set_en_passant_pawn(previous_en_passant)
+        self.key = key
+        self.whiteInCheck = bool(self.whiteCheckers)
+        self.blackInCheck = bool(self.blackCheckers)
+
+    def promote_pawn(self, piece_type: PieceType, pos: tuple[int, int]) -> bool:
+        piece = self.grid[pos[0]][pos[1]]
+        # Check that there's a pawn at the specified position
+        if not piece or piece.type != PieceType.PAWN:
+            return False
+        
+        # Check that the pawn is at the last rank
+        if (piece.color == 'white' and pos[0] != 0) or (piece.color == 'black' and pos[0] != 7):
+            return False
+        
+        # Promote the pawn, the new piece can give check. The position after the pawn move was already
+        # counted for the repetition rule, so it is replaced by the position with the new piece
+        opponent_color = 'black' if piece.color == 'white' else 'white'
+        self.repetitions[self.zobrist_hash(opponent_color)] -= 1
+        square = pos[0] * 8 + pos[1]
+        self.key ^= ZOBRIST_PIECES[(piece.color, PieceType.PAWN)][square] ^ ZOBRIST_PIECES[(piece.color, piece_type)][square]
+        self.material[(piece.color, PieceType.PAWN)] -= 1
+        self.material[(piece.color, piece_type)] += 1
+        piece.type = piece_type
+        self.finish_move(piece.color)
+        return True
+
+    def get_king_position(self, color: str) -> tuple[int, int] | None:
+        #The king found last time is still on the board in almost all cases
+        king = self.kings.get(color)
+        if king is not None:
+            row, col = king.position
+            if self.grid[row][col] is king and king.type == PieceType.KING:
+                return (row, col)
+        for row in range(8):
+            for col in range(8):
+                piece = self.grid[row][col]
+                if piece and piece.type == PieceType.KING and piece.color == color:
+                    self.kings[color] = piece
+                    return (row, col)
+        return None
+
+    #Positions of the pieces of by_color that attack the square. Only the squares from which a piece could
+    #attack are looked at, with the precomputed knight and king targets and the rays of the sliding pieces
+    def attackers_of(self, row: int, col: int, by_color: str) -> list[tuple[int, int]]:
+        grid = self.grid
+        square = row * 8 + col
+        attackers = []
+        #A white pawn attacks the squares one row above it, so it stands one row below the square
+        pawn_row = row + 1 if by_color == 'white' else row - 1
+        if 0 <= pawn_row < 8:
+            for pawn_col in (col - 1, col + 1):
+                if 0 <= pawn_col < 8:
+                    piece = grid[pawn_row][pawn_col]
+                    if piece and piece.color == by_color and piece.type == PieceType.PAWN:
+                        attackers.append((pawn_row, pawn_col))
+        for r, c in KNIGHT_TARGETS[square]:
+            piece = grid[r][c]
+            if piece and piece.color == by_color and piece.type == PieceType.KNIGHT:
+                attackers.append((r, c))
+        for r, c in KING_TARGETS[square]:
+            piece = grid[r][c]
+            if piece and piece.color == by_color and piece.type == PieceType.KING:
+                attackers.append((r, c))
+        for rays, slider in ((ROOK_RAYS[square], PieceType.ROOK), (BISHOP_RAYS[square], PieceType.BISHOP)):
+            for ray in rays:
+                for r, c in ray:
+                    piece = grid[r][c]
+                    if piece is not None:
+                        if piece.color == by_color and (piece.type == slider or piece.type == PieceType.QUEEN):
+                            attackers.append((r, c))
+                        break
+        return attackers
+
+    #Positions of the pieces that give check to the king of the given color
+    def find_checkers(self, color: str) -> list[tuple[int, int]]:
+        king = self.get_king_position(color)
+        if not king:
+            return []
+        return self.attackers_of(king[0], king[1], 'black' if color == 'white' else 'white')
+
+    #Compute the check state of both kings once after a move. Code that places pieces on the grid itself
+    #(not with the move functions) has to call this, the setup positions never have a check
+    def update_check_state(self):
+        self.whiteCheckers = self.find_checkers('white')
+        self.blackCheckers = self.find_checkers('black')
+        self.whiteInCheck = bool(self.whiteCheckers)
+        self.blackInCheck = bool(self.blackCheckers)
+
+    #The cached check state of the current position, this is what the rest of the program should use
+    def in_check(self, color: str) -> bool:
+        return self.whiteInCheck if color == 'white' else self.blackInCheck
+
+    def checkers(self, color: str) -> list[tuple[int, int]]:
+        return self.whiteCheckers if color == 'white' else self.blackCheckers
+
+    #Checks if the king is in check of the given color. This computes it for the grid as it is now,
+    #so it also works while a move is tried on the grid without the move functions
+    @profiler.timed('legality.is_check')
+    def is_check(self, color: str) -> bool:
+        return bool(self.find_checkers(color))
+                    
+    #Checks if the king is in checkmate of the given color
+    @profiler.timed('is_checkmate')
+    def is_checkmate(self, color: str) -> bool:
+        king_pos = self.get_king_position(color)
+        if not king_pos:
+            return False
+        
+        if not self.in_check(color):
+            return False
+
+        #In check without a legal move
+        return not self.has_legal_move(color)
+
+    #Checks if the side to move has no legal move without being in check
+    def is_stalemate(self, color: str) -> bool:
+        return not self.in_check(color) and not self.has_legal_move(color)
+
+    #Stops at the first legal move of iter_legal_moves, in check the king is tried first.
+    #The order of the captures does not matter here, so they are not searched first
+    @profiler.timed('has_legal_move')
+    def has_legal_move(self, color: str) -> bool:
+        cached_moves = move_cache.get(self.zobrist_hash(color))
+        if cached_moves is not None:
+            return bool(cached_moves)
+        for move in self.iter_legal_moves(color, captures_first=False):
+            return True
+        return False
+
+    #Neither side can mate: only kings and at most one knight or bishop, or only bishops that are all on
+    #squares of the same color. The material counts are kept by the moves, the grid is only read for bishops
+    def is_insufficient_material(self) -> bool:
+        material = self.material
+        for color in ('white', 'black'):
+            if material[(color, PieceType.PAWN)] or material[(color, PieceType.ROOK)] or material[(color, PieceType.QUEEN)]:
+                return False
+        knights = material[('white', PieceType.KNIGHT)] + material[('black', PieceType.KNIGHT)]
+        bishops = material[('white', PieceType.BISHOP)] + material[('black', PieceType.BISHOP)]
+        if knights + bishops <= 1:
+            return True
+        if knights:
+            return False
+        square_colors = {(row + col) % 2 for row in range(8) for col in range(8)
+                         if self.grid[row][col] is not None and self.grid[row][col].type == PieceType.BISHOP}
+        return len(square_colors) == 1
+
+    #Only a king left, used when the opponent runs out of time
+    def has_only_king(self, color: str) -> bool:
+        return all(self.material[(color, piece_type)] == 0 for piece_type in PieceType if piece_type != PieceType.KING)
+
+    #How often the position with this color to move was reached in the game
+    def repetition_count(self, color: str) -> int:
+        return self.repetitions.get(self.zobrist_hash(color), 0)
+
+    #Checks that a move from get_valid_moves or generate_moves does not leave the own king in check.
+    #For castling the king must not be in check and must not pass an attacked square, like in castle()
+    def is_legal_move(self, move, color: str) -> bool:
+        if move.rook_from is not None:
+            if self.in_check(color):
+                return False
+            step = 1 if move.to_col > move.from_col else -1
+            for col in range(move.from_col + step, move.to_col + step, step):
+                if self.is_square_under_attack(color, move.to_row, col):
+                    return False
+            return True
+        piece = self.grid[move.from_row][move.from_col]
+        captured_pos = (move.from_row, move.to_col) if move.is_enPassant else (move.to_row, move.to_col)
+        captured_piece = self.grid[captured_pos[0]][captured_pos[1]]
+        #Try the move, check and undo it
+        self.grid[captured_pos[0]][captured_pos[1]] = None
+        self.grid[move.to_row][move.to_col] = piece
+        self.grid[move.from_row][move.from_col] = None
+        old_position = piece.position
+        piece.position = (move.to_row, move.to_col)
+        legal = not self.is_check(color)
+        piece.position = old_position
+        self.grid[move.from_row][move.from_col] = piece
+        self.grid[move.to_row][move.to_col] = None
+        self.grid[captured_pos[0]][captured_pos[1]] = captured_piece
+        return legal
+
+    #Checks if a square is under attack by any piece of the opposite color. we need this to see if we can castle
+    @profiler.timed('legality.square_attacked')
+    def is_square_under_attack(self, color: str, row: int, col: int) -> bool:
+        opponent_color = 'black' if color == 'white' else 'white'
+        return bool(self.attackers_of(row, col, opponent_color))
+
+
+#This class is used to store the move when we get the valid moves
+#For a promotion the new piece type is stored, for castling the king moves and the rook squares are stored
+class Move:
+    def __init__(self, from_col, from_row, to_col, to_row, is_capture, is_enPassant=False, promotion=None, rook_from=None, rook_to=None):
+        self.from_col = from_col
+        self.from_row = from_row
+        self.to_col = to_col
+        self.to_row = to_row
+        self.is_capture = is_capture
+        self.is_enPassant = is_enPassant
+        self.promotion = promotion
+        self.rook_from = rook_from
+        self.rook_to = rook_to
+
+class Piece:
+    def __init__(self, color, position, type):
+        self.color = color
+        self.position = position
+        self.type = type
+        self.has_moved = False
+        self.pawn_has_moved_two_squares_last_turn = False
+
+    @profiler.timed('movegen')
+    def get_valid_moves(self, board) -> list[Move]:
+        valid_moves = []  # List of tuples (row, col, is_capture)
+        row, col = self.position
+        opponent_color = 'black' if self.color == 'white' else 'white'
+        if self.type == PieceType.PAWN:
+            direction = -1 if self.color == 'white' else 1
+            start_row = 6 if self.color == 'white' else 1
+
+            # One square forward without captures for that: 1. Square has to be valid 2. Square has to be empty
+            if 0 <= row + direction < 8 and board.grid[row + direction][col] is None:
+                valid_moves.append(Move(col, row, col, row + direction, False))
+                # Two squares forward from starting position
+                if row == start_row and board.grid[row + 2*direction][col] is None:
+                    valid_moves.append(Move(col, row, col, row + 2*direction, False))
+            
+            # Captures (diagonally) for that: 1. Square has to be valid 2. Square has to have an opponent piece
+            for capture_col in [col-1, col+1]:
+                if 0 <= capture_col < 8 and 0 <= row + direction < 8:
+                    target = board.grid[row + direction][capture_col]
+                    if target and target.color == opponent_color:
+                        valid_moves.append(Move(col, row, capture_col, row + direction, True))
+
+            #En passant
+            if col-1 >= 0 and board.grid[row][col-1] is not None and board.grid[row][col-1].type == PieceType.PAWN and board.grid[row][col-1].pawn_has_moved_two_squares_last_turn == True:
+                valid_moves.append(Move(col, row, col-1, row + direction, True, True))
+            if col+1 < 8 and board.grid[row][col+1] is not None and board.grid[row][col+1].type == PieceType.PAWN and board.grid[row][col+1].pawn_has_moved_two_squares_last_turn == True:
+                valid_moves.append(Move(col, row, col+1, row + direction, True, True))
+
+        elif self.type == PieceType.KNIGHT:
+             # Knights move in L-shape
+            moves = [
+                (-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                (1, -2), (1, 2), (2, -1), (2, 1)
+            ]
+            for move_row, move_col in moves:
+                new_row, new_col = row + move_row, col + move_col
+                #We check if the move is valid: 1. Square has to be on the board 2. Square has to be empty or have an opponent piece
+                if (0 <= new_row < 8 and 0 <= new_col < 8):
+                    if board.grid[new_row][new_col] is None:
+                        valid_moves.append(Move(col, row, new_col, new_row, False))
+                    elif board.grid[new_row][new_col].color != self.color:
+                        valid_moves.append(Move(col, row, new_col, new_row, True))
+        elif self.type == PieceType.BISHOP:
+            # Check all diagonal directions
+            directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+            for dir_row, dir_col in directions:
+                # Start from current position and look along entire diagonal
+                new_row, new_col = row, col
+                while True:
+                    new_row += dir_row
+                    new_col += dir_col
+                    # Stop if we go off the board
+                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
+                        break
+                    # Empty square is valid move
+                    if board.grid[new_row][new_col] is None:
+                        valid_moves.append(Move(col, row, new_col, new_row, False))
+                    # Square has a piece
+                    else:
+                        # Can capture opponent piece but then must stop
+                        if board.grid[new_row][new_col].color != self.color:
+                            valid_moves.append(Move(col, row, new_col, new_row, True))
+                        break
+        elif self.type == PieceType.ROOK:
+            # Same logic as bishop but only for the horizontal and vertical directions
+            directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+            for dir_row, dir_col in directions:
+                new_row, new_col = row, col
+                while True:
+                    new_row += dir_row
+                    new_col += dir_col
+                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
+                        break
+                    if board.grid[new_row][new_col] is None:
+                        valid_moves.append(Move(col, row, new_col, new_row, False))
+                    else:
+                        if board.grid[new_row][new_col].color != self.color:
+                            valid_moves.append(Move(col, row, new_col, new_row, True))
+                        break
+        elif self.type == PieceType.QUEEN:
+            directions = [
+                (-1, -1), (-1, 0), (-1, 1),
+                (0, -1),           (0, 1),
+                (1, -1),  (1, 0),  (1, 1)
+            ]
+            for dir_row, dir_col in directions:
+                new_row, new_col = row, col
+                while True:
+                    new_row += dir_row
+                    new_col += dir_col
+                    if new_row < 0 or new_row >= 8 or new_col < 0 or new_col >= 8:
+                        break
+                    if board.grid[new_row][new_col] is None:
+                        valid_moves.append(Move(col, row, new_col, new_row, False))
+                    else:
+                        if board.grid[new_row][new_col].color != self.color:
+                            valid_moves.append(Move(col, row, new_col, new_row, True))
+                        break
+        elif self.type == PieceType.KING:
+            #King moves one square in any direction
+            moves = [(-1, -1), (-1, 0), (-1, 1),
+                     (0, -1),           (0, 1),
+                     (1, -1),  (1, 0),  (1, 1)]
+            for move_row, move_col in moves:
+                new_row, new_col = row + move_row, col + move_col
+                #We check if the move is valid: 1. Square has to be on the board 2. Square has to be empty or have an opponent piece
+                if  0 <= new_row < 8 and 0 <= new_col < 8:
+                    if board.grid[new_row][new_col] is None:
+                        valid_moves.append(Move(col, row, new_col, new_row, False))
+                    elif board.grid[new_row][new_col].color != self.color:
+                        valid_moves.append(Move(col, row, new_col, new_row, True))
+        profiler.count('moves_generated', len(valid_moves))
+        return valid_moves
+
+
+#Parse a move entered by the user in standard chess notation and play it with the board functions.
+#Returns if the move was played and the error message if it is invalid
+@profiler.timed('san_parse')
+def play_san(board, text_move, current_turn):
+    #The check and mate symbols are compared with the check state of the position after the move.
+    #A wrong symbol does not make the move invalid, many PGN files are not exact about it
+    gives_check = text_move.endswith(('+', '#'))
+    gives_mate = text_move.endswith('#')
+    success, error_message = play_san_move(board, text_move.rstrip('+#'), current_turn)
+    if success:
+        opponent_color = 'black' if current_turn == 'white' else 'white'
+        if gives_check != board.in_check(opponent_color) or gives_mate and not board.is_checkmate(opponent_color):
+            logger.warning("%s: the check symbol does not match the position", text_move)
+    return success, error_message
+
+
+#Play a move in standard notation without the check and mate symbols
+def play_san_move(board, text_move, current_turn):
+    error_message = None
+    #Convert row and column to 0-7 range
+    file_map = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
+    success = False  # We'll set this True if we successfully do a move.
+    try:
+        # 1) Handle castling
+        if text_move == "O-O":  # Kingside castling
+            rank = 7 if current_turn == 'white' else 0
+            color = current_turn
+            king_to = (rank, 6)  # g1/g8
+            rook_to = (rank, 5)  # f1/f8
+
+            # Find the king
+            king_pos = None
+            for col in range(8):
+                piece = board.grid[rank][col]
+                if piece and piece.type == PieceType.KING and piece.color == color:
+                    king_pos = (rank, col)
+                    break
+
+            # Find the rook to the right of the king
+            rook_pos = None
+            if king_pos:
+                for col in range(king_pos[1] + 1, 8):
+                    piece = board.grid[rank][col]
+                    if piece and piece.type == PieceType.ROOK and piece.color == color:
+                        rook_pos = (rank, col)
+                        break
+
+            # Attempt castling if we found king and rook
+            if king_pos and rook_pos:
+                success = board.castle(
+                    king_from=king_pos,
+                    king_to=king_to,
+                    rook_from=rook_pos,
+                    rook_to=rook_to,
+                    current_turn=current_turn
+                )
+
+            if not success:
+                error_message = "Invalid castling move"
+                return False, error_message
+            return success, error_message
+
+        elif text_move == "O-O-O":  # Queenside castling
+            rank = 7 if current_turn == 'white' else 0
+            color = current_turn
+            king_to = (rank, 2)  # c1/c8
+            rook_to = (rank, 3)  # d1/d8
+
+            # Find the king
+            king_pos = None
+            for col in range(8):
+                piece = board.grid[rank][col]
+                if piece and piece.type == PieceType.KING and piece.color == color:
+                    king_pos = (rank, col)
+                    break
+
+            # Find the rook to the left of the king
+            rook_pos = None
+            if king_pos:
+                for col in range(king_pos[1] - 1, -1, -1):
+                    piece = board.grid[rank][col]
+                    if piece and piece.type == PieceType.ROOK and piece.color == color:
+                        rook_pos = (rank, col)
+                        break
+
+            # Attempt castling if we found king and rook
+            if king_pos and rook_pos:
+                success = board.castle(
+                    king_from=king_pos,
+                    king_to=king_to,
+                    rook_from=rook_pos,
+                    rook_to=rook_to,
+                    current_turn=current_turn
+                )
+
+            if not success:
+                error_message = "Invalid castling move"
+                return False, error_message
+            return True, error_message
+
+        # 2) If it's not a castling move, handle normal moves here.
+        else:
+            # parse something like "e2e4", call your regular move function, etc.
+            # If that move succeeds, set success = True
+            pass
+
+        # 3) If we reach here, we either castled successfully or did a normal move.
+        #    You can do additional steps, like toggling current_turn from white <-> black.
+        if success:
+            current_turn = 'black' if current_turn == 'white' else 'white'
+        else:
+            # Possibly handle normal moves or print some error message for invalid normal move
+            pass
+
+
+        #We save if there is a check or checkmate and at the end we check if there is a check or checkmate on our side
+        is_check = '+' in text_move
+        is_checkmate = '#' in text_move
+        # Remove check/checkmate symbols
+        text_move = text_move.replace('+', '').replace('#', '')
+
+        # Handle pawn promotion
+        #We do the move and then we check for promotion
+        promotion_type = None
+        if '=' in text_move:
+            move_part, promotion_part = text_move.split('=')
+            #We remove the = and the promotion part
+            text_move = move_part
+            piece_map = {
+                'Q': PieceType.QUEEN,
+                'R': PieceType.ROOK,
+                'B': PieceType.BISHOP,
+                'N': PieceType.KNIGHT
+            }
+            promotion_type = piece_map[promotion_part]
+        
+        # Handle captures
+        is_capture = 'x' in text_move
+        #We remove the x
+        text_move = text_move.replace('x', '')
+
+        # Handle basic pawn moves and captures these are just the first two letters of the move
+        if len(text_move) == 2 and text_move[0].lower() in file_map:  # e.g., "e4"
+            # We get the file from the map. The rank is the secind char but bc. we start at the top left we need to subtract it from 8
+            file = file_map[text_move[0].lower()]
+            rank = 8 - int(text_move[1])
+            from_rank = None
+            #We move the pawn and then we check if there is a promotion
+            success = board.move_piece(PieceType.PAWN, (from_rank, file), (rank, file), current_turn)
+            if not success:
+                error_message = "Invalid pawn move"
+            if success and promotion_type:
+                success = board.promote_pawn(promotion_type, (rank, file))
+                if not success:
+                    error_message = "Invalid pawn promotion"
+            return success, error_message
+
+        # Handle pawn captures (e.g., "exd5") the x is already removed. When the first char is in the file_map we know it is a pawn capture
+        elif len(text_move) == 3 and text_move[0] in file_map and is_capture:
+            src_file = None
+            src_rank = None
+            if text_move[0].isalpha():
+                src_file = file_map[text_move[0]]
+                src_rank = None
+            else:
+                src_file = None
+                src_rank = 8 - int(text_move[0])
+            dest_file = file_map[text_move[1]]
+            dest_rank = 8 - int(text_move[2])
+            success = board.move_piece_capture(PieceType.PAWN, (src_rank, src_file), (dest_rank, dest_file), current_turn)
+            if success and promotion_type:
+                success = board.promote_pawn(promotion_type, (dest_rank, dest_file))
+                if not success:
+                    error_message = "Invalid pawn promotion"
+            if not success:
+                error_message = "Invalid pawn capture"
+            return success, error_message
+
+        # Handle piece moves other than pawn with possible disambiguation
+        else:
+            piece_map = {
+                'K': PieceType.KING,
+                'Q': PieceType.QUEEN,
+                'R': PieceType.ROOK,
+                'B': PieceType.BISHOP,
+                'N': PieceType.KNIGHT
+            }
+            
+            #Check if the first char is a piece. when not this is invalid
+            if text_move[0] in piece_map:
+                piece_type = piece_map[text_move[0]]
+                dest_file = file_map[text_move[-2]]
+                dest_rank = 8 - int(text_move[-1])
+                
+                # Handle disambiguation (e.g., "Nbd7" or "R1e2")
+                src_file = None
+                src_rank = None
+                #If there is a second char we know it is a disambiguation
+                if len(text_move) == 4:
+                    if text_move[1].isalpha():
+                        src_file = file_map[text_move[1].lower()]
+                    else:
+                        src_rank = 8 - int(text_move[1])
+                #src_rank and src_file will be None if there is no disambiguation. the logic will be handled in the move_piece function
+                if is_capture:
+                    success = board.move_piece_capture(piece_type, (src_rank, src_file), (dest_rank, dest_file), current_turn)
+                    if not success:
+                        error_message = f"Invalid {piece_type.name.lower()} capture"
+                else:
+                    success = board.move_piece(piece_type, (src_rank, src_file), (dest_rank, dest_file), current_turn)
+                    if not success:
+                        error_message = f"Invalid {piece_type.name.lower()} move"
+                return success, error_message
+            else:
+                error_message = "Invalid piece notation"
+                return False, error_message
+
+        #If the move is not handled by the above, it is invalid
+        error_message = "Invalid move format"
+        return False, error_message
+    
+    except (KeyError, ValueError, IndexError):
+        error_message = "Invalid move syntax"
+        return False, error_message
+
+
+#Choose the next white move in the rook+king vs king endgame with the "Box Method".
+#Returns (piece_type, from_pos, to_pos) or None when no move was found, the caller plays the move.
+def choose_two_rooks_move(board):
+
+    # Helper: Manhattan distance between two positions.
+    def manhattan_distance(p1, p2):
+        return abs(p1[0] - p2[0]) + abs(p1[1] - p2[1])
+
+    # Helper: From a piece's valid moves, choose the move whose destination is
+    # closest (Manhattan distance) to the intended target.
+    def select_move(piece, intended_target, board):
+        valid_moves = piece.get_valid_moves(board)
+        if not valid_moves:
+            return None
+        best_move = None
+        best_distance = math.inf
+        for move in valid_moves:
+            # Destination of move as (row, col)
+            dest = (move.to_row, move.to_col)
+            d = manhattan_distance(dest, intended_target)
+            if d < best_distance:
+                best_distance = d
+                best_move = move
+        return best_move
+    
+    white_king = None
+    white_rook = None
+    black_king = None
+    for row in range(8):
+        for col in range(8):
+            piece = board.grid[row][col]
+            if piece and piece.type == PieceType.KING:
+                if piece.color == 'white':
+                    white_king = piece
+                else:
+                    black_king = piece
+            if piece and piece.type == PieceType.ROOK:
+                white_rook = piece
+
+    if not white_king or not white_rook or not black_king:
+        logger.error("Error piece not found")
+        return
+    
+    # Get current positions (row, col) for each piece.
+    # Rows are 0-based with row 0 corresponding to rank 8 and row 7 to rank 1.
+    wk_r, wk_c = white_king.position
+    wr_r, wr_c = white_rook.position
+    bk_r, bk_c = black_king.position
+
+    # Compute how far the black king is from an edge in each direction.
+    dist_row = min(bk_r, 7 - bk_r)
+    dist_col = min(bk_c, 7 - bk_c)
+
+     # Decide which axis to restrict: if black king is further from an edge vertically, use a horizontal cutoff.
+    if dist_row >= dist_col:
+        # We'll restrict vertically by moving the rook to an edge row.
+        # Choose target row: if black king is in the upper half, aim for the top (row 0, rank 8);
+        # otherwise, aim for the bottom (row 7, rank 1).
+        target_r = 0 if bk_r <= 3 else 7
+        # Intended rook target is to move it to (target_r, current rook column)
+        intended_rook_target = (target_r, wr_c)
+        
+          
+        # If the rook is not already on that row, move it there.
+        if wr_r != target_r:
+            # Rook moves: Keep its current column.
+            chosen_move = select_move(white_rook, intended_rook_target, board)
+            if chosen_move is not None:
+                return (white_rook.type, white_rook.position, (chosen_move.to_row, chosen_move.to_col))
+         # Otherwise, if the rook is in place, move the king one square closer.
+        intended_king_target = (wk_r + (1 if bk_r > wk_r else -1 if bk_r < wk_r else 0),
+                                wk_c + (1 if bk_c > wk_c else -1 if bk_c < wk_c else 0))
+        chosen_move = select_move(white_king, intended_king_target, board)
+        if chosen_move is not None:
+            return (white_king.type, white_king.position, (chosen_move.to_row, chosen_move.to_col))
+
+    else:
+        # We'll restrict horizontally by moving the rook to an edge column.
+        # Choose target column: if black king is in the left half, aim for column 0 ('a'); otherwise, column 7 ('h').
+        target_c = 0 if bk_c <= 3 else 7
+        intended_rook_target = (wr_r, target_c)
+        if wr_c != target_c:
+            # Move the rook vertically: Keep its current row.
+            chosen_move = select_move(white_rook, intended_rook_target, board)
+            if chosen_move is not None:
+                return (white_rook.type, white_rook.position, (chosen_move.to_row, chosen_move.to_col))
+        # Otherwise, move the white king one square closer.
+        intended_king_target = (wk_r + (1 if bk_r > wk_r else -1 if bk_r < wk_r else 0),
+                                wk_c + (1 if bk_c > wk_c else -1 if bk_c < wk_c else 0))
+        chosen_move = select_move(white_king, intended_king_target, board)
+        if chosen_move is not None:
+            return (white_king.type, white_king.position, (chosen_move.to_row, chosen_move.to_col))
+        
+    # If no legal move was found, return None.
+    return None
+
+
+#A game is drawn after 50 moves of both players without a capture or pawn move and when the same position
+#with the same player to move is reached three times. Both are applied without a claim
+FIFTY_MOVE_PLIES = 100
+REPETITION_LIMIT = 3
+
+
+#Returns (result, reason) when the game is over, otherwise (None, None). The result is 'white_win', 'black_win'
+#or 'draw', the reason 'timeout', 'checkmate', 'stalemate', 'insufficient_material', 'fifty_moves' or 'repetition'.
+#current_turn is the color to move; without it only checkmate and the rules that don't depend on it are checked.
+#All rules read the counters kept by the moves, only the legal move test looks at the moves and it stops at the first.
+#Draw offers and resignations are handled by the caller
+def get_termination(board, current_turn=None, clock=None):
+    if clock is not None:
+        #A player who runs out of time only loses when the opponent has something to mate with
+        if clock.white_time <= 0:
+            return ('draw' if board.has_only_king('black') else 'black_win'), 'timeout'
+        if clock.black_time <= 0:
+            return ('draw' if board.has_only_king('white') else 'white_win'), 'timeout'
+    if current_turn is None:
+        if board.is_checkmate('white'):
+            return 'black_win', 'checkmate'
+        if board.is_checkmate('black'):
+            return 'white_win', 'checkmate'
+    elif not board.has_legal_move(current_turn):
+        if board.in_check(current_turn):
+            return ('black_win' if current_turn == 'white' else 'white_win'), 'checkmate'
+        return 'draw', 'stalemate'
+    if board.is_insufficient_material():
+        return 'draw', 'insufficient_material'
+    if board.halfmove_clock >= FIFTY_MOVE_PLIES:
+        return 'draw', 'fifty_moves'
+    if current_turn is not None and board.repetition_count(current_turn) >= REPETITION_LIMIT:
+        return 'draw', 'repetition'
+    return None, None
+
+
+#Returns the result ('white_win', 'black_win' or 'draw') or None when the game goes on, see get_termination
+def get_game_result(board, clock=None, current_turn=None):
+    return get_termination(board, current_turn, clock)[0]
+
+
+PIECE_LETTERS = {
+    PieceType.KING: 'K',
+    PieceType.QUEEN: 'Q',
+    PieceType.ROOK: 'R',
+    PieceType.BISHOP: 'B',
+    PieceType.KNIGHT: 'N'
+}
+
+
+#Write a move in coordinate notation like "e2e4" or "e7e8q", castling is written as the move of the king.
+#In Chess960 notation castling is written as the king capturing its own rook, e.g. "e1h1"
+def move_to_uci(move, chess960=False):
+    files = 'abcdefgh'
+    to_row, to_col = move.rook_from if chess960 and move.rook_from is not None else (move.to_row, move.to_col)
+    text = files[move.from_col] + str(8 - move.from_row) + files[to_col] + str(8 - to_row)
+    if move.promotion is not None:
+        text += PIECE_LETTERS[move.promotion].lower()
+    return text
+
+
+#The legal move of a color in coordinate notation, None when there is no such move. Without chess960 castling
+#can be written as the move of the king or as the king capturing the rook
+def parse_uci_move(board, text, color, chess960=False):
+    for move in board.legal_moves(color):
+        if move_to_uci(move, chess960) == text:
+            return move
+        if not chess960 and move.rook_from is not None and move_to_uci(move, True) == text:
+            return move
+    return None
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {letter.lower(): piece_type for piece_type, letter in PIECE_LETTERS.items()}
+FEN_PIECES['p'] = PieceType.PAWN
+
+
+#The rook a king castles with on one side (step 1 or -1): the first rook next to the king, like generate_castling_moves
+def _castling_rook(board, king, step):
+    row, col = king.position
+    col += step
+    while 0 <= col < 8:
+        piece = board.grid[row][col]
+        if piece is not None and piece.type == PieceType.ROOK and piece.color == king.color:
+            return piece
+        col += step
+    return None
+
+
+#Read a position in Forsyth-Edwards Notation, returns (board, color to move, move number). Castling rights are
+#K and Q or, for Chess960, the file of the rook like in Shredder-FEN. Raises ValueError for an invalid FEN
+def board_from_fen(fen):
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError(f"A FEN needs at least 4 fields: {fen}")
+    placement, side, castling, en_passant = fields[:4]
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        move_number = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Invalid move counters: {fen}") from None
+    rows = placement.split('/')
+    if len(rows) != 8:
+        raise ValueError(f"A FEN needs 8 rows: {fen}")
+    if side not in ('w', 'b'):
+        raise ValueError(f"Invalid color to move: {side}")
+    board = Board()
+    kings = {}
+    for row, text in enumerate(rows):
+        col = 0
+        for char in text:
+            if char.isdigit():
+                col += int(char)
+                continue
+            piece_type = FEN_PIECES.get(char.lower())
+            if piece_type is None or col >= 8:
+                raise ValueError(f"Invalid row {text}")
+            piece = Piece('white' if char.isupper() else 'black', (row, col), piece_type)
+            #Kings and rooks keep their castling rights below, pawns can move two squares from their start row
+            piece.has_moved = not (piece_type == PieceType.PAWN and row == (6 if piece.color == 'white' else 1))
+            if piece_type == PieceType.KING:
+                kings[piece.color] = piece
+            board.grid[row][col] = piece
+            col += 1
+        if col != 8:
+            raise ValueError(f"Invalid row {text}")
+    if set(kings) != {'white', 'black'}:
+        raise ValueError(f"Both players need a king: {fen}")
+    color = 'white' if side == 'w' else 'black'
+    for char in castling if castling != '-' else '':
+        king = kings['white' if char.isupper() else 'black']
+        if king.position[0] != (7 if king.color == 'white' else 0):
+            raise ValueError(f"Castling right {char} without a king on the first rank")
+        if char in 'KkQq':
+            rook = _castling_rook(board, king, 1 if char in 'Kk' else -1)
+        elif char.lower() in 'abcdefgh':
+            rook = board.grid[king.position[0]]['abcdefgh'.index(char.lower())]
+        else:
+            raise ValueError(f"Invalid castling right {char}")
+        if rook is None or rook.type != PieceType.ROOK or rook.color != king.color:
+            raise ValueError(f"No rook for castling right {char}")
+        king.has_moved = False
+        rook.has_moved = False
+    if en_passant != '-':
+        if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' or en_passant[1] not in '36':
+            raise ValueError(f"Invalid en passant square {en_passant}")
+        #The pawn stands in front of the square it passed
+        row = 4 if en_passant[1] == '3' else 3
+        pawn = board.grid[row]['abcdefgh'.index(en_passant[0])]
+        if pawn is None or pawn.type != PieceType.PAWN or pawn.color == color:
+            raise ValueError(f"No pawn for en passant square {en_passant}")
+        board.en_passant_pawn = pawn
+        pawn.pawn_has_moved_two_squares_last_turn = True
+    board.reset_state(color)
+    board.halfmove_clock = halfmove_clock
+    return board, color, move_number
+
+
+def board_to_fen(board, color, move_number=1):
+    rows = []
+    for row in range(8):
+        text = ''
+        empty = 0
+        for col in range(8):
+            piece = board.grid[row][col]
+            if piece is None:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            letter = 'P' if piece.type == PieceType.PAWN else PIECE_LETTERS[piece.type]
+            text += letter if piece.color == 'white' else letter.lower()
+        rows.append(text + (str(empty) if empty else ''))
+    castling = ''
+    for piece_color in ('white', 'black'):
+        king_position = board.get_king_position(piece_color)
+        if king_position is None:
+            continue
+        king = board.grid[king_position[0]][king_position[1]]
+        if king.has_moved or king_position[0] != (7 if piece_color == 'white' else 0):
+            continue
+        for step, letter in ((1, 'K'), (-1, 'Q')):
+            rook = _castling_rook(board, king, step)
+            if rook is None or rook.has_moved:
+                continue
+            #Another rook further out would be the castling rook of K/Q for other programs, so the file is written
+            if _castling_rook(board, rook, step) is not None:
+                letter = 'abcdefgh'[rook.position[1]].upper()
+            castling += letter if piece_color == 'white' else letter.lower()
+    en_passant = '-'
+    if board.en_passant_pawn is not None:
+        row, col = board.en_passant_pawn.position
+        en_passant = 'abcdefgh'[col] + ('3' if row == 4 else '6')
+    return f"{'/'.join(rows)} {'w' if color == 'white' else 'b'} {castling or '-'} {en_passant} {board.halfmove_clock} {move_number}"
+
+
+#Write a move from get_valid_moves in standard chess notation. This has to be called before the move is played.
+#The disambiguation follows play_san, so the result can always be parsed again
+def move_to_san(board, move, color, promotion=None):
+    files = 'abcdefgh'
+    piece = board.grid[move.from_row][move.from_col]
+    destination = files[move.to_col] + str(8 - move.to_row)
+    if move.rook_from is not None:
+        san = 'O-O' if move.to_col == 6 else 'O-O-O'
+    elif piece.type == PieceType.PAWN:
+        san = files[move.from_col] + 'x' + destination if move.is_capture else destination
+        if promotion is not None:
+            san += '=' + PIECE_LETTERS[promotion]
+    else:
+        #Other pieces of the same type that can reach the same square need a disambiguation
+        others = []
+        for row in range(8):
+            for col in range(8):
+                other = board.grid[row][col]
+                if other is None or other is piece or other.type != piece.type or other.color != color:
+                    continue
+                for other_move in other.get_valid_moves(board):
+                    if other_move.to_row == move.to_row and other_move.to_col == move.to_col and other_move.is_capture == move.is_capture:
+                        others.append(other)
+                        break
+        disambiguation = ''
+        if others:
+            if all(other.position[1] != move.from_col for other in others):
+                disambiguation = files[move.from_col]
+            elif all(other.position[0] != move.from_row for other in others):
+                disambiguation = str(8 - move.from_row)
+            else:
+                disambiguation = files[move.from_col] + str(8 - move.from_row)
+        san = PIECE_LETTERS[piece.type] + disambiguation + ('x' if move.is_capture else '') + destination
+
+    #Play the move to see if it gives check or mate and undo it again, make_move updates the check state
+    opponent_color = 'black' if color == 'white' else 'white'
+    if promotion is not None and move.promotion != promotion:
+        move = Move(move.from_col, move.from_row, move.to_col, move.to_row, move.is_capture, move.is_enPassant, promotion)
+    undo = board.make_move(move)
+    if board.is_checkmate(opponent_color):
+        san += '#'
+    elif board.in_check(opponent_color):
+        san += '+'
+    board.unmake_move(undo)
+    return san
+
+
+#A game without any window: the board, whose turn it is, the clock, the played moves and the result.
+#It is used where there is no pygame, e.g. the game server
+class GameState:
+    def __init__(self, game_mode='normal', clock=None):
+        self.board = Board()
+        self.board.game_mode = game_mode
+        self.game_mode = game_mode
+        if game_mode == 'fischer':
+            self.board.setup_fischer_random()
+        elif game_mode == 'two_rooks':
+            self.board.setup_two_rooks()
+        else:
+            self.board.setup_pieces()
+        self.current_turn = 'white'
+        self.clock = clock
+        self.last_clock_update = None
+        self.moves = []
+        self.game_result = None
+        #Why the game ended, see get_termination ('resignation' and 'agreement' are set here)
+        self.termination = None
+        self.error_message = None
+        self.whiteWantsDraw = False
+        self.blackWantsDraw = False
+
+    def start(self):
+        if self.clock is not None:
+            self.clock.start_clock()
+            self.last_clock_update = time.monotonic()
+
+    def is_done(self):
+        return self.game_result is not None
+
+    #Let the clock run until now and check if a player lost on time
+    def update_clock(self):
+        if self.clock is None or not self.clock.is_running or self.game_result is not None:
+            return
+        now = time.monotonic()
+        self.clock.update_clock((now - self.last_clock_update) * 1000)
+        self.last_clock_update = now
+        if self.clock.white_time <= 0 or self.clock.black_time <= 0:
+            self.check_game_result()
+
+    #Play a move in standard chess notation for the player whose turn it is
+    def play_move(self, text_move):
+        if self.game_result is not None:
+            self.error_message = "Game is over"
+            return False
+        self.update_clock()
+        if self.game_result is not None:
+            self.error_message = "Time is over"
+            return False
+        success, self.error_message = play_san(self.board, text_move, self.current_turn)
+        if success:
+            self.finish_move(text_move)
+        return success
+
+    #Play a move chosen by the computer, e.g. from choose_two_rooks_move. Returns the move in standard notation or None
+    def play_computer_move(self, piece_type, from_pos, to_pos):
+        if self.game_result is not None:
+            return None
+        self.update_clock()
+        piece = self.board.grid[from_pos[0]][from_pos[1]]
+        if piece is None or piece.type != piece_type or piece.color != self.current_turn:
+            return None
+        move = None
+        for valid_move in piece.get_valid_moves(self.board):
+            if valid_move.to_row == to_pos[0] and valid_move.to_col == to_pos[1]:
+                move = valid_move
+                break
+        if move is None:
+            return None
+        san = move_to_san(self.board, move, self.current_turn)
+        if move.is_capture:
+            success = self.board.move_piece_capture(piece_type, from_pos, to_pos, self.current_turn)
+        else:
+            success = self.board.move_piece(piece_type, from_pos, to_pos, self.current_turn)
+        if not success:
+            return None
+        self.finish_move(san)
+        return san
+
+    def finish_move(self, san):
+        self.moves.append(san)
+        self.current_turn = 'black' if self.current_turn == 'white' else 'white'
+        if self.clock is not None:
+            self.clock.switch_player()
+        self.check_game_result()
+
+    def check_game_result(self):
+        if self.game_result is None:
+            self.game_result, self.termination = get_termination(self.board, self.current_turn, self.clock)
+        return self.game_result
+
+    #A player offers a draw or accepts the offer of the opponent. Returns True when the game ended in a draw
+    def offer_draw(self, color):
+        if self.game_result is not None:
+            return False
+        if (color == 'white' and self.blackWantsDraw) or (color == 'black' and self.whiteWantsDraw):
+            self.game_result = 'draw'
+            self.termination = 'agreement'
+            return True
+        if color == 'white':
+            self.whiteWantsDraw = True
+        else:
+            self.blackWantsDraw = True
+        return False
+
+    def resign(self, color):
+        if self.game_result is None:
+            self.game_result = 'black_win' if color == 'white' else 'white_win'
+            self.termination = 'resignation'
@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from engine import Searcher, SearchLimits, choose_endgame_move, clock_limits
+from rules import Clock, GameState
+
+logger = logging.getLogger(__name__)
+
+#Line based protocol, every command and reply is one line of words separated by spaces:
+#  NEW <normal|fischer|two_rooks> <human|computer> [<minutes>+<increment>]  -> GAME <id> <color>
+#  JOIN <id>                                                                 -> GAME <id> <color>
+#  MOVE <san>                                                                -> OK <san> | ERR <message>
+#  CLOCK                                                                     -> CLOCK <white ms> <black ms>
+#  BOARD                                                                     -> BOARD <squares>
+#  DRAW                                                                      -> OK draw offered
+#  RESIGN                                                                    -> OK resigned
+#  QUIT
+#The server pushes these lines to the players of a game:
+#  MOVED <color> <san> <white ms> <black ms>
+#  DRAWOFFER <color>
+#  RESULT <white_win|black_win|draw> <checkmate|stalemate|timeout|resignation|agreement|repetition|...>
+#In a game against the computer the human plays black in the rook+king vs king mode and white otherwise.
+#The computer searches with the time manager on the clock of the game, or NORMAL_MOVETIME per move without a clock.
+
+#Milliseconds per computer move in a game without a clock
+NORMAL_MOVETIME = 1000
+
+
+#Engines run in the worker processes. They get a pickled copy of the GameState and return
+#(piece_type, from_pos, to_pos) or None, the server plays the move on its own state.
+def two_rooks_engine(game_state):
+    chosen_move = choose_endgame_move(game_state.board, game_state.current_turn, game_state.clock,
+                                      len(game_state.moves) // 2 + 1)
+    #The box method can choose a move that is not legal (e.g. next to the other king).
+    #The state is our own copy, so we just try it and otherwise take the first legal move
+    if chosen_move is not None and game_state.play_computer_move(*chosen_move) is not None:
+        return chosen_move
+    return first_legal_move(game_state)
+
+
+#Alpha-beta search for the normal and Fischer random modes. The search plays on its own board, the move is then
+#checked on our copy of the state like the moves of the box method
+def search_engine(game_state):
+    board = game_state.board
+    color = game_state.current_turn
+    if game_state.clock is not None:
+        limits = clock_limits(game_state.clock, len(game_state.moves) // 2 + 1)
+    else:
+        limits = SearchLimits(movetime=NORMAL_MOVETIME)
+    result = Searcher().search(board.copy(), color, limits)
+    move = result.best_move
+    if move is not None:
+        chosen_move = (board.grid[move.from_row][move.from_col].type, (move.from_row, move.from_col),
+                       (move.to_row, move.to_col))
+        if game_state.play_computer_move(*chosen_move) is not None:
+            return chosen_move
+    return first_legal_move(game_state)
+
+
+def first_legal_move(game_state):
+    board = game_state.board
+    for row in range(8):
+        for col in range(8):
+            piece = board.grid[row][col]
+            if piece is None or piece.color != game_state.current_turn:
+                continue
+            for move in piece.get_valid_moves(board):
+                if board.is_legal_move(move, game_state.current_turn):
+                    return (piece.type, (row, col), (move.to_row, move.to_col))
+    return None
+
+
+#The engine that plays the computer side in each game mode
+ENGINES = {
+    'normal': search_engine,
+    'fischer': search_engine,
+    'two_rooks': two_rooks_engine
+}
+
+
+def parse_clock(text):
+    minutes, _, increment = text.partition('+')
+    return Clock(float(minutes), int(increment or 0))
+
+
+def clock_millis(game_state):
+    if game_state.clock is None:
+        return "-", "-"
+    return str(max(0, int(game_state.clock.white_time * 1000))), str(max(0, int(game_state.clock.black_time * 1000)))
+
+
+#One client. Replies and pushes go through a bounded queue that is written by its own task.
+#Replies to the own commands wait for space in the queue, so a client that does not read stops being served.
+#Pushes from other players can't wait, so a client whose queue is full is disconnected.
+class Connection:
+    def __init__(self, reader, writer, max_queue):
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(max_queue)
+        self.session = None
+        self.color = None
+        self.closed = False
+        self.handler_task = None
+        self.writer_task = asyncio.create_task(self.write_loop())
+
+    async def write_loop(self):
+        try:
+            while True:
+                line = await self.queue.get()
+                if line is None:
+                    break
+                self.writer.write(line.encode() + b"\n")
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    async def reply(self, line):
+        if not self.closed:
+            await self.queue.put(line)
+
+    def push(self, line):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            logger.warning("Client is too slow, closing the connection")
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        #Drop everything that is still waiting and let the writer task end
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class GameSession:
+    def __init__(self, game_id, game_state, computer_color=None):
+        self.game_id = game_id
+        self.state = game_state
+        self.players = {'white': None, 'black': None}
+        self.computer_color = computer_color
+        self.engine_busy = False
+        self.result_sent = False
+
+    def push(self, line):
+        for connection in self.players.values():
+            if connection is not None:
+                connection.push(line)
+
+
+#Hosts many headless games in one process. Computer moves are computed in a process pool,
+#so a slow engine never blocks the event loop.
+class GameServer:
+    def __init__(self, engine_workers=None, max_queue=64, clock_interval=0.25):
+        self.games = {}
+        self.game_ids = itertools.count(1)
+        self.max_queue = max_queue
+        self.clock_interval = clock_interval
+        self.engine_workers = engine_workers
+        self.pool = None
+        self.server = None
+        self.clock_task = None
+        #Running engine moves, asyncio only keeps weak references to tasks
+        self.engine_tasks = set()
+        self.connections = set()
+        self.moves_played = 0
+
+    async def start(self, host='127.0.0.1', port=5555):
+        self.pool = ProcessPoolExecutor(self.engine_workers)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self.clock_task = asyncio.create_task(self.watch_clocks())
+        return self.server
+
+    async def stop(self):
+        if self.clock_task is not None:
+            self.clock_task.cancel()
+        for task in list(self.engine_tasks):
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+            #Closing the transports ends the connection handlers, we wait for them before the loop goes away
+            handlers = [connection.handler_task for connection in self.connections]
+            for connection in list(self.connections):
+                connection.writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        connection = Connection(reader, writer, self.max_queue)
+        connection.handler_task = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            while not connection.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors='replace').split()
+                if not words:
+                    continue
+                if words[0].upper() == 'QUIT':
+                    break
+                await self.handle_command(connection, words[0].upper(), words[1:])
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            self.leave(connection)
+            connection.close()
+
+    async def handle_command(self, connection, command, args):
+        handler = getattr(self, 'command_' + command.lower(), None)
+        if handler is None:
+            await connection.reply(f"ERR Unknown command {command}")
+            return
+        try:
+            await handler(connection, args)
+        except (IndexError, ValueError):
+            await connection.reply(f"ERR Invalid arguments for {command}")
+
+    async def command_new(self, connection, args):
+        mode, opponent = args[0], args[1]
+        if mode not in ('normal', 'fischer', 'two_rooks') or opponent not in ('human', 'computer'):
+            raise ValueError(mode)
+        if opponent == 'computer' and mode not in ENGINES:
+            await connection.reply(f"ERR No engine for {mode}")
+            return
+        clock = parse_clock(args[2]) if len(args) > 2 else None
+        self.leave(connection)
+        computer_color = None
+        color = 'white'
+        if opponent == 'computer':
+            color = 'black' if mode == 'two_rooks' else 'white'
+            computer_color = 'white' if color == 'black' else 'black'
+        session = GameSession(next(self.game_ids), GameState(mode, clock), computer_color)
+        self.games[session.game_id] = session
+        self.join(session, connection, color)
+        await connection.reply(f"GAME {session.game_id} {color}")
+        if computer_color is not None:
+            session.state.start()
+            self.schedule_engine(session)
+
+    async def command_join(self, connection, args):
+        session = self.games.get(int(args[0]))
+        if session is None or session.computer_color is not None or session.players['black'] is not None:
+            await connection.reply("ERR Game can't be joined")
+            return
+        self.leave(connection)
+        self.join(session, connection, 'black')
+        session.state.start()
+        await connection.reply(f"GAME {session.game_id} black")
+
+    async def command_move(self, connection, args):
+        session = connection.session
+        if session is None:
+            await connection.reply("ERR Not in a game")
+            return
+        state = session.state
+        if state.current_turn != connection.color:
+            await connection.reply("ERR Not your turn")
+            return
+        color = state.current_turn
+        if not state.play_move(args[0]):
+            await connection.reply(f"ERR {state.error_message}")
+            self.push_result(session)
+            return
+        self.moves_played += 1
+        await connection.reply(f"OK {args[0]}")
+        white_ms, black_ms = clock_millis(state)
+        session.push(f"MOVED {color} {args[0]} {white_ms} {black_ms}")
+        self.push_result(session)
+        if not state.is_done() and state.current_turn == session.computer_color:
+            self.schedule_engine(session)
+
+    async def command_clock(self, connection, args):
+        if connection.session is None:
+            await connection.reply("ERR Not in a game")
+            return
+        connection.session.state.update_clock()
+        white_ms, black_ms = clock_millis(connection.session.state)
+        await connection.reply(f"CLOCK {white_ms} {black_ms}")
+        self.push_result(connection.session)
+
+    async def command_board(self, connection, args):
+        if connection.session is None:
+            await connection.reply("ERR Not in a game")
+            return
+        squares = connection.session.state.board.get_position_representation().replace("\n", "/")
+        await connection.reply(f"BOARD {squares}")
+
+    async def command_draw(self, connection, args):
+        session = connection.session
+        if session is None or session.state.is_done():
+            await connection.reply("ERR Not in a running game")
+            return
+        if session.state.offer_draw(connection.color):
+            await connection.reply("OK draw accepted")
+            self.push_result(session)
+        else:
+            await connection.reply("OK draw offered")
+            session.push(f"DRAWOFFER {connection.color}")
+
+    async def command_resign(self, connection, args):
+        session = connection.session
+        if session is None or session.state.is_done():
+            await connection.reply("ERR Not in a running game")
+            return
+        session.state.resign(connection.color)
+        await connection.reply("OK resigned")
+        self.push_result(session)
+
+    def join(self, session, connection, color):
+        session.players[color] = connection
+        connection.session = session
+        connection.color = color
+
+    #A player left, the game is removed when nobody is playing it anymore
+    def leave(self, connection):
+        session = connection.session
+        if session is None:
+            return
+        session.players[connection.color] = None
+        connection.session = None
+        if not session.state.is_done():
+            session.state.resign(connection.color)
+            self.push_result(session)
+        if all(player is None for player in session.players.values()):
+            self.games.pop(session.game_id, None)
+
+    def push_result(self, session):
+        if session.state.is_done() and not session.result_sent:
+            session.result_sent = True
+            session.push(f"RESULT {session.state.game_result} {session.state.termination}")
+
+    def schedule_engine(self, session):
+        if not session.engine_busy:
+            session.engine_busy = True
+            task = asyncio.create_task(self.play_engine_move(session))
+            self.engine_tasks.add(task)
+            task.add_done_callback(self.engine_tasks.discard)
+
+    async def play_engine_move(self, session):
+        state = session.state
+        try:
+            #The engine divides the time left on the clock, so it must be up to date
+            state.update_clock()
+            loop = asyncio.get_running_loop()
+            chosen_move = await loop.run_in_executor(self.pool, ENGINES[state.game_mode], state)
+        except Exception as error:
+            #A crashed worker or an engine bug must not leave the game waiting for a move that never comes:
+            #the computer plays the first legal move instead. A broken pool is replaced for the next moves
+            logger.exception("Engine failed in game %s, playing the first legal move", session.game_id)
+            if isinstance(error, BrokenProcessPool):
+                self.pool.shutdown(wait=False)
+                self.pool = ProcessPoolExecutor(self.engine_workers)
+            chosen_move = first_legal_move(state)
+        finally:
+            session.engine_busy = False
+        #The game may have ended while the engine was thinking
+        if state.is_done() or state.current_turn != session.computer_color:
+            return
+        color = state.current_turn
+        san = state.play_computer_move(*chosen_move) if chosen_move is not None else None
+        if san is None:
+            logger.error("Engine found no move in game %s", session.game_id)
+            state.resign(color)
+        else:
+            self.moves_played += 1
+            white_ms, black_ms = clock_millis(state)
+            session.push(f"MOVED {color} {san} {white_ms} {black_ms}")
+        self.push_result(session)
+
+    #The clocks of all games are checked regularly, so a player who doesn't move still loses on time
+    async def watch_clocks(self):
+        while True:
+            await asyncio.sleep(self.clock_interval)
+            for session in list(self.games.values()):
+                if not session.state.is_done():
+                    session.state.update_clock()
+                    self.push_result(session)
+
+
+async def serve(host, port, engine_workers):
+    game_server = GameServer(engine_workers)
+    server = await game_server.start(host, port)
+    logger.info("Serving on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+    try:
+        await server.serve_forever()
+    finally:
+        await game_server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host many headless chess games over a line based protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--workers", type=int, default=None, help="engine worker processes (default: cpu count)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.workers))
@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from archive import ArchiveReader, append_games, decode_start, encode_start, pgn_games
+from pgn import read_games, write_game
+from rules import Board, board_from_fen, board_to_fen, move_to_san
+
+PGN_PATH = os.path.join(os.path.dirname(__file__), '..', 'game.pgn')
+#Black to move with castling rights on one side only and an en passant capture
+FEN = "r3k2r/ppp2ppp/8/3pP3/8/8/PPP2PPP/R3K2R w Kq d6 3 12"
+FEN_MOVES = ['exd6', 'O-O-O', 'O-O', 'cxd6']
+
+
+def start_board():
+    board = Board()
+    board.setup_pieces()
+    return board
+
+
+def san_moves(game):
+    board = game.board.copy()
+    color = game.color
+    moves = []
+    for move in game.moves:
+        moves.append(move_to_san(board, move, color, move.promotion))
+        board.make_move(move)
+        color = 'black' if color == 'white' else 'white'
+    return moves
+
+
+def test_start_state_round_trip():
+    board, color, _ = board_from_fen(FEN)
+    decoded, decoded_color = decode_start(encode_start(board, color))
+    assert decoded_color == color
+    assert board_to_fen(decoded, decoded_color, 12) == FEN
+    assert decoded.zobrist_hash(color) == board.zobrist_hash(color)
+
+
+def test_games_round_trip(tmp_path):
+    path = str(tmp_path / 'games.cga')
+    game = next(read_games(PGN_PATH))
+    fen_board, color, _ = board_from_fen(FEN)
+    black_board, black, _ = board_from_fen(FEN.replace(' w ', ' b ').replace(' d6 ', ' - '))
+    assert append_games(path, [(start_board(), game.moves, game.result, 'white'),
+                               (fen_board, FEN_MOVES, '*', color)]) == 2
+    assert append_games(path, [(black_board, ['O-O-O', 'O-O'], '1/2-1/2', black)]) == 3
+    with ArchiveReader(path) as reader:
+        first, second, third = (reader.read_game(number) for number in range(3))
+    assert first.result == game.result and san_moves(first) == game.moves
+    assert second.color == 'white' and san_moves(second) == ['exd6', 'O-O-O', 'O-O', 'cxd6']
+    assert third.color == 'black' and third.result == '1/2-1/2' and san_moves(third) == ['O-O-O', 'O-O']
+
+
+def test_invalid_game_is_skipped(tmp_path):
+    path = str(tmp_path / 'games.cga')
+    append_games(path, [(start_board(), ['e4', 'e5'], '*', 'white')])
+    count = append_games(path, [(start_board(), ['e4', 'Ke3'], '*', 'white'),
+                                (start_board(), ['d4', 'd5'], '*', 'white')])
+    assert count == 2
+    with ArchiveReader(path) as reader:
+        assert [san_moves(reader.read_game(number)) for number in range(2)] == [['e4', 'e5'], ['d4', 'd5']]
+
+
+def test_pgn_game_with_fen(tmp_path):
+    pgn_path = tmp_path / 'fen.pgn'
+    pgn_path.write_text(f'[SetUp "1"]\n[FEN "{FEN}"]\n\n1. exd6 O-O-O 2. O-O cxd6 *\n\n'
+                        '[FEN "not a fen"]\n\n1. e4 *\n')
+    path = str(tmp_path / 'games.cga')
+    assert append_games(path, pgn_games([str(pgn_path)])) == 1
+    with ArchiveReader(path) as reader:
+        assert san_moves(reader.read_game(0)) == FEN_MOVES
+
+
+def test_write_game_numbers_from_fen(tmp_path):
+    fen = FEN.replace(' w ', ' b ')
+    pgn_path = tmp_path / 'written.pgn'
+    with open(pgn_path, 'w') as file:
+        write_game(file, ['O-O-O', 'O-O', 'Kb8'], {'FEN': fen}, '*', {0: 'comment'})
+    text = pgn_path.read_text()
+    assert '12... O-O-O {comment} 13. O-O Kb8 *' in text
+    game, = read_games(str(pgn_path))
+    assert game.moves == ['O-O-O', 'O-O', 'Kb8']
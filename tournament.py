@@ -0,0 +1,357 @@
+import argparse
+import logging
+import math
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from engine import MATE_BOUND, Searcher, SearchLimits, clock_limits
+from pgn import PgnGame, read_games, start_position, write_game
+from rules import START_FEN, Board, Clock, board_from_fen, board_to_fen, get_termination, move_to_san, play_san
+
+logger = logging.getLogger(__name__)
+
+#Self-play between two engine configurations to see if a change made the engine stronger or weaker.
+#Every opening is played twice with swapped colors, the games run in a process pool. The result is the Elo
+#difference of the first engine with its error margin and, with --sprt, a sequential probability ratio test
+#that stops the match as soon as the games are enough to accept or reject the change.
+
+#Short openings in standard notation, used when there is no opening file and no Chess960
+OPENINGS = [
+    "e4 e5 Nf3 Nc6 Bb5 a6",
+    "e4 e5 Nf3 Nc6 Bc4 Bc5",
+    "e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6",
+    "e4 c6 d4 d5 Nc3 dxe4 Nxe4",
+    "e4 e6 d4 d5 Nc3 Nf6",
+    "d4 d5 c4 e6 Nc3 Nf6",
+    "d4 d5 c4 c6 Nf3 Nf6",
+    "d4 Nf6 c4 e6 Nc3 Bb4",
+    "d4 Nf6 c4 g6 Nc3 Bg7 e4 d6",
+    "c4 e5 Nc3 Nf6 g3 d5",
+    "Nf3 d5 g3 Nf6 Bg2 e6",
+    "e4 d5 exd5 Qxd5 Nc3 Qa5",
+]
+
+#A game is adjudicated when both engines agree for this many plies that one side is winning
+RESIGN_SCORE = 1000
+RESIGN_PLIES = 8
+MAX_PLIES = 300
+
+RESULT_NAMES = {1.0: '1-0', 0.0: '0-1', 0.5: '1/2-1/2'}
+
+
+#Search settings of one side: the limits of every move (or a clock for the whole game) and the table size
+class EngineConfig:
+    def __init__(self, name, depth=None, nodes=None, movetime=None, table_size=1 << 20):
+        self.name = name
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.table_size = table_size
+
+    #"name=new,depth=4,nodes=5000,movetime=100,table=100000"
+    @classmethod
+    def parse(cls, text, default_name):
+        config = cls(default_name)
+        for item in text.split(','):
+            key, _, value = item.partition('=')
+            key = key.strip()
+            if key == 'name':
+                config.name = value
+            elif key in ('depth', 'nodes', 'movetime'):
+                setattr(config, key, int(value))
+            elif key == 'table':
+                config.table_size = int(value)
+            elif key:
+                raise ValueError(f"Unknown engine setting {key}")
+        return config
+
+    def limits(self, clock, move_number):
+        if clock is not None:
+            limits = clock_limits(clock, move_number)
+        else:
+            limits = SearchLimits()
+        limits.depth = self.depth
+        limits.nodes = self.nodes
+        limits.movetime = self.movetime
+        if clock is None and self.depth is None and self.nodes is None and self.movetime is None:
+            limits.nodes = 2000
+        return limits
+
+
+class GameRecord:
+    def __init__(self, opening, first_white):
+        self.opening = opening
+        self.first_white = first_white
+        #1, 0.5 or 0 from the view of white
+        self.result = None
+        self.termination = None
+        self.moves = []
+        #Nodes and seconds of the search of the first and second engine
+        self.nodes = [0, 0]
+        self.time = [0.0, 0.0]
+
+    #Points of the first engine
+    def score(self):
+        return self.result if self.first_white else 1.0 - self.result
+
+
+#Runs in a worker process: one game from the FEN of the opening. task is (fen, configs, first_white, time_control, max_plies)
+def play_game(task):
+    fen, configs, first_white, time_control, max_plies = task
+    record = GameRecord(fen, first_white)
+    board, color, move_number = board_from_fen(fen)
+    searchers = [Searcher(table_size=config.table_size) for config in configs]
+    clock = None
+    if time_control is not None:
+        clock = Clock(time_control[0] / 60, time_control[1])
+        clock.current_player = color
+        clock.start_clock()
+    #Scores from the view of white of the last moves, for the adjudication
+    scores = []
+    while True:
+        result, termination = get_termination(board, color, clock)
+        if result is not None:
+            record.result = {'white_win': 1.0, 'black_win': 0.0, 'draw': 0.5}[result]
+            record.termination = termination
+            break
+        if len(record.moves) >= max_plies:
+            record.result, record.termination = 0.5, 'adjudication'
+            break
+        side = 0 if (color == 'white') == first_white else 1
+        start = time.perf_counter()
+        search = searchers[side].search(board, color, configs[side].limits(clock, move_number))
+        elapsed = time.perf_counter() - start
+        record.nodes[side] += search.nodes
+        record.time[side] += elapsed
+        if clock is not None:
+            clock.update_clock(elapsed * 1000)
+            if clock.white_time <= 0 or clock.black_time <= 0:
+                continue
+            clock.switch_player()
+        scores.append(search.score if color == 'white' else -search.score)
+        if len(scores) >= RESIGN_PLIES and abs(scores[-1]) < MATE_BOUND:
+            last = scores[-RESIGN_PLIES:]
+            if all(score >= RESIGN_SCORE for score in last) or all(score <= -RESIGN_SCORE for score in last):
+                record.result, record.termination = (1.0 if last[-1] > 0 else 0.0), 'adjudication'
+                break
+        move = search.best_move
+        record.moves.append(move_to_san(board, move, color, move.promotion))
+        board.make_move(move)
+        if color == 'black':
+            move_number += 1
+        color = 'black' if color == 'white' else 'white'
+    return record
+
+
+#Elo difference for an expected score between 0 and 1
+def elo_difference(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+#Elo difference and its 95% error margin from the numbers of wins, draws and losses
+def elo_estimate(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, float('inf')
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return elo_difference(score), (elo_difference(score + margin) - elo_difference(score - margin)) / 2
+
+
+#Sequential probability ratio test of H0: elo = elo0 against H1: elo = elo1 with the error rates alpha and beta.
+#The log likelihood ratio uses the normal approximation of the mean score of the games
+class SPRT:
+    def __init__(self, elo0=0.0, elo1=10.0, alpha=0.05, beta=0.05):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self, wins, draws, losses):
+        games = wins + draws + losses
+        if games == 0:
+            return 0.0
+        score = (wins + draws / 2) / games
+        variance = (wins + draws / 4) / games - score ** 2
+        if variance <= 0:
+            #All games had the same result, the variance is not known yet
+            return 0.0
+        score0 = expected_score(self.elo0)
+        score1 = expected_score(self.elo1)
+        return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+    #'H1' (the change is better by elo1), 'H0' (not better than elo0) or None to play on
+    def status(self, wins, draws, losses):
+        llr = self.llr(wins, draws, losses)
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+
+#Start positions as FEN: the openings of a PGN file (the first plies of every game), random Chess960 positions
+#or the built-in openings
+def start_positions(count, pgn_path=None, opening_plies=8, chess960=False, seed=None):
+    if chess960:
+        random.seed(seed)
+        positions = []
+        for _ in range(count):
+            board = Board()
+            board.setup_fischer_random()
+            positions.append(board_to_fen(board, 'white'))
+        return positions
+    if pgn_path is not None:
+        games = list(read_games(pgn_path))
+    else:
+        games = [PgnGame(moves=line.split()) for line in OPENINGS]
+    positions = []
+    for game in games:
+        try:
+            board, color = start_position(game)
+        except ValueError as error:
+            logger.warning("Opening skipped: %s", error)
+            continue
+        moves = game.moves[:opening_plies]
+        for san in moves:
+            success, error_message = play_san(board, san, color)
+            if not success:
+                logger.warning("Opening stopped at %s: %s", san, error_message)
+                break
+            color = 'black' if color == 'white' else 'white'
+        positions.append(board_to_fen(board, color, len(moves) // 2 + 1))
+    if not positions:
+        raise ValueError("No openings")
+    return [positions[index % len(positions)] for index in range(count)]
+
+
+class MatchResult:
+    def __init__(self, configs):
+        self.configs = configs
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.terminations = {}
+        self.nodes = [0, 0]
+        self.time = [0.0, 0.0]
+        self.records = []
+        self.elapsed = 0.0
+        #Decision of the SPRT, None without a test or when the games were not enough
+        self.decision = None
+
+    def add(self, record):
+        score = record.score()
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.terminations[record.termination] = self.terminations.get(record.termination, 0) + 1
+        for side in range(2):
+            self.nodes[side] += record.nodes[side]
+            self.time[side] += record.time[side]
+        self.records.append(record)
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def nodes_per_second(self, side):
+        return self.nodes[side] / self.time[side] if self.time[side] > 0 else 0.0
+
+
+#Play the games in a process pool. The games are submitted in pairs (one opening with both colors), with an
+#SPRT no more games are started once it has a decision
+def run_match(configs, positions, workers=None, time_control=None, max_plies=MAX_PLIES, sprt=None):
+    match = MatchResult(configs)
+    tasks = [(fen, configs, first_white, time_control, max_plies) for fen in positions for first_white in (True, False)]
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        next_task = 0
+        running = set()
+        decision = None
+        while running or (next_task < len(tasks) and decision is None):
+            #A few more games than workers keep every worker busy without starting many that are not needed
+            while next_task < len(tasks) and decision is None and len(running) < 2 * workers:
+                running.add(executor.submit(play_game, tasks[next_task]))
+                next_task += 1
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                match.add(future.result())
+            if sprt is not None and decision is None:
+                decision = sprt.status(match.wins, match.draws, match.losses)
+            if match.games() % 10 == 0 or decision is not None:
+                elo, margin = elo_estimate(match.wins, match.draws, match.losses)
+                logger.info("%d games, +%d =%d -%d, Elo %+.1f +- %.1f%s", match.games(), match.wins, match.draws,
+                            match.losses, elo, margin, f", SPRT {decision}" if decision else "")
+    match.elapsed = time.perf_counter() - start
+    match.decision = decision
+    return match
+
+
+def write_games(path, match, chess960=False):
+    with open(path, 'w') as file:
+        for number, record in enumerate(match.records, 1):
+            white, black = match.configs if record.first_white else reversed(match.configs)
+            result = RESULT_NAMES[record.result]
+            headers = {'Event': 'tournament.py', 'Round': str(number), 'White': white.name, 'Black': black.name,
+                       'Result': result, 'Termination': record.termination}
+            if record.opening != START_FEN:
+                headers['SetUp'] = '1'
+                headers['FEN'] = record.opening
+            if chess960:
+                headers['Variant'] = 'Chess960'
+            write_game(file, record.moves, headers, result)
+
+
+def parse_time_control(text):
+    seconds, _, increment = text.partition('+')
+    return float(seconds), float(increment or 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play games between two engine configurations and compare their strength")
+    parser.add_argument('--first', default='', help="settings of the tested engine, e.g. name=new,nodes=4000")
+    parser.add_argument('--second', default='', help="settings of the reference engine, e.g. name=old,nodes=2000")
+    parser.add_argument('--games', type=int, default=100, help="number of games, played in pairs with swapped colors")
+    parser.add_argument('--tc', default=None, help="time control in seconds per game and increment, e.g. 10+0.1")
+    parser.add_argument('--openings', default=None, help="PGN file whose games start the games")
+    parser.add_argument('--opening-plies', type=int, default=8)
+    parser.add_argument('--chess960', action='store_true', help="start from random Chess960 positions")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help="longer games are adjudicated as a draw")
+    parser.add_argument('--sprt', type=float, nargs=2, default=None, metavar=('ELO0', 'ELO1'),
+                        help="stop when the test accepts elo0 or elo1 (alpha = beta = 0.05)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--pgn', default=None, help="write the games to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    configs = (EngineConfig.parse(args.first, 'first'), EngineConfig.parse(args.second, 'second'))
+    positions = start_positions((args.games + 1) // 2, args.openings, args.opening_plies, args.chess960, args.seed)
+    time_control = parse_time_control(args.tc) if args.tc else None
+    sprt = SPRT(*args.sprt) if args.sprt else None
+    match = run_match(configs, positions, args.workers, time_control, args.max_plies, sprt)
+    if args.pgn:
+        write_games(args.pgn, match, args.chess960)
+
+    elo, margin = elo_estimate(match.wins, match.draws, match.losses)
+    print(f"{configs[0].name} vs {configs[1].name}: {match.games()} games in {match.elapsed:.1f}s, "
+          f"+{match.wins} ={match.draws} -{match.losses}")
+    print(f"Elo difference {elo:+.1f} +- {margin:.1f}")
+    if sprt is not None:
+        llr = sprt.llr(match.wins, match.draws, match.losses)
+        print(f"SPRT [{sprt.elo0:g}, {sprt.elo1:g}]: LLR {llr:.2f} ({sprt.lower:.2f}, {sprt.upper:.2f}), "
+              f"{match.decision or 'no decision'}")
+    print(', '.join(f"{name}: {count}" for name, count in sorted(match.terminations.items())))
+    for side, config in enumerate(configs):
+        print(f"{config.name}: {match.nodes_per_second(side):.0f} nodes/sec")
@@ -0,0 +1,212 @@
+import logging
+import sys
+import threading
+
+from engine import MATE_BOUND, MATE_SCORE, Searcher, SearchLimits
+from rules import START_FEN, board_from_fen, move_to_uci, parse_uci_move
+
+logger = logging.getLogger(__name__)
+
+#UCI (Universal Chess Interface) front-end for the engine, it reads commands from stdin and writes to stdout
+#and does not import pygame. Tournament managers and scripts can use it like any other engine:
+#  python uci.py
+#Supported: uci, isready, ucinewgame, setoption (Hash, Threads, UCI_Chess960), position (startpos or fen, with
+#moves), go (depth, nodes, movetime, wtime, btime, winc, binc, movestogo, infinite, ponder), stop, ponderhit, quit.
+#The search runs in a thread, so stop and isready are answered while it searches.
+
+ENGINE_NAME = "Chess Program"
+ENGINE_AUTHORS = "Liv Richter, Bhavya Sharma, Oliver Baumgartner"
+
+#Rough memory of one entry of the transposition table in bytes, a Python dict entry with a tuple
+TABLE_ENTRY_BYTES = 300
+DEFAULT_HASH = 64
+MAX_HASH = 4096
+
+GO_PARAMETERS = ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo')
+
+
+def format_score(score):
+    if abs(score) >= MATE_BOUND:
+        plies = MATE_SCORE - abs(score)
+        return f"mate {(plies + 1) // 2 if score > 0 else -(plies // 2)}"
+    return f"cp {score}"
+
+
+class UciEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.hash_size = DEFAULT_HASH
+        self.searcher = self.create_searcher()
+        self.chess960 = False
+        self.board, self.color, self.move_number = board_from_fen(START_FEN)
+        self.thread = None
+        #Limits of a "go ponder", used when the ponder hit comes
+        self.ponder_limits = None
+        #Set when the best move of an infinite or ponder search may be sent
+        self.release = threading.Event()
+
+    def create_searcher(self):
+        searcher = Searcher(table_size=self.hash_size * 1024 * 1024 // TABLE_ENTRY_BYTES)
+        searcher.report = self.send_info
+        return searcher
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def send_info(self, result):
+        nps = int(result.nodes_per_second())
+        pv = ' '.join(move_to_uci(move, self.chess960) for move in result.pv)
+        self.send(f"info depth {result.depth} score {format_score(result.score)} nodes {result.nodes} nps {nps} "
+                  f"time {int(result.elapsed * 1000)} pv {pv}")
+
+    #Handle one command line, returns False for quit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHORS}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH} min 1 max {MAX_HASH}")
+            #The search is pure Python, more threads would only wait for each other on the interpreter lock
+            self.send("option name Threads type spin default 1 min 1 max 1")
+            self.send("option name Ponder type check default false")
+            self.send("option name UCI_Chess960 type check default false")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'ucinewgame':
+            self.stop()
+            self.searcher.clear()
+            self.board, self.color, self.move_number = board_from_fen(START_FEN)
+        elif command == 'setoption':
+            self.set_option(args)
+        elif command == 'position':
+            self.stop()
+            self.set_position(args)
+        elif command == 'go':
+            self.stop()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            if self.thread is not None and self.ponder_limits is not None:
+                self.searcher.ponderhit(self.ponder_limits, self.color)
+                self.ponder_limits = None
+                self.release.set()
+        elif command == 'quit':
+            self.stop()
+            return False
+        else:
+            logger.warning("Unknown command: %s", line.strip())
+        return True
+
+    def set_option(self, args):
+        #setoption name <name> [value <value>], the name can have spaces
+        if 'name' not in args:
+            return
+        value_index = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:value_index]).lower()
+        value = ' '.join(args[value_index + 1:])
+        if name == 'hash':
+            self.stop()
+            try:
+                self.hash_size = max(1, min(MAX_HASH, int(value)))
+            except ValueError:
+                self.send(f"info string Invalid Hash value {value}")
+                return
+            self.searcher = self.create_searcher()
+        elif name == 'threads':
+            if value != '1':
+                self.send("info string Only one search thread is supported")
+        elif name == 'uci_chess960':
+            self.chess960 = value.lower() == 'true'
+        elif name != 'ponder':
+            self.send(f"info string Unknown option {name}")
+
+    #position startpos|fen <fen> [moves <move>...]
+    def set_position(self, args):
+        moves_index = args.index('moves') if 'moves' in args else len(args)
+        try:
+            if args and args[0] == 'fen':
+                board, color, move_number = board_from_fen(' '.join(args[1:moves_index]))
+            else:
+                board, color, move_number = board_from_fen(START_FEN)
+        except ValueError as error:
+            self.send(f"info string {error}")
+            return
+        for text in args[moves_index + 1:]:
+            move = parse_uci_move(board, text, color, self.chess960)
+            if move is None:
+                self.send(f"info string Illegal move {text}")
+                break
+            board.make_move(move)
+            if color == 'black':
+                move_number += 1
+            color = 'black' if color == 'white' else 'white'
+        self.board, self.color, self.move_number = board, color, move_number
+
+    def go(self, args):
+        values = {}
+        for index, word in enumerate(args[:-1]):
+            if word in GO_PARAMETERS:
+                try:
+                    values[word] = int(args[index + 1])
+                except ValueError:
+                    self.send(f"info string Invalid value for {word}")
+        ponder = 'ponder' in args
+        limits = SearchLimits(depth=values.get('depth'), nodes=values.get('nodes'), movetime=values.get('movetime'),
+                              wtime=values.get('wtime'), btime=values.get('btime'), winc=values.get('winc', 0),
+                              binc=values.get('binc', 0), movestogo=values.get('movestogo'), move_number=self.move_number)
+        #A plain "go" searches until stop like "go infinite"
+        infinite = 'infinite' in args or not values
+        self.ponder_limits = limits if ponder else None
+        if ponder:
+            self.searcher.start_ponder()
+        else:
+            self.searcher.ponder_limits = None
+        self.release.clear()
+        if not (infinite or ponder):
+            self.release.set()
+        self.thread = threading.Thread(target=self.run_search, args=(self.board.copy(), self.color, limits, ponder),
+                                       daemon=True)
+        self.thread.start()
+
+    def run_search(self, board, color, limits, ponder):
+        result = self.searcher.search(board, color, limits, ponder=ponder)
+        #The best move of an infinite or ponder search is only sent after stop or ponderhit
+        self.release.wait()
+        if result.best_move is None:
+            self.send("bestmove 0000")
+            return
+        line = f"bestmove {move_to_uci(result.best_move, self.chess960)}"
+        if len(result.pv) > 1:
+            line += f" ponder {move_to_uci(result.pv[1], self.chess960)}"
+        self.send(line)
+
+    def stop(self):
+        if self.thread is not None:
+            self.release.set()
+            #The search clears the stop flag when it starts, so it is set until the thread has ended
+            while self.thread.is_alive():
+                self.searcher.stop()
+                self.thread.join(0.05)
+            self.thread = None
+            self.ponder_limits = None
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format="%(message)s")
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()